@@ -0,0 +1,222 @@
+# fix division problem:
+from __future__ import division
+
+# Compact pool of agents for simulation: per-agent states in
+# arrays, free-list (deque, longest idle agent is taken first)
+# for O(1) acquire/release, heap of busy-until times for
+# event-driven release and per-agent time accounting updated
+# incrementally on every state change.
+
+import heapq
+from array import array
+from collections import deque
+
+class EAgentPoolError(Exception):
+    "Invalid operation with agent pool"
+    pass
+
+# states of agent:
+IDLE, BUSY, WRAPUP, OFFLINE = 0, 1, 2, 3
+STATES = ('idle', 'busy', 'wrapup', 'offline')
+
+class AgentPool(object):
+    """
+    Pool of agents with indexes 0..size-1.
+    speeds - optional handling-time factors of agents (service
+    time of agent i is multiplied by speeds[i]).
+
+    >>> pool = AgentPool(3, speeds=[1.0, 1.0, 2.0])
+    >>> a = pool.acquire(0)
+    >>> pool.hold(a, 30).acquire(10)
+    1
+    >>> pool.idle, pool.busy, pool.next_release()
+    (1, 2, 30)
+    >>> pool.wrapup(a, 30, 5).advance(35)
+    [0]
+    >>> pool.release(1, 40).idle
+    3
+    >>> pool.acquire(50) # longest idle agent first
+    2
+    >>> round(pool.occupancy(0, 60), 3), pool.calls[0]
+    (0.5, 1)
+    """
+
+    def __init__(self, size, speeds=None, now=0):
+        if speeds is not None and len(speeds) != size:
+            raise EAgentPoolError('Number of speeds must match size of pool!')
+        self.size = size
+        self.states = array('B', [IDLE]) * size
+        self.speeds = array('d', speeds if speeds is not None else [1.0] * size)
+        # busy-until time of busy (or wrap-up) agent:
+        self.until = array('d', [0.0]) * size
+        # accumulated time per state (busy, idle, wrapup) and number of calls:
+        self.busy_time = array('d', [0.0]) * size
+        self.idle_time = array('d', [0.0]) * size
+        self.wrapup_time = array('d', [0.0]) * size
+        self.calls = array('l', [0]) * size
+        # time of the last state change:
+        self._since = array('d', [now]) * size
+        self._free = deque(xrange(size))
+        # (until, agent), entries of released agents are dropped lazily:
+        self._heap = []
+        self._offline = 0
+
+    @property
+    def idle(self):
+        "Number of idle agents"
+        return len(self._free)
+
+    @property
+    def busy(self):
+        "Number of busy agents (including wrap-up)"
+        return self.size - len(self._free) - self._offline
+
+    def _account(self, agent, now, state):
+        "Accumulate time of current state of agent and switch to new state"
+        elapsed = now - self._since[agent]
+        current = self.states[agent]
+        if current == BUSY:
+            self.busy_time[agent] += elapsed
+        elif current == IDLE:
+            self.idle_time[agent] += elapsed
+        elif current == WRAPUP:
+            self.wrapup_time[agent] += elapsed
+        self._since[agent] = now
+        self.states[agent] = state
+
+    def _prune(self):
+        "Drop heap entries of agents released explicitly"
+        heap, states, until = self._heap, self.states, self.until
+        while heap:
+            t, agent = heap[0]
+            if states[agent] in (BUSY, WRAPUP) and until[agent] == t:
+                break
+            heapq.heappop(heap)
+
+    def acquire(self, now, until=None):
+        "Take longest idle agent, return its index (None if all agents are busy)"
+        if not self._free:
+            return None
+        agent = self._free.popleft()
+        self._account(agent, now, BUSY)
+        self.calls[agent] += 1
+        if until is not None:
+            self.hold(agent, until)
+        return agent
+
+    def assign(self, agent, now):
+        "Next call of busy (or wrap-up) agent without return to the free-list"
+        if self.states[agent] not in (BUSY, WRAPUP):
+            raise EAgentPoolError('Agent {} is not busy!'.format(agent))
+        self._account(agent, now, BUSY)
+        self.calls[agent] += 1
+        self._prune()
+        return self # for chaining
+
+    def hold(self, agent, until):
+        "Set busy-until time of busy agent"
+        self.until[agent] = until
+        heapq.heappush(self._heap, (until, agent))
+        return self # for chaining
+
+    def wrapup(self, agent, now, duration):
+        "Switch busy agent to wrap-up for duration"
+        if self.states[agent] != BUSY:
+            raise EAgentPoolError('Agent {} is not busy!'.format(agent))
+        self._account(agent, now, WRAPUP)
+        self.hold(agent, now + duration)
+        self._prune()
+        return self # for chaining
+
+    def release(self, agent, now):
+        "Return busy (or wrap-up) agent to the free-list"
+        if self.states[agent] not in (BUSY, WRAPUP):
+            raise EAgentPoolError('Agent {} is not busy!'.format(agent))
+        self._account(agent, now, IDLE)
+        self._free.append(agent)
+        self._prune()
+        return self # for chaining
+
+    def next_release(self):
+        "Earliest busy-until time (None if no agent holds until known time)"
+        self._prune()
+        return self._heap[0][0] if self._heap else None
+
+    def advance(self, now):
+        "Release agents with busy-until time not later than now, return their indexes"
+        released = []
+        heap, until = self._heap, self.until
+        self._prune()
+        while heap and heap[0][0] <= now:
+            t, agent = heapq.heappop(heap)
+            if self.states[agent] in (BUSY, WRAPUP) and until[agent] == t:
+                self._account(agent, t, IDLE)
+                self._free.append(agent)
+                released.append(agent)
+        return released
+
+    def setoffline(self, agent, now):
+        "Remove idle agent from the pool (logout)"
+        if self.states[agent] != IDLE:
+            raise EAgentPoolError('Agent {} is not idle!'.format(agent))
+        self._free.remove(agent)
+        self._account(agent, now, OFFLINE)
+        self._offline += 1
+        return self # for chaining
+
+    def setonline(self, agent, now):
+        "Return offline agent to the pool (login)"
+        if self.states[agent] != OFFLINE:
+            raise EAgentPoolError('Agent {} is not offline!'.format(agent))
+        self._account(agent, now, IDLE)
+        self._free.append(agent)
+        self._offline -= 1
+        return self # for chaining
+
+    def times(self, agent, now):
+        "Busy, idle and wrap-up time of agent up to now (including current state)"
+        busy, idle, wrapup = self.busy_time[agent], self.idle_time[agent], self.wrapup_time[agent]
+        elapsed = now - self._since[agent]
+        state = self.states[agent]
+        if state == BUSY:
+            busy += elapsed
+        elif state == IDLE:
+            idle += elapsed
+        elif state == WRAPUP:
+            wrapup += elapsed
+        return busy, idle, wrapup
+
+    def occupancy(self, agent, now):
+        "Busy time / logged time of agent up to now"
+        busy, idle, wrapup = self.times(agent, now)
+        logged = busy + idle + wrapup
+        return busy / logged if logged else 0.0
+
+    def summary(self, now):
+        """
+        Pool-wide metrics: occupancy spread and fairness of load
+        (Jain's index of busy time: 1 - equal load).
+        """
+        occupancy = [self.occupancy(agent, now) for agent in xrange(self.size)]
+        busy = [self.times(agent, now)[0] for agent in xrange(self.size)]
+        total, squares = sum(busy), sum(b * b for b in busy)
+        return {
+            'agents': self.size,
+            'idle': self.idle,
+            'busy': self.busy,
+            'calls': sum(self.calls),
+            'occupancy_mean': sum(occupancy) / self.size if self.size else 0,
+            'occupancy_min': min(occupancy) if occupancy else 0,
+            'occupancy_max': max(occupancy) if occupancy else 0,
+            'fairness': total * total / (self.size * squares) if squares else 1.0,
+        }
+
+    def __str__(self):
+        return 'AgentPool: agents: {}, idle: {}, busy: {}'.format(self.size, self.idle, self.busy)
+
+    def __repr__(self):
+        return self.__str__()
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,249 @@
+# fix division problem:
+from __future__ import division
+
+# Multi-day / multi-file log analytics: rows are partitioned
+# by day, agent and/or campaign (logs with campaign column);
+# files are split into chunks of lines, partitions of every
+# chunk are computed in parallel and rolled up into the total.
+#
+# Usage:
+# analytics.py [--by=day,agent,campaign] [--processes=<n>]
+#              [--chunk=<megabytes>] [--format=json|csv|text]
+#              <call_log.csv> [...]
+
+import sys
+
+import calllog
+import report
+
+class EAnalyticsError(Exception):
+    "Generic error in log analytics"
+    pass
+
+# partition fields: name -> column of decoded row
+PARTITIONS = {
+    'day': 'day',
+    'agent': 'agent_name',
+    'campaign': 'campaign',
+}
+# columns computed by decoding (not present in log header):
+DECODED = ('day',)
+
+# size of chunk of file processed by single task (bytes):
+CHUNK_SIZE = 32 * 1024 * 1024
+
+class Aggregate(object):
+    """
+    Mergeable aggregates of log rows.
+    Uptime is computed per day (from full timestamps)
+    and summed, so logs crossing midnight or spanning
+    several days are handled correctly.
+
+    >>> a = Aggregate()
+    >>> rows = [
+    ...     {'day': '2015-03-02', 'agent_name': 'a1', 'call_timestamp': 100, 'call_duration': 60},
+    ...     {'day': '2015-03-02', 'agent_name': 'a2', 'call_timestamp': 200, 'call_duration': None},
+    ...     {'day': '2015-03-03', 'agent_name': 'a1', 'call_timestamp': 86500, 'call_duration': 5},
+    ...     {'day': '2015-03-03', 'agent_name': 'a1', 'call_timestamp': 86600, 'call_duration': 20},
+    ... ]
+    >>> for row in rows[:2]: a = a.add(row)
+    >>> b = Aggregate()
+    >>> for row in rows[2:]: b = b.add(row)
+    >>> a.merge(b)
+    Aggregate: calls: 4, answered: 2, uptime: 200, agents: 2
+    >>> a.man_time, a.service_time
+    (300, 80)
+    """
+
+    # calls longer than threshold are counted as answered (see parse_log)
+    answered_threshold = 10
+
+    def __init__(self):
+        self.calls_total = 0
+        self.calls_answered = 0
+        self.service_time = 0
+        # day -> [first timestamp, last timestamp, set of agents]
+        self.days = {}
+
+    def add(self, row):
+        "Count decoded row"
+        timestamp = row['call_timestamp']
+        if timestamp is None:
+            return self
+        self.calls_total += 1
+        duration = row['call_duration']
+        if duration and duration > self.answered_threshold:
+            self.calls_answered += 1
+            self.service_time += duration
+        day = row['day']
+        try:
+            span = self.days[day]
+        except KeyError:
+            span = self.days[day] = [timestamp, timestamp, set()]
+        if timestamp < span[0]:
+            span[0] = timestamp
+        elif timestamp > span[1]:
+            span[1] = timestamp
+        span[2].add(row['agent_name'])
+        return self # for chaining
+
+    def merge(self, other):
+        "Add aggregates of other object"
+        self.calls_total += other.calls_total
+        self.calls_answered += other.calls_answered
+        self.service_time += other.service_time
+        for day, (first, last, agents) in other.days.iteritems():
+            if day in self.days:
+                span = self.days[day]
+                span[0] = min(span[0], first)
+                span[1] = max(span[1], last)
+                span[2].update(agents)
+            else:
+                self.days[day] = [first, last, set(agents)]
+        return self # for chaining
+
+    @property
+    def uptime(self):
+        "Sum of daily uptimes (seconds)"
+        return sum(last - first for first, last, agents in self.days.itervalues())
+
+    @property
+    def agents(self):
+        "Number of distinct agents"
+        names = set()
+        for first, last, agents in self.days.itervalues():
+            names.update(agents)
+        return len(names)
+
+    @property
+    def man_time(self):
+        "Sum of daily uptime multiplied by number of agents of the day"
+        return sum((last - first) * len(agents) for first, last, agents in self.days.itervalues())
+
+    def summary(self):
+        "Return metrics as dict"
+        uptime, man_time = self.uptime, self.man_time
+        def ratio(a, b):
+            try:
+                return a / b
+            except ZeroDivisionError:
+                return 0
+        return {
+            'days': len(self.days),
+            'agents_total': self.agents,
+            'uptime': uptime,
+            'man_time_total': man_time,
+            'service_time': self.service_time,
+            'idle_time_total': man_time - self.service_time,
+            'idle_time_percent': ratio(man_time - self.service_time, man_time) * 100,
+            'calls_total': self.calls_total,
+            'calls_answered': self.calls_answered,
+            'call_rate': ratio(self.calls_total, uptime),
+            'answered_call_rate': ratio(self.calls_answered, uptime),
+            'connection_rate': ratio(self.calls_answered, self.calls_total),
+            'average_call_duration': ratio(self.service_time, self.calls_answered),
+        }
+
+    def __str__(self):
+        return 'Aggregate: calls: {}, answered: {}, uptime: {}, agents: {}' \
+            .format(self.calls_total, self.calls_answered, self.uptime, self.agents)
+
+    def __repr__(self):
+        return self.__str__()
+
+def partitionkey(row, by):
+    """
+    Return text key of partition for row, e.g. 'day=2015-03-02/agent=a1'.
+    >>> partitionkey({'day': '2015-03-02', 'agent_name': 'a1'}, ('day', 'agent', 'campaign'))
+    'day=2015-03-02/agent=a1/campaign=None'
+    """
+    return '/'.join('{}={}'.format(name, row.get(PARTITIONS[name])) for name in by)
+
+def analyze_file(args):
+    """
+    Return dict: partition key -> Aggregate for chunk of file
+    (byte range, see calllog.chunks); used by worker processes
+    """
+    filename, by, start, end = args
+    partitions = {}
+    for row in calllog.iterchunk(filename, start, end):
+        key = partitionkey(row, by)
+        try:
+            aggregate = partitions[key]
+        except KeyError:
+            aggregate = partitions[key] = Aggregate()
+        aggregate.add(row)
+    return partitions
+
+def analyze(filenames, by=('day',), processes=None, chunk_size=CHUNK_SIZE):
+    """
+    Compute aggregates for partitions of all files (chunks of
+    files are processed in parallel), return (partitions, rollup).
+    """
+    for name in by:
+        if name not in PARTITIONS:
+            raise EAnalyticsError('Unknown partition "{}", use: {}' \
+                .format(name, ', '.join(sorted(PARTITIONS))))
+    tasks = []
+    for filename in filenames:
+        try:
+            header = calllog.readheader(filename)
+        except EnvironmentError as e:
+            raise EAnalyticsError('Cannot read log "{}": {}'.format(filename, e))
+        for name in by:
+            column = PARTITIONS[name]
+            if column not in header and column not in DECODED:
+                raise EAnalyticsError('Log "{}" has no column "{}" (partition "{}")!' \
+                    .format(filename, column, name))
+        tasks.extend((filename, tuple(by), start, end)
+            for start, end in calllog.chunks(filename, chunk_size))
+    if processes == 1 or len(tasks) <= 1:
+        results = map(analyze_file, tasks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(analyze_file, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    partitions = {}
+    rollup = Aggregate()
+    for result in results:
+        for key, aggregate in result.iteritems():
+            rollup.merge(aggregate)
+            if key in partitions:
+                partitions[key].merge(aggregate)
+            else:
+                partitions[key] = aggregate
+    return partitions, rollup
+
+def main(argv):
+    try:
+        options, filenames = report.parseargs(argv,
+            {'by': 'day', 'processes': None, 'chunk': '32', 'format': 'json'})
+        if not filenames:
+            raise EAnalyticsError('No log files specified!')
+        processes = int(options['processes']) if options['processes'] else None
+        chunk_size = int(float(options['chunk']) * 1024 * 1024)
+        if chunk_size <= 0:
+            raise EAnalyticsError('Size of chunk must be positive!')
+        partitions, rollup = analyze(filenames, options['by'].split(','), processes, chunk_size)
+    except ValueError as e:
+        print 'Invalid number: {}'.format(e)
+        return 2
+    except (report.EReportError, EAnalyticsError) as e:
+        print e
+        return 2
+    report.emit({
+        'partitions': dict((key, aggregate.summary()) for key, aggregate in partitions.iteritems()),
+        'total': rollup.summary()
+    }, options['format'])
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv))
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,508 @@
+# fix division problem:
+from __future__ import division
+
+# Benchmark suite for hot paths: solver ticks, environments,
+# statistics, log parsing and simulation.
+# Results are written as JSON and can be compared with
+# a baseline file; regressions and scenarios over their
+# time budget are reported (exit code 1).
+#
+# Usage:
+# bench.py [--scale=<float>] [--repeat=<n>] [--output=<file.json>]
+#          [--baseline=<file.json>] [--tolerance=<float>] [scenario ...]
+# (all scenarios are run by default)
+# bench.py --doctest [-v] (run doctests of module)
+
+import os
+import sys
+import csv
+import json
+import random
+import shutil
+import tempfile
+import platform
+import py_compile
+import subprocess
+from timeit import default_timer as timer
+
+import dctr
+import calllog
+import statistics
+import agentpool
+import timerwheel
+import recorder
+import sharedstate
+import codec
+import leads
+import parse_log
+
+SEED = 20150302
+
+##############################################
+# Synthetic data generators
+##############################################
+
+def synthetic_durations(n, seed=SEED):
+    "Call durations (seconds), roughly lognormal like real calls"
+    rng = random.Random(seed)
+    return [int(rng.lognormvariate(3.6, 1.0)) + 1 for i in xrange(n)]
+
+def synthetic_environments(n, seed=SEED):
+    "Sequence of solver inputs for n ticks (all branches of PIController)"
+    rng = random.Random(seed)
+    buff = []
+    for i in xrange(n):
+        calls_total = rng.randint(0, 3000)
+        calls_answered = rng.randint(0, calls_total)
+        calls_served = calls_answered - rng.randint(0, calls_answered // 30 + 1)
+        buff.append((rng.randint(0, 50), calls_total, calls_answered,
+            max(0, calls_served), rng.randint(0, 3600)))
+    return buff
+
+def synthetic_log(filename, rows, seed=SEED, agents=50):
+    "Write call log with given number of rows"
+    rng = random.Random(seed)
+    def datestr(day, t):
+        return '2015-03-{:02d} {:02d}:{:02d}:{:02d}'.format(
+            day, t // 3600, t % 3600 // 60, t % 60)
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['agent_name', 'classification', 'call_time', 'talk_time', 'call_duration'])
+        day, t = 1, 9 * 3600
+        for i in xrange(rows):
+            t += rng.randint(0, 3)
+            if t >= 21 * 3600:
+                day, t = day % 28 + 1, 9 * 3600
+            if rng.random() < 0.3:
+                duration = int(rng.lognormvariate(3.6, 1.0)) + 1
+                talk_time = datestr(day, min(t + rng.randint(5, 20), 86399))
+                duration = '{:02d}:{:02d}:{:02d}'.format(
+                    duration // 3600 % 24, duration % 3600 // 60, duration % 60)
+                classification = ''
+            else:
+                talk_time, duration, classification = '', '', 'No answer'
+            writer.writerow(['agent{}'.format(rng.randint(1, agents)),
+                classification, datestr(day, t), talk_time, duration])
+
+##############################################
+# Scenarios
+##############################################
+# Every scenario takes size "n", prepares data and returns
+# function to measure; the function returns number of operations
+# (optional "cleanup" attribute of function is called at the end).
+
+def scenario_solver_tick(n):
+    inputs = synthetic_environments(1000)
+    env = dctr.PIEnvironment()
+    solver = dctr.PIController(env)
+    def run():
+        for i in xrange(n):
+            (env.idle_agents, env.calls_total, env.calls_answered,
+                env.calls_served, env.uptime) = inputs[i % 1000]
+            solver.predict_outgoing_calls()
+        return n
+    return run
+
+def scenario_lookahead_tick(n):
+    "Look-ahead decisions with 50 active calls (hazard of synthetic durations)"
+    inputs = synthetic_environments(1000)
+    rng = random.Random(SEED)
+    env = dctr.PIEnvironment(lookahead_horizon=15.0,
+        talk_elapsed=[rng.uniform(0, 300) for i in xrange(50)])
+    solver = dctr.LookAheadController(env,
+        hazard=dctr.HazardTable.fromdurations(synthetic_durations(10000)))
+    def run():
+        for i in xrange(n):
+            (env.idle_agents, env.calls_total, env.calls_answered,
+                env.calls_served, env.uptime) = inputs[i % 1000]
+            solver.predict_outgoing_calls()
+        return n
+    return run
+
+def scenario_shared_dispatch(n):
+    "Decisions of 100 campaigns with controller state in shared table (lock, load, store)"
+    inputs = synthetic_environments(1000)
+    fields = ('idle_agents', 'calls_total', 'calls_answered', 'calls_served', 'uptime')
+    requests = [dict(zip(fields, values), campaign='c{}'.format(i % 100), interval=5)
+        for i, values in enumerate(inputs)]
+    tmpdir = tempfile.mkdtemp()
+    state = sharedstate.SharedState(os.path.join(tmpdir, 'd9.state'))
+    dispatcher = codec.Dispatcher(state=state)
+    def run():
+        for i in xrange(0, n, 100):
+            dispatcher.solve(requests[i % 1000:i % 1000 + 100])
+        return n
+    def cleanup():
+        state.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    run.cleanup = cleanup
+    return run
+
+def scenario_environment_extendfrom(n):
+    source = dctr.PIEnvironment(idle_agents=10, calls_total=1000,
+        calls_answered=300, calls_served=290, uptime=600, interval=5)
+    def run():
+        for i in xrange(n):
+            dctr.PIEnvironment().extendfrom(source)
+        return n
+    return run
+
+def scenario_environment_differential(n):
+    base = dctr.PIEnvironment(calls_total=1000, calls_answered=300,
+        calls_served=290, uptime=600, interval=5)
+    source = dctr.TrackedEnvironment(idle_agents=0).clearchanges()
+    def run():
+        env = dctr.OverlayEnvironment(base)
+        for i in xrange(n):
+            source.idle_agents = i
+            env.extendfrom(source, changed_only=True)
+        return n
+    return run
+
+def scenario_environment_dump(n):
+    env = dctr.PIEnvironment(idle_agents=10, calls_total=1000)
+    def run():
+        for i in xrange(n):
+            env.dump()
+        return n
+    return run
+
+def scenario_numset_append_read(n):
+    values = synthetic_durations(n)
+    def run():
+        p = statistics.NumSet()
+        for v in values:
+            p.append(v)
+        p.y
+        p.min, p.max, p.mean
+        return n
+    return run
+
+def scenario_histogram_build(n):
+    source = statistics.NumSet().fromlist(synthetic_durations(n))
+    def run():
+        statistics.Histogram(source=source, bins=20)
+        return n
+    return run
+
+def scenario_decayed_windowed(n):
+    "Decayed mean/variance and windowed min/max updates (15 minutes at 1 value/s)"
+    values = synthetic_durations(n)
+    def run():
+        d = statistics.DecayedStats(halflife=900)
+        w = statistics.WindowedExtrema(window=900)
+        for t, v in enumerate(values):
+            d.append(v, t)
+            w.append(v, t)
+        d.mean, d.variance, w.min, w.max
+        return n
+    return run
+
+def scenario_selectrandom(n):
+    source = statistics.NumSet().fromlist(synthetic_durations(10000))
+    def run():
+        random.seed(SEED)
+        for i in xrange(n):
+            source.selectrandom()
+        return n
+    return run
+
+def scenario_agent_pool(n):
+    "Acquire/release cycles in pool of 5000 agents (event-driven release)"
+    durations = synthetic_durations(10000)
+    def run():
+        pool = agentpool.AgentPool(5000)
+        now = 0.0
+        for i in xrange(n):
+            now += 0.05
+            pool.advance(now)
+            if pool.idle:
+                pool.acquire(now, now + durations[i % 10000])
+        return n
+    return run
+
+def scenario_timer_wheel(n):
+    "Patience timers: schedule, cancel most of them (served calls), expire the rest"
+    rng = random.Random(SEED)
+    patience = [rng.expovariate(1 / 30.0) for i in xrange(10000)]
+    def run():
+        wheel = timerwheel.TimerWheel(tick=1.0)
+        pending = {} # payload -> handle
+        now = 0.0
+        for i in xrange(n):
+            now += 0.01
+            pending[i] = wheel.schedule(now + patience[i % 10000], i)
+            if i % 4:
+                wheel.cancel(pending.popitem()[1])
+            if i % 100 == 0:
+                for payload in wheel.advance(now):
+                    del pending[payload]
+        return n
+    return run
+
+def scenario_lead_queue(n):
+    "Pop 20 leads per decision from list of 1M leads, 4 of 5 attempts are retried"
+    queue = leads.LeadQueue(max_attempts=3, retry_delay=3600, window=(9 * 3600, 21 * 3600))
+    queue.extend(xrange(1000000))
+    def run():
+        now = 9 * 3600
+        for i in xrange(0, n, 20):
+            now += 1
+            for k, lead in enumerate(queue.pop(20, now)):
+                queue.result(lead, k % 5 == 0, now)
+        return n
+    return run
+
+def scenario_recorder_sample(n):
+    "Samples of 8 metrics into recorder of 4096 samples (downsampled)"
+    values = (0.02, 5, 12, 150.0, 3.5, 0.8, 40, 2)
+    def run():
+        r = recorder.Recorder(['m{}'.format(i) for i in xrange(len(values))], 4096)
+        for i in xrange(n):
+            r.sample(i * 10.0, values)
+        return n
+    return run
+
+def scenario_csv_parse(n):
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'call_log.csv')
+    synthetic_log(filename, n)
+    def run():
+        count = 0
+        for row in calllog.iterlog(filename):
+            count += 1
+        return count
+    run.cleanup = lambda: shutil.rmtree(tmpdir, ignore_errors=True)
+    return run
+
+def scenario_csv_decode_columns(n):
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'call_log.csv')
+    synthetic_log(filename, n)
+    def run():
+        return len(calllog.decodelog(filename)['call_timestamp'])
+    run.cleanup = lambda: shutil.rmtree(tmpdir, ignore_errors=True)
+    return run
+
+def scenario_parse_log_incremental(n):
+    """
+    Refresh of report after n rows appended to log of 20 * n rows
+    (load checkpoint, parse tail, summarize)
+    """
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'call_log.csv')
+    checkpoint = os.path.join(tmpdir, 'call_log.checkpoint')
+    synthetic_log(filename, 20 * n)
+    with open(filename, 'rb') as f:
+        lines = f.readlines()
+    with open(filename, 'wb') as f:
+        f.writelines(lines[:-n])
+    state = parse_log.Checkpoint()
+    parse_log.analyze(filename, state)
+    state.store(checkpoint)
+    with open(filename, 'ab') as f:
+        f.writelines(lines[-n:])
+    def run():
+        state = parse_log.Checkpoint().load(checkpoint)
+        parse_log.analyze(filename, state)
+        return len(parse_log.data)
+    run.cleanup = lambda: shutil.rmtree(tmpdir, ignore_errors=True)
+    return run
+
+def scenario_simulation(n):
+    """
+    Simulated hours per wall-second (n - simulated hours).
+    Requires Khronos suite.
+    """
+    import imp
+    import khronos # check presence
+    tmpdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dctr-khronos-sim.py')
+    os.chdir(tmpdir)
+    try:
+        statistics.NumSet().fromlist(synthetic_durations(10000)).store('c_duration.dat')
+        sim_module = imp.load_source('dctr_khronos_sim', path)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    sim_module.CallCenterSim.total_agents = 23
+    sim = sim_module.CallCenterSim('bench')
+    sim.stack.trace = False
+    def run():
+        random.seed(SEED)
+        sim.single_run(n * 3600)
+        return n
+    return run
+
+def scenario_startup(n):
+    """
+    Process per decision: startup of dctr-decide.py
+    (bytecode of dctr is compiled in advance, as on deployment).
+    """
+    path = os.path.dirname(os.path.abspath(__file__))
+    py_compile.compile(os.path.join(path, 'dctr.py'))
+    args = [sys.executable, '-S', os.path.join(path, 'dctr-decide.py'),
+        'idle_agents=5', 'calls_total=3000', 'calls_answered=1000',
+        'calls_served=990', 'uptime=600', 'interval=5']
+    devnull = open(os.devnull, 'w')
+    def run():
+        for i in xrange(n):
+            subprocess.check_call(args, stdout=devnull)
+        return n
+    run.cleanup = devnull.close
+    return run
+
+# name: (scenario, default size, unit of operation)
+scenarios = {
+    'solver_tick': (scenario_solver_tick, 100000, 'tick'),
+    'lookahead_tick': (scenario_lookahead_tick, 20000, 'tick'),
+    'shared_dispatch': (scenario_shared_dispatch, 100000, 'decision'),
+    'environment_extendfrom': (scenario_environment_extendfrom, 10000, 'copy'),
+    'environment_differential': (scenario_environment_differential, 100000, 'update'),
+    'environment_dump': (scenario_environment_dump, 10000, 'dump'),
+    'numset_append_read': (scenario_numset_append_read, 200000, 'value'),
+    'histogram_build': (scenario_histogram_build, 200000, 'value'),
+    'decayed_windowed': (scenario_decayed_windowed, 200000, 'value'),
+    'selectrandom': (scenario_selectrandom, 100000, 'selection'),
+    'agent_pool': (scenario_agent_pool, 200000, 'call'),
+    'timer_wheel': (scenario_timer_wheel, 200000, 'timer'),
+    'lead_queue': (scenario_lead_queue, 200000, 'lead'),
+    'recorder_sample': (scenario_recorder_sample, 200000, 'sample'),
+    'csv_parse': (scenario_csv_parse, 1000000, 'row'),
+    'csv_decode_columns': (scenario_csv_decode_columns, 1000000, 'row'),
+    'parse_log_incremental': (scenario_parse_log_incremental, 10000, 'row'),
+    'simulation': (scenario_simulation, 10, 'simulated hour'),
+    'startup': (scenario_startup, 50, 'process'),
+}
+
+# name: max seconds per operation
+budgets = {
+    'startup': 0.010,
+}
+
+##############################################
+# Runner
+##############################################
+
+def measure(name, scale=1.0, repeat=3):
+    "Run scenario, return result record (best of repeats)"
+    scenario, size, unit = scenarios[name]
+    n = max(1, int(size * scale))
+    try:
+        run = scenario(n)
+    except ImportError as e:
+        return {'skipped': str(e)}
+    best = None
+    try:
+        for i in xrange(repeat):
+            started = timer()
+            ops = run()
+            elapsed = timer() - started
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if hasattr(run, 'cleanup'):
+            run.cleanup()
+    return {
+        'n': ops,
+        'unit': unit,
+        'seconds': best,
+        'ops_per_sec': ops / best if best else float('inf')
+    }
+
+def run_all(names=None, scale=1.0, repeat=3):
+    random.seed(SEED)
+    results = {}
+    for name in sorted(names or scenarios.keys()):
+        results[name] = measure(name, scale, repeat)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'repeat': repeat,
+        'scenarios': results
+    }
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Return list of (scenario, current, baseline) for scenarios
+    slower than baseline by more than tolerance (ops per second).
+    >>> compare({'scenarios': {'a': {'ops_per_sec': 70.0}, 'b': {'ops_per_sec': 95.0}}},
+    ...     {'scenarios': {'a': {'ops_per_sec': 100.0}, 'b': {'ops_per_sec': 100.0}}})
+    [('a', 70.0, 100.0)]
+    """
+    regressions = []
+    for name, record in sorted(results['scenarios'].items()):
+        base = baseline.get('scenarios', {}).get(name)
+        if not base or 'ops_per_sec' not in base or 'ops_per_sec' not in record:
+            continue
+        if record['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append((name, record['ops_per_sec'], base['ops_per_sec']))
+    return regressions
+
+def overbudget(results):
+    """
+    Return list of (scenario, seconds per operation, budget)
+    for scenarios slower than their budget.
+    >>> overbudget({'scenarios': {'startup': {'n': 10, 'seconds': 0.2}}})
+    [('startup', 0.02, 0.01)]
+    """
+    buff = []
+    for name, record in sorted(results['scenarios'].items()):
+        if name not in budgets or 'seconds' not in record:
+            continue
+        per_op = record['seconds'] / record['n']
+        if per_op > budgets[name]:
+            buff.append((name, per_op, budgets[name]))
+    return buff
+
+def main(argv):
+    options = {'scale': '1.0', 'repeat': '3', 'output': None,
+        'baseline': None, 'tolerance': '0.2'}
+    names = []
+    for arg in argv[1:]:
+        if arg.startswith('--'):
+            name, sep, value = arg[2:].partition('=')
+            if name not in options or not sep:
+                print 'Unknown option: {}'.format(arg)
+                return 2
+            options[name] = value
+        elif arg in scenarios:
+            names.append(arg)
+        else:
+            print 'Unknown scenario: {}, available: {}'.format(arg, ', '.join(sorted(scenarios)))
+            return 2
+
+    results = run_all(names, float(options['scale']), int(options['repeat']))
+    for name, record in sorted(results['scenarios'].items()):
+        if 'skipped' in record:
+            print '{:<24} skipped ({})'.format(name, record['skipped'])
+        else:
+            print '{:<24} {:>14.1f} {}/s'.format(name, record['ops_per_sec'], record['unit'])
+
+    failed = False
+    for name, per_op, budget in overbudget(results):
+        print 'OVER BUDGET {}: {:.2f} ms (budget {:.2f} ms)'.format(name, per_op * 1000, budget * 1000)
+        failed = True
+
+    if options['output']:
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options['baseline']:
+        with open(options['baseline'], 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, float(options['tolerance']))
+        for name, current, base in regressions:
+            print 'REGRESSION {}: {:.1f} ops/s (baseline {:.1f} ops/s)'.format(name, current, base)
+        if regressions:
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--doctest']:
+        import doctest
+        doctest.testmod()
+    else:
+        sys.exit(main(sys.argv))
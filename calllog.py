@@ -0,0 +1,307 @@
+# fix division problem:
+from __future__ import division
+
+# Reading and decoding of call logs (call_log.csv).
+# Fields used: agent_name, classification,
+# call_time, talk_time (<date> 00:00:00),
+# call_duration (00:00:00).
+
+import os
+import csv
+import calendar
+import itertools
+from array import array
+
+def timefromtimestr(s):
+    """ Decode from text like 00:00:00
+    >>> timefromtimestr('01:02:03'), timefromtimestr('1:02:03'), timefromtimestr('')
+    (3723, 3723, None)
+    """
+    # fast path for fixed-width text:
+    if len(s) == 8 and s[2] == ':' and s[5] == ':':
+        return 3600*int(s[0:2]) + 60*int(s[3:5]) + int(s[6:8])
+    if len(s) == 0:
+        return None
+    h, m, s = [int(v) for v in s.split(':')]
+    return 3600*h + 60 *m + s
+
+def timefromdatestr(s):
+    """ Decode from text like <date><space>00:00:00"""
+    if len(s) == 0:
+        return None
+    return timefromtimestr(s.split(' ')[1])
+
+def datefromdatestr(s):
+    """ Extract <date> from text like <date><space>00:00:00"""
+    if len(s) == 0:
+        return None
+    return s.split(' ')[0]
+
+# cache: <date> -> timestamp of midnight
+_midnights = {}
+
+def midnightfromdatestr(date):
+    """
+    Decode text like YYYY-MM-DD into timestamp (UTC seconds) of midnight.
+    >>> midnightfromdatestr('2015-03-02')
+    1425254400
+    """
+    try:
+        return _midnights[date]
+    except KeyError:
+        y, m, d = [int(v) for v in date.split('-')]
+        midnight = _midnights[date] = calendar.timegm((y, m, d, 0, 0, 0))
+        return midnight
+
+def timeofday(timestamp):
+    """
+    Seconds of day of timestamp (midnights are UTC, see midnightfromdatestr).
+    >>> timeofday(timestampfromdatestr('2015-03-02 10:00:05')), timeofday(None)
+    (36005, None)
+    """
+    if timestamp is None:
+        return None
+    return timestamp % 86400
+
+def timestampfromdatestr(s):
+    """
+    Decode from text like <date><space>00:00:00 into timestamp
+    (date is preserved, so intervals across midnight are correct).
+    >>> timestampfromdatestr('2015-03-03 00:00:10') - timestampfromdatestr('2015-03-02 23:59:50')
+    20
+    """
+    if len(s) == 0:
+        return None
+    date, time = s.split(' ')
+    return midnightfromdatestr(date) + timefromtimestr(time)
+
+##############################################
+# Bulk (column) decoding
+##############################################
+
+class MaskedColumn(object):
+    """
+    Column of decoded integer values. Missing (empty) fields
+    are marked in mask (value is stored as 0) instead of None.
+    >>> c = decodetimes(['00:01:00', '', '00:01:00', '00:00:05'])
+    >>> list(c.values), list(c.mask)
+    ([60, 0, 60, 5], [0, 1, 0, 0])
+    >>> c.count, c.compressed(), c.filled(None)
+    (3, [60, 60, 5], [60, None, 60, 5])
+    """
+
+    def __init__(self, values=None, mask=None):
+        self.values = values if values is not None else array('l')
+        self.mask = mask if mask is not None else array('B')
+
+    @classmethod
+    def fromlist(cls, decoded):
+        "Make column from list of values (None - missing value)"
+        return cls(array('l', [v or 0 for v in decoded]),
+            array('B', [v is None for v in decoded]))
+
+    def isvalid(self, i):
+        return not self.mask[i]
+
+    @property
+    def count(self):
+        "Number of valid values"
+        return len(self.mask) - sum(self.mask)
+
+    def compressed(self):
+        "List of valid values"
+        return list(itertools.compress(self.values, (not m for m in self.mask)))
+
+    def filled(self, default=0):
+        "List of values, where missing values are replaced by default"
+        return [default if m else v for v, m in itertools.izip(self.values, self.mask)]
+
+    def __len__(self):
+        return len(self.values)
+
+class _Memo(dict):
+    "Cache of decoded values (durations and dates repeat heavily)"
+    def __init__(self, decoder):
+        dict.__init__(self)
+        self.decoder = decoder
+
+    def __missing__(self, key):
+        value = self[key] = self.decoder(key)
+        return value
+
+def decodetimes(strings):
+    "Bulk decode of texts like 00:00:00 into MaskedColumn"
+    return MaskedColumn.fromlist(map(_Memo(timefromtimestr).__getitem__, strings))
+
+def decodetimestamps(strings):
+    """
+    Bulk decode of texts like <date><space>00:00:00 into
+    MaskedColumn of timestamps.
+    >>> decodetimestamps(['2015-03-02 00:00:10', '', '2015-3-2 0:0:20']).filled(None)
+    [1425254410, None, 1425254420]
+    """
+    times = _Memo(timefromtimestr)
+    midnights = _Memo(midnightfromdatestr)
+    return MaskedColumn.fromlist([midnights[s[:10]] + times[s[11:]]
+        if len(s) == 19 and s[10] == ' ' else timestampfromdatestr(s)
+        for s in strings])
+
+def readcolumns(filename, names):
+    "Read columns of CSV file, return dict: name -> tuple of texts"
+    with open(filename, 'r') as f:
+        reader = csv.reader(f, delimiter=',')
+        header = reader.next()
+        columns = zip(*reader)
+    if not columns:
+        columns = [()] * len(header)
+    return dict((name, columns[header.index(name)]) for name in names)
+
+def decodelog(filename):
+    """
+    Bulk decode of log file into columns:
+    agent_name, classification (texts), call_timestamp,
+    talk_timestamp, call_duration (MaskedColumn).
+    """
+    columns = readcolumns(filename,
+        ('agent_name', 'classification', 'call_time', 'talk_time', 'call_duration'))
+    return {
+        'agent_name': columns['agent_name'],
+        'classification': columns['classification'],
+        'call_timestamp': decodetimestamps(columns['call_time']),
+        'talk_timestamp': decodetimestamps(columns['talk_time']),
+        'call_duration': decodetimes(columns['call_duration']),
+    }
+
+##############################################
+# Row decoding
+##############################################
+
+def decode(d, name):
+    if len(d[name]) > 0:
+        return d[name]
+    else:
+        return None
+
+def decoderow(line):
+    """
+    Decode fields of log row (in place), add computed fields
+    'day', 'call_timestamp', 'talk_timestamp' and 'dialing_time'.
+    >>> row = decoderow({'agent_name': 'a1', 'classification': '',
+    ...     'call_time': '2015-03-02 10:00:00', 'talk_time': '2015-03-02 10:00:12',
+    ...     'call_duration': '00:01:05'})
+    >>> row['day'], row['call_time'], row['dialing_time'], row['call_duration']
+    ('2015-03-02', 36000, 12, 65)
+    >>> row['classification'] is None
+    True
+    >>> row['talk_timestamp'] - row['call_timestamp']
+    12
+    """
+    line['classification'] = decode(line, 'classification')
+    line['day'] = datefromdatestr(line['call_time'])
+    call_timestamp = line['call_timestamp'] = timestampfromdatestr(line['call_time'])
+    talk_timestamp = line['talk_timestamp'] = timestampfromdatestr(line['talk_time'])
+    # time of day from timestamp (date and time are parsed once):
+    line['call_time'] = timeofday(call_timestamp)
+    line['talk_time'] = timeofday(talk_timestamp)
+    if talk_timestamp is not None and call_timestamp is not None:
+        line['dialing_time'] = talk_timestamp - call_timestamp
+    else:
+        line['dialing_time'] = None
+    line['call_duration'] = timefromtimestr(line['call_duration'])
+    return line
+
+def decoderows(rows):
+    """
+    Bulk version of decoderow() for list of rows (in place):
+    dates, times and durations are decoded by columns
+    (memoized, see decodetimestamps).
+    >>> rows = decoderows([{'agent_name': 'a1', 'classification': '',
+    ...     'call_time': '2015-03-02 10:00:00', 'talk_time': '',
+    ...     'call_duration': ''}])
+    >>> rows[0]['day'], rows[0]['call_time'], rows[0]['talk_time'], rows[0]['dialing_time']
+    ('2015-03-02', 36000, None, None)
+    """
+    call_timestamps = decodetimestamps([line['call_time'] for line in rows]).filled(None)
+    talk_timestamps = decodetimestamps([line['talk_time'] for line in rows]).filled(None)
+    durations = decodetimes([line['call_duration'] for line in rows]).filled(None)
+    for line, call_timestamp, talk_timestamp, call_duration in \
+            itertools.izip(rows, call_timestamps, talk_timestamps, durations):
+        line['classification'] = decode(line, 'classification')
+        line['day'] = datefromdatestr(line['call_time'])
+        line['call_timestamp'] = call_timestamp
+        line['talk_timestamp'] = talk_timestamp
+        line['call_time'] = timeofday(call_timestamp)
+        line['talk_time'] = timeofday(talk_timestamp)
+        if talk_timestamp is not None and call_timestamp is not None:
+            line['dialing_time'] = talk_timestamp - call_timestamp
+        else:
+            line['dialing_time'] = None
+        line['call_duration'] = call_duration
+    return rows
+
+def iterlog(filename):
+    "Iterate over decoded rows of log file"
+    with open(filename, 'r') as f:
+        for line in csv.DictReader(f, delimiter=','):
+            yield decoderow(line)
+
+def readheader(filename):
+    "Names of columns of log file"
+    with open(filename, 'rb') as f:
+        return next(csv.reader([f.readline()]), [])
+
+def chunks(filename, size):
+    """
+    Split log file into byte ranges [start, end) of about
+    size bytes (header excluded), see iterchunk()
+    """
+    with open(filename, 'rb') as f:
+        start = len(f.readline())
+        f.seek(0, os.SEEK_END)
+        total = f.tell()
+    ranges = []
+    while start < total:
+        ranges.append((start, min(total, start + size)))
+        start += size
+    return ranges
+
+def iterchunk(filename, start, end):
+    """
+    Iterate over decoded rows of lines which start within byte
+    range [start, end) of log file: every line belongs to exactly
+    one range of chunks() (fields with line breaks are not supported).
+    """
+    with open(filename, 'rb') as f:
+        fieldnames = next(csv.reader([f.readline()]))
+        if start > f.tell():
+            # skip line started before range:
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        lines = []
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            lines.append(line)
+    for line in decoderows(list(csv.DictReader(lines, fieldnames=fieldnames))):
+        yield line
+
+def iterlogs(filenames):
+    "Iterate over decoded rows of several log files (in given order)"
+    for filename in filenames:
+        for line in iterlog(filename):
+            yield line
+
+def iterdays(rows):
+    """
+    Group consecutive rows (log is ordered by call time)
+    by day, yield (day, list of rows).
+    """
+    for day, group in itertools.groupby(rows, lambda line: line['day']):
+        yield day, list(group)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
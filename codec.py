@@ -0,0 +1,390 @@
+# fix division problem:
+from __future__ import division
+
+# Wire protocols of the solver: newline-delimited JSON and
+# fixed-layout binary frames. Every message is a batch of
+# requests (one per campaign), so dialer sends single frame
+# per tick for all campaigns instead of one process per campaign.
+#
+# JSON request line (single object is accepted as batch of one):
+#   [{"campaign": "c1", "idle_agents": 5, "calls_total": 1000, ...}, ...]
+# JSON reply line:
+#   [{"campaign": "c1", "calls": 12}, {"campaign": "c2", "error": "..."}]
+#
+# Binary request frame: header <4sH (magic 'D9Q2', count), then
+# count records <I + one double per field of FIELDS (campaign id,
+# values; NaN - field is not set). Binary reply frame: header
+# <4sH (magic 'D9R1', count), then records <Ii (campaign id,
+# calls; -1 on error).
+#
+# Usage:
+# codec.py [--format=json|binary] [--state=<file>] < requests > replies
+
+import os
+import sys
+import json
+import struct
+
+import dctr
+import sharedstate
+
+# fields of request (fixed order of binary layout):
+FIELDS = dctr.PI_FIELDS
+# fields which must be present in every request,
+# the rest have defaults of PIEnvironment:
+INPUTS = dctr.PI_INPUTS
+OPTIONAL = tuple(name for name in FIELDS if name not in INPUTS)
+
+REQUEST_MAGIC = 'D9Q2'
+REPLY_MAGIC = 'D9R1'
+HEADER = struct.Struct('<4sH')
+REQUEST_RECORD = struct.Struct('<I{}d'.format(len(FIELDS)))
+REPLY_RECORD = struct.Struct('<Ii')
+
+NOT_SET = float('nan')
+
+FORMATS = ('json', 'binary')
+
+def isnumber(value):
+    "Numbers only (bool is not accepted)"
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+def validate(request):
+    """
+    Check single request (dict), return (campaign, fields).
+    >>> validate({'campaign': 'c1', 'idle_agents': 5, 'calls_total': 10,
+    ...     'calls_answered': 3, 'calls_served': 3, 'uptime': 600, 'interval': 5})[0]
+    'c1'
+    >>> validate({'campaign': 'c1', 'idle_agents': 5})
+    Traceback (most recent call last):
+    ...
+    ESolverInputError: Request of campaign "c1": field "calls_total" missed!
+    """
+    if not isinstance(request, dict):
+        raise dctr.ESolverInputError('Request must be an object!')
+    fields = dict(request)
+    try:
+        campaign = fields.pop('campaign')
+    except KeyError:
+        raise dctr.ESolverInputError('Request without "campaign" field!')
+    if not isinstance(campaign, basestring) and not isnumber(campaign):
+        raise dctr.ESolverInputError('Campaign must be a string or a number!')
+    for name, value in fields.iteritems():
+        if name not in FIELDS:
+            raise dctr.ESolverInputError(
+                'Request of campaign "{}": unknown field "{}"!'.format(campaign, name))
+        if not isnumber(value):
+            raise dctr.ESolverInputError(
+                'Request of campaign "{}": value of "{}" must be a number!'.format(campaign, name))
+    for name in INPUTS:
+        if name not in fields:
+            raise dctr.ESolverInputError(
+                'Request of campaign "{}": field "{}" missed!'.format(campaign, name))
+    return campaign, fields
+
+##############################################
+# JSON lines
+##############################################
+
+def decodejson(line):
+    """
+    Decode request line into list of requests (dicts),
+    requests are not validated.
+    >>> sorted(decodejson('{"campaign": 1, "idle_agents": 5}')[0].items())
+    [(u'campaign', 1), (u'idle_agents', 5)]
+    """
+    try:
+        message = json.loads(line)
+    except ValueError as e:
+        raise dctr.ESolverInputError('Malformed JSON request: {}'.format(e))
+    if isinstance(message, dict):
+        return [message]
+    if not isinstance(message, list):
+        raise dctr.ESolverInputError('JSON request must be an object or a list!')
+    return message
+
+def encodejson(requests):
+    "Encode list of requests (dicts) into line"
+    return json.dumps(requests, separators=(',', ':')) + '\n'
+
+def encodejsonreply(replies):
+    """
+    Encode list of (campaign, calls, error) into reply line.
+    >>> encodejsonreply([('c1', 12, None), ('c2', None, 'failed')])
+    '[{"calls":12,"campaign":"c1"},{"campaign":"c2","error":"failed"}]\\n'
+    """
+    buff = []
+    for campaign, calls, error in replies:
+        if error is None:
+            buff.append({'campaign': campaign, 'calls': calls})
+        else:
+            buff.append({'campaign': campaign, 'error': error})
+    return json.dumps(buff, separators=(',', ':'), sort_keys=True) + '\n'
+
+def decodejsonreply(line):
+    "Decode reply line into list of (campaign, calls, error)"
+    return [(reply['campaign'], reply.get('calls'), reply.get('error'))
+        for reply in json.loads(line)]
+
+##############################################
+# Binary frames
+##############################################
+
+def encodebinary(requests):
+    """
+    Encode list of requests (dicts with integer campaign ids)
+    into request frame; missing fields are sent as NaN.
+    >>> frame = encodebinary([{'campaign': 7, 'idle_agents': 5}])
+    >>> len(frame) == HEADER.size + REQUEST_RECORD.size
+    True
+    >>> sorted(decodebinary(frame)[0].items())
+    [('campaign', 7), ('idle_agents', 5.0)]
+    """
+    buff = [HEADER.pack(REQUEST_MAGIC, len(requests))]
+    for request in requests:
+        try:
+            buff.append(REQUEST_RECORD.pack(request['campaign'],
+                *[request.get(name, NOT_SET) for name in FIELDS]))
+        except (KeyError, struct.error) as e:
+            raise dctr.ESolverInputError('Cannot encode request: {}'.format(e))
+    return ''.join(buff)
+
+def _header(data, magic):
+    try:
+        tag, count = HEADER.unpack_from(data)
+    except struct.error:
+        raise dctr.ESolverInputError('Truncated frame header!')
+    if tag != magic:
+        raise dctr.ESolverInputError('Bad frame magic: {!r}'.format(tag))
+    return count
+
+def decodebinary(data):
+    "Decode request frame into list of requests (dicts)"
+    count = _header(data, REQUEST_MAGIC)
+    size = REQUEST_RECORD.size
+    if len(data) != HEADER.size + count * size:
+        raise dctr.ESolverInputError('Frame size does not match number of requests!')
+    buff = []
+    for offset in xrange(HEADER.size, len(data), size):
+        values = REQUEST_RECORD.unpack_from(data, offset)
+        request = {'campaign': values[0]}
+        for name, value in zip(FIELDS, values[1:]):
+            if value == value: # NaN - not set
+                request[name] = value
+        buff.append(request)
+    return buff
+
+def encodebinaryreply(replies):
+    """
+    Encode list of (campaign, calls, error) into reply frame.
+    >>> decodebinaryreply(encodebinaryreply([(1, 12, None), (2, None, 'failed')]))
+    [(1, 12, None), (2, None, 'error')]
+    """
+    buff = [HEADER.pack(REPLY_MAGIC, len(replies))]
+    for campaign, calls, error in replies:
+        buff.append(REPLY_RECORD.pack(campaign, -1 if error is not None else int(calls)))
+    return ''.join(buff)
+
+def decodebinaryreply(data):
+    "Decode reply frame into list of (campaign, calls, error)"
+    count = _header(data, REPLY_MAGIC)
+    buff = []
+    for i in xrange(count):
+        campaign, calls = REPLY_RECORD.unpack_from(data, HEADER.size + i * REPLY_RECORD.size)
+        if calls < 0:
+            buff.append((campaign, None, 'error'))
+        else:
+            buff.append((campaign, calls, None))
+    return buff
+
+def readframe(stream, magic=REQUEST_MAGIC, record=REQUEST_RECORD):
+    "Read single binary frame from stream, return None at the end of stream"
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    count = _header(header, magic)
+    body = stream.read(count * record.size)
+    if len(body) != count * record.size:
+        raise dctr.ESolverInputError('Truncated frame!')
+    return header + body
+
+##############################################
+# Dispatcher
+##############################################
+
+class Dispatcher(object):
+    """
+    Solvers of campaigns: state of solver (integrator etc.)
+    is kept between frames, fields of request override
+    values of previous request of campaign.
+    With state (sharedstate.SharedState) integrator and
+    predict_adjust of campaign are taken from (and stored to)
+    shared table under lock of campaign record, so dispatchers
+    of different processes may serve the same campaigns.
+
+    >>> d = Dispatcher()
+    >>> request = {'idle_agents': 5, 'calls_total': 10, 'calls_answered': 3,
+    ...     'calls_served': 3, 'uptime': 60, 'interval': 5}
+    >>> d.solve([dict(request, campaign='c1'), {'campaign': 'c2'}])
+    [('c1', 5, None), ('c2', None, 'Request of campaign "c2": field "idle_agents" missed!')]
+    >>> d
+    Dispatcher: campaigns: 1
+    """
+
+    def __init__(self, solver_factory=dctr.PIController, settings=None, state=None):
+        self.solver_factory = solver_factory
+        self.settings = settings or {}
+        self.state = state
+        # campaign -> solver
+        self.solvers = {}
+        # values of optional fields omitted by request (not values
+        # of previous request served by this worker); predict_adjust
+        # is state of controller:
+        defaults = dctr.PIEnvironment(**self.settings)
+        self.defaults = dict((name, getattr(defaults, name))
+            for name in OPTIONAL if name != 'predict_adjust')
+
+    def solver(self, campaign):
+        try:
+            return self.solvers[campaign]
+        except KeyError:
+            solver = self.solvers[campaign] = \
+                self.solver_factory(dctr.PIEnvironment(**self.settings))
+            return solver
+
+    def solve(self, requests):
+        "Return list of (campaign, calls, error) for list of requests"
+        replies = []
+        for request in requests:
+            try:
+                campaign, fields = validate(request)
+            except dctr.ESolverInputError as e:
+                replies.append((request.get('campaign') if isinstance(request, dict) else None,
+                    None, str(e)))
+                continue
+            state = self.state
+            if state is not None:
+                try:
+                    slot = state.acquire(campaign)
+                except sharedstate.ESharedStateError as e:
+                    # campaign has no record (e.g., key is too long, table is full):
+                    replies.append((campaign, None, str(e)))
+                    continue
+                solver = self.solver(campaign)
+                env = solver.e
+                try:
+                    shared = state.load(slot)
+                    if shared is not None:
+                        solver.integrator, env.predict_adjust = shared
+                    replies.append(self._decide(campaign, solver, fields))
+                    state.store(slot, solver.integrator, env.predict_adjust)
+                finally:
+                    state.release(slot)
+            else:
+                replies.append(self._decide(campaign, self.solver(campaign), fields))
+        return replies
+
+    def _decide(self, campaign, solver, fields):
+        env = solver.e
+        for name, value in self.defaults.iteritems():
+            if name not in fields:
+                setattr(env, name, value)
+        for name, value in fields.iteritems():
+            setattr(env, name, value)
+        try:
+            return campaign, solver.predict_outgoing_calls(), None
+        except dctr.ESolverError as e:
+            return campaign, None, str(e)
+
+    def __str__(self):
+        return 'Dispatcher: campaigns: {}'.format(len(self.solvers))
+
+    def __repr__(self):
+        return self.__str__()
+
+def serve(instream, outstream, format='json', dispatcher=None):
+    """
+    Answer every request frame (line) of instream,
+    return number of frames processed. Malformed frame
+    is answered with single error reply (binary frame with
+    bad magic: reading continues right after its header).
+    """
+    dispatcher = dispatcher or Dispatcher()
+    frames = 0
+    if format == 'json':
+        for line in iter(instream.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                replies = dispatcher.solve(decodejson(line))
+            except dctr.ESolverInputError as e:
+                replies = [(None, None, str(e))]
+            outstream.write(encodejsonreply(replies))
+            outstream.flush()
+            frames += 1
+    elif format == 'binary':
+        while True:
+            try:
+                frame = readframe(instream)
+                if frame is None:
+                    break
+                replies = dispatcher.solve(decodebinary(frame))
+            except dctr.ESolverInputError as e:
+                replies = [(0, None, str(e))]
+            outstream.write(encodebinaryreply(replies))
+            outstream.flush()
+            frames += 1
+    else:
+        raise dctr.ESolverInputError('Unknown format "{}", use one of: {}' \
+            .format(format, ', '.join(FORMATS)))
+    return frames
+
+def binarystdio():
+    "Standard input and output in binary mode (no newline translation on Windows)"
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+    streams = []
+    for stream, mode in ((sys.stdin, 'rb'), (sys.stdout, 'wb')):
+        if msvcrt is not None:
+            msvcrt.setmode(stream.fileno(), os.O_BINARY)
+        streams.append(os.fdopen(os.dup(stream.fileno()), mode))
+    return streams
+
+def main(argv):
+    """
+    Usage: codec.py [--format=json|binary] [--state=<file>] < requests > replies
+    With --state controller states of campaigns are kept in shared
+    table (e.g., /dev/shm/d9.state) common for all worker processes.
+    """
+    format, state = 'json', None
+    for arg in argv[1:]:
+        if arg.startswith('--format='):
+            format = arg.split('=', 1)[1]
+        elif arg.startswith('--state='):
+            state = arg.split('=', 1)[1]
+        else:
+            print main.__doc__
+            return 2
+    try:
+        dispatcher = None
+        if state:
+            dispatcher = Dispatcher(state=sharedstate.SharedState(state))
+        instream, outstream = sys.stdin, sys.stdout
+        if format == 'binary':
+            instream, outstream = binarystdio()
+        serve(instream, outstream, format, dispatcher)
+    except dctr.ESolverInputError as e:
+        sys.stderr.write('{}\n'.format(e))
+        return 2
+    except sharedstate.ESharedStateError as e:
+        sys.stderr.write('{}\n'.format(e))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv))
+    import doctest
+    doctest.testmod()
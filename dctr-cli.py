@@ -1,9 +1,15 @@
+import sys
 import dctr as dialercontrol
 
-env = dialercontrol.PIEnvironment().\
+# defaults are not copied: CLI values are layered over them
+try:
+    env = dialercontrol.OverlayEnvironment(dialercontrol.PIEnvironment()).\
                 extendfrom(\
                     dialercontrol.CLIEnvironment()\
                 )
+except dialercontrol.EEnvironmentError as e:
+    print e
+    sys.exit(2)
 print '\n'.join(env.dump())
 print '---'
 print dialercontrol.PIController(env).predict_outgoing_calls(debug=True)
@@ -0,0 +1,38 @@
+# Startup-optimized entry point: single decision per process.
+# Imports only dctr (no statistics, numpy or matplotlib), checks
+# arguments by precomputed schema table and prints recommended
+# number of outgoing calls only. Errors are written to stderr.
+#
+# Usage (option -S skips import of site module):
+# python -S dctr-decide.py idle_agents=<value> calls_total=<value> \
+#     calls_answered=<value> calls_served=<value> uptime=<value> \
+#     interval=<value> [calls_congested=<value>] [<setting>=<value> ...]
+
+import sys
+import dctr
+
+def main(argv):
+    schema = dctr.PI_SCHEMA
+    values = {}
+    try:
+        for pair in argv[1:]:
+            name, sep, text = pair.partition('=')
+            if not sep or name not in schema:
+                raise dctr.ECliError('Unknown argument "{}", use: {}'.format(
+                    pair, ' '.join('{}=<value>'.format(name) for name in dctr.PI_FIELDS)))
+            values[name] = dctr.parsenumber(name, text)
+        for name in dctr.PI_INPUTS:
+            if name not in values:
+                raise dctr.ECliError('Argument "{}" missed!'.format(name))
+        calls = dctr.PIController(dctr.PIEnvironment(**values)).predict_outgoing_calls()
+    except dctr.EEnvironmentError as e:
+        sys.stderr.write('{}\n'.format(e))
+        return 2
+    except dctr.ESolverError as e:
+        sys.stderr.write('{}\n'.format(e))
+        return 1
+    sys.stdout.write('{}\n'.format(calls))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -2,21 +2,34 @@
 from __future__ import division
 from khronos.des import Simulator, Process, Chain, Signal, Listener
 from khronos.des.extra.components.resources import Resource
-from khronos.statistics import TSeries, Plotter
 
-import numpy
+import os
+import sys
 
 import statistics
+import report
+import simtools
+import agentpool
+import timerwheel
+import recorder
+import leads
+from collections import OrderedDict
 
 import dctr as predict
 
+# kinds of in-flight activities:
+TALKING, RINGING, WRAPUP, WAITING = 'talking', 'ringing', 'wrapup', 'waiting'
+
 class Call(Process):
     """Represents simulated environment of incoming calls"""
     
     # settings
     ctr_integral_gain = 0.05
     ctr_proportional_gain = 2.0
+    ctr_congestion_gain = 1.0
     predict_adjust = 100.0
+    # look-ahead horizon (seconds) of LookAheadController, 0 - disabled:
+    lookahead_horizon = 0
 
     # criterions for progressive mode:
     uptime_threshold = 5 * 60 # 5 minutes in seconds
@@ -32,10 +45,13 @@ class Call(Process):
     
     calls_total = 0 # total outbound calls
     calls_answered = 0 # total answered
-    calls_congested = 0 # due to network overload, to-do
+    calls_congested = 0 # due to network overload
     calls_served = 0 # total served, abandon = calls_answered-calls_served
     
     total_service_time = 0
+
+    trunks = None # will be assigned from model
+    trunks_busy = 0
     
     uptime = 0
     interval = 0
@@ -43,19 +59,54 @@ class Call(Process):
     
     # simulation settings:
     p_answer = 0.2 # 20% probability of a live call response
+    # time-of-day profile of answer probability (see parse_log),
+    # p_answer is used for hours without observed calls:
+    profile = None
+    if os.path.exists('rate.profile'):
+        profile = statistics.RateProfile().load('rate.profile')
         
+    ring_time = 20 # no-answer timeout (seconds), trunk is busy while ringing
+    wrapup_time = 0 # after-call work of agent (seconds)
+    # distribution of customer patience (seconds) for answered
+    # calls waiting for agent (None - abandoned at once):
+    patience = None
+
     talk_time_min = 10.0 * 60 # 10 minutes
     talk_time_max = 20.0 * 60 # 20 minutes
     
     predicted_calls = 0
+    # exponentially weighted talk time of recent calls:
+    recent_duration = None
+    # elapsed talk times of active calls and remaining wrap-up
+    # times of agents (look-ahead inputs of solver):
+    talk_elapsed = ()
+    wrapup_remaining = ()
+
+    # in-flight activities of calls: call -> (kind, end time, duration),
+    # used to capture warm-start snapshot:
+    inflight = {}
+    # (kind, remaining time, duration) for call resumed from snapshot:
+    resumed = None
+    # index of agent in CallCenterSim.pool serving the call:
+    agent = None
+    # index of dialed lead in CallCenterSim.leads (None - anonymous call):
+    lead = None
     
-    c_duration = statistics.NumSet()
-    c_duration.load('c_duration.dat')
+    # compact fitted model is preferred to raw samples:
+    if os.path.exists('c_duration.model'):
+        c_duration = statistics.loadmodel('c_duration.model')
+    else:
+        c_duration = statistics.NumSet()
+        c_duration.load('c_duration.dat')
     #~ c10_duration.store('c10_duration.dat')
     
     def is_answered(self):
-        p = self.sim.rng.uniform(0, 1)
-        if p < Call.p_answer:
+        p_answer = Call.p_answer
+        if Call.profile is not None:
+            p_answer = Call.profile.p_answer(
+                CallCenterSim.day_start + CallCenterSim.clock_offset + self.sim.clock.get(), p_answer)
+        p = CallCenterSim.streams['answer'].uniform(0, 1)
+        if p < p_answer:
             return True
         return False
 
@@ -64,40 +115,153 @@ class Call(Process):
         # to-do: poisson or erlang distribution (?)
         #~ return self.sim.rng.uniform(Call.talk_time_min, Call.talk_time_max)
         #~ return numpy.random.poisson(70)
-        return Call.c_duration.selectrandom()
+        return Call.c_duration.selectrandom(CallCenterSim.streams['duration'])
+
+    def wrapup(self):
+        "After-call work of agent (steps of process)"
+        if Call.wrapup_time > 0:
+            now = self.sim.clock.get()
+            CallCenterSim.pool.wrapup(self.agent, now, Call.wrapup_time)
+            Call.inflight[self] = (WRAPUP, now + Call.wrapup_time, Call.wrapup_time)
+            yield Call.wrapup_time
+            del Call.inflight[self]
+
+    def serve(self, call):
+        """
+        Conversation of call (own or waiting one) with agent
+        of this process, then after-call work (steps of process)
+        """
+        pool = CallCenterSim.pool
+        now = self.sim.clock.get()
+        # wait until conversation finished:
+        duration = call.service_time() * pool.speeds[self.agent]
+        pool.hold(self.agent, now + duration)
+        #~ print 'Idle agents: ', Call.idle_agents,' Call duration: ', duration, ' calls_total: ', Call.calls_total, ' calls_answered: ', Call.calls_answered
+        Call.inflight[call] = (TALKING, now + duration, duration)
+        yield duration
+        del Call.inflight[call]
+        # update service time
+        Call.total_service_time += duration
+        Call.recent_duration.append(duration, self.sim.clock.get())
+        # release trunk:
+        Call.trunks_busy -= 1
+        # update served count:
+        Call.calls_served +=1
+        for step in self.wrapup():
+            yield step
+
+    def pickup(self):
+        """
+        Released agent serves the longest-waiting answered calls,
+        then returns to the pool (steps of process)
+        """
+        pool = CallCenterSim.pool
+        waiting = CallCenterSim.waiting
+        while waiting:
+            call, (handle, expires) = waiting.popitem(last=False)
+            CallCenterSim.wheel.cancel(handle)
+            pool.assign(self.agent, self.sim.clock.get())
+            call.finish(True)
+            for step in self.serve(call):
+                yield step
+        pool.release(self.agent, self.sim.clock.get())
+        Call.idle_agents = pool.idle
+        yield Signal("AgentIsIdle")
+
+    def finish(self, answered):
+        "Report outcome of dialed lead (answered and served or not)"
+        if self.lead is not None:
+            CallCenterSim.leads.result(self.lead, answered,
+                CallCenterSim.day_start + CallCenterSim.clock_offset + self.sim.clock.get())
+
+    def wait(self):
+        "Answered call waits for agent until patience of customer runs out"
+        expires = self.sim.clock.get() + \
+            Call.patience.selectrandom(CallCenterSim.streams['patience'])
+        CallCenterSim.waiting[self] = (CallCenterSim.wheel.schedule(expires, self), expires)
 
     @Chain
     def initialize(self):
-        # Update "uptime"
-        Call.uptime = int(10 * 3600) # convert to seconds (for solver)
+        pool = CallCenterSim.pool
+        # finish activity which was in progress at snapshot
+        # (agent is acquired by CallCenterSim):
+        if self.resumed is not None:
+            kind, remaining, duration = self.resumed
+            Call.inflight[self] = (kind, self.sim.clock.get() + remaining, duration)
+            yield remaining
+            del Call.inflight[self]
+            if kind != WRAPUP:
+                Call.trunks_busy -= 1
+            if kind == TALKING:
+                Call.total_service_time += duration
+                Call.recent_duration.append(duration, self.sim.clock.get())
+                Call.calls_served += 1
+                for step in self.wrapup():
+                    yield step
+            if kind in (TALKING, WRAPUP):
+                for step in self.pickup():
+                    yield step
+            return
+        # Update "uptime" (seconds since start of warm-up, for solver)
+        Call.uptime = int(CallCenterSim.clock_offset + self.sim.clock.get())
         # Count calls:
         Call.calls_total += 1
+
+        # Reject call if all trunks are busy (network overload):
+        if Call.trunks_busy >= Call.trunks:
+            Call.calls_congested += 1
+            self.finish(False)
+            yield 0
+            return
+        Call.trunks_busy += 1
         
         # If call answered:
         if self.is_answered():
             # Update counter for answered call
             Call.calls_answered += 1
             # serve call if agent is available:
-            if Call.idle_agents > 0:
-                # aquire agent:
-                Call.idle_agents -= 1
-                # wait until conversation finished:
-                duration = self.service_time()
-                #~ print 'Idle agents: ', Call.idle_agents,' Call duration: ', duration, ' calls_total: ', Call.calls_total, ' calls_answered: ', Call.calls_answered
-                yield duration
-                # update service time
-                Call.total_service_time += duration
-                # release agent:
-                Call.idle_agents += 1
-                # update served count:
-                Call.calls_served +=1
-                yield Signal("AgentIsIdle")
+            if pool.idle > 0:
+                self.finish(True)
+                # aquire agent (longest idle):
+                self.agent = pool.acquire(self.sim.clock.get())
+                Call.idle_agents = pool.idle
+                for step in self.serve(self):
+                    yield step
+                for step in self.pickup():
+                    yield step
+            elif Call.patience is not None:
+                # customer holds the line (and trunk) until agent
+                # is released or patience runs out (see PatienceTimer):
+                self.wait()
+                yield 0
             else:
                 #~ print 'All agents busy'
+                Call.trunks_busy -= 1
+                self.finish(False)
                 yield 0
+        else:
+            # trunk is busy until no-answer timeout:
+            Call.inflight[self] = (RINGING, self.sim.clock.get() + Call.ring_time, Call.ring_time)
+            yield Call.ring_time
+            del Call.inflight[self]
+            Call.trunks_busy -= 1
+            self.finish(False)
 
         pass # end                
 
+class PatienceTimer(Process):
+    """Abandons waiting calls when patience of customer runs out."""
+
+    @Chain
+    def initialize(self):
+        wheel = CallCenterSim.wheel
+        while True:
+            yield wheel.tick
+            for call in wheel.advance(self.sim.clock.get()):
+                del CallCenterSim.waiting[call]
+                Call.trunks_busy -= 1
+                call.finish(False)
+
 #~ class Agent(Process):
     
     #~ talk_time_min = 10.0 / 60 # 10 minutes
@@ -114,21 +278,74 @@ class Call(Process):
     
     
 
+def make_solver(hazard=None):
+    controller = predict.LookAheadController(hazard=hazard) if hazard is not None \
+        else predict.PIController()
+    return predict.SolverPipeline(controller, [predict.AntiWindup()])
+
+_hazard = []
+
+def duration_hazard():
+    "Hazard table of call duration (built once)"
+    if not _hazard:
+        source = Call.c_duration
+        if isinstance(source, statistics.Distribution):
+            _hazard.append(predict.HazardTable.fromsurvival(lambda t: 1 - source.cdf(t)))
+        else:
+            _hazard.append(predict.HazardTable.fromdurations(source.y))
+    return _hazard[0]
+
+def make_leads(source):
+    "Lead queue of run: stored queue (file name) or number of fresh leads"
+    if isinstance(source, basestring):
+        return leads.LeadQueue().load(source)
+    return leads.LeadQueue(CallCenterSim.lead_attempts, CallCenterSim.lead_retry,
+        CallCenterSim.lead_window).extend(xrange(source))
+
 class CallCenterSim(Simulator):
     """Generates customer traffic and resets 'served' and 'happy' counters at initialization."""
     #~ rate = 40.0 # clients per hour (arrival rate)
     rate = 0.65 # outbound calls per second
+    day_start = 9 * 3600 # time of day at start of simulation (seconds)
     
     total_agents = 0
+    # optional handling-time factors of agents (heterogeneous agents):
+    agent_speeds = None
+    trunks = 60 # capacity of trunk pool (simultaneous calls)
+    # agents of current run (agentpool.AgentPool):
+    pool = None
+    # answered calls waiting for agent: call -> (timer handle, expiry time),
+    # the longest waiting first; patience timers of waiting calls:
+    waiting = OrderedDict()
+    wheel = None
+    # calling list (leads.LeadQueue) of current run, None - anonymous calls;
+    # list is created at reset from lead_list (number of leads or stored file):
+    leads = None
+    lead_list = None
+    lead_attempts = 3
+    lead_retry = 3600 # seconds
+    lead_window = (9 * 3600, 21 * 3600) # local time of day
+    lead_poll = 10 # seconds, dialer waits for leads if list is short
     
-    solver = predict.PIController()
+    # random streams of current replication (see simtools):
+    streams = simtools.Streams()
+    # settings of Call applied over defaults at reset (configuration):
+    settings = {}
+    # warm-start snapshot (simtools.Snapshot) applied at reset:
+    warm = None
+    # model time of snapshot (time of day and uptime continue from it):
+    clock_offset = 0
+
+    solver = make_solver()
 
     def reset(self):
         Call.autoname_reset()
         # Set actual values for prediction algorithm
         Call.ctr_integral_gain = 0.05
         Call.ctr_proportional_gain = 2.0
+        Call.ctr_congestion_gain = 1.0
         Call.predict_adjust = 150.0
+        Call.lookahead_horizon = 0
 
         # criterions for progressive mode:
         Call.uptime_threshold = 5 * 60 # 5 minutes in seconds
@@ -141,21 +358,68 @@ class CallCenterSim(Simulator):
         # state definition:
         total_agents = CallCenterSim.total_agents 
         Call.total_agents = total_agents 
+        CallCenterSim.pool = agentpool.AgentPool(total_agents, CallCenterSim.agent_speeds)
         Call.idle_agents = total_agents 
         Call.predicted_calls = total_agents 
         
         Call.calls_total = 0 # total outbound calls
         Call.calls_answered = 0 # total answered
-        Call.calls_congested = 0 # due to network overload, to-do
+        Call.calls_congested = 0 # due to network overload
+        Call.trunks = CallCenterSim.trunks
+        Call.trunks_busy = 0
         Call.calls_served = 0 # total served, abandon = calls_answered-calls_served
         
         Call.uptime = 0
         Call.total_service_time = 0
-        
+        Call.recent_duration = statistics.DecayedStats(Collector.recent)
+
+        Call.inflight = {}
+        CallCenterSim.clock_offset = 0
+        CallCenterSim.waiting = OrderedDict()
+        CallCenterSim.wheel = timerwheel.TimerWheel(tick=1.0)
+        CallCenterSim.leads = None
+        if CallCenterSim.lead_list is not None:
+            CallCenterSim.leads = make_leads(CallCenterSim.lead_list)
+
+        Call.talk_elapsed = ()
+        Call.wrapup_remaining = ()
+
+        warm = CallCenterSim.warm
+        if warm is not None:
+            for name, value in warm.state.iteritems():
+                setattr(Call, name, value)
+            CallCenterSim.clock_offset = warm.clock
+
+        for name, value in CallCenterSim.settings.iteritems():
+            setattr(Call, name, value)
+
+        # replications are independent: controller starts from scratch
+        CallCenterSim.solver = make_solver(
+            duration_hazard() if Call.lookahead_horizon > 0 else None)
+        if warm is not None:
+            CallCenterSim.solver.setstate(warm.controller)
         CallCenterSim.solver.observe(Call)
 
     @Chain
     def initialize(self):
+        # activities in progress at warm-start snapshot:
+        if CallCenterSim.warm is not None:
+            pool = CallCenterSim.pool
+            for activity in CallCenterSim.warm.inflight:
+                call = Call()
+                kind, remaining = activity[:2]
+                if kind == WAITING:
+                    # waiting call has no process, it is served by released agent:
+                    CallCenterSim.waiting[call] = \
+                        (CallCenterSim.wheel.schedule(remaining, call), remaining)
+                    continue
+                call.resumed = activity
+                if kind in (TALKING, WRAPUP):
+                    call.agent = pool.acquire(0, remaining)
+                self.launch(call)
+            Call.idle_agents = pool.idle
+        if Call.patience is not None:
+            self.launch(PatienceTimer())
         # start process:        
         while True:
             #~ for i in range(0, Call.predicted_calls):
@@ -163,59 +427,324 @@ class CallCenterSim(Simulator):
                 #~ yield 5.0/3600
                 #~ yield (1.0/rate)/3600
             #~ yield Listener('AgentIsIdle')  
+            if Call.lookahead_horizon > 0:
+                now = self.sim.clock.get()
+                Call.talk_elapsed = [now - end + duration
+                    for kind, end, duration in Call.inflight.itervalues() if kind == TALKING]
+                Call.wrapup_remaining = [end - now
+                    for kind, end, duration in Call.inflight.itervalues() if kind == WRAPUP]
             Call.predicted_calls = CallCenterSim.solver.predict_outgoing_calls()
 
-
-            for i in range(0, Call.predicted_calls): self.launch(Call())
+            if CallCenterSim.leads is not None:
+                queue = CallCenterSim.leads
+                shortfall = Call.predicted_calls
+                while True:
+                    now = CallCenterSim.day_start + CallCenterSim.clock_offset + self.sim.clock.get()
+                    dialed = queue.pop(shortfall, now)
+                    for lead in dialed:
+                        call = Call()
+                        call.lead = lead
+                        self.launch(call)
+                    shortfall -= len(dialed)
+                    if shortfall <= 0 or not queue.counts[leads.PENDING]:
+                        break
+                    # leads wait for retry (window): dial only the rest
+                    # of this decision when they become ready
+                    yield CallCenterSim.lead_poll
+            else:
+                for i in range(0, Call.predicted_calls): self.launch(Call())
             
             yield Listener('AgentIsIdle')  
             #~ yield 1/CallCenterSim.rate
             #~ yield self.rng.expovariate(CallCenterSim.rate)
 
 
+# state of Call captured by snapshot (counters and controller settings):
+# (busy agents are restored from in-flight activities)
+SNAPSHOT_STATE = ('predicted_calls', 'calls_total', 'calls_answered',
+    'calls_congested', 'calls_served', 'total_service_time', 'trunks_busy', 'uptime',
+    'predict_adjust')
+
+def take_snapshot(clock):
+    """
+    Capture state of stopped run at model time clock (seconds
+    since start of run) as simtools.Snapshot.
+    """
+    inflight = [(kind, max(0, end - clock), duration)
+        for kind, end, duration in Call.inflight.itervalues()]
+    # waiting calls are appended in order of waiting (restored in the same order):
+    inflight.sort()
+    inflight.extend((WAITING, max(0, expires - clock), 0)
+        for handle, expires in CallCenterSim.waiting.itervalues())
+    return simtools.Snapshot(CallCenterSim.clock_offset + clock,
+        dict((name, getattr(Call, name)) for name in SNAPSHOT_STATE),
+        CallCenterSim.solver.getstate(), inflight)
+
+def warmup(sim, hours, streams=None):
+    """
+    Simulate warm-up period from empty center, return snapshot
+    of its end; branches started with CallCenterSim.warm = snapshot
+    continue from it.
+    """
+    CallCenterSim.warm = None
+    CallCenterSim.streams = streams or simtools.Streams(-1)
+    sim.single_run(hours * 3600)
+    return take_snapshot(hours * 3600)
+
 def compute_abandoned():
     try:
         return float(Call.calls_answered - Call.calls_served) / Call.calls_answered
     except ZeroDivisionError:
         return 0        
 
+# metrics of trajectory recorded by Collector:
+TRAJECTORY = ('abandon_rate', 'abandon_recent', 'duration_recent', 'idle_agents',
+    'idle_min', 'predicted_calls', 'predict_adjust', 'integrator', 'utilization',
+    'trunks_busy', 'waiting', 'leads_pending')
+
 class Collector(Process):
-    """Periodically collects customer happiness to a time series."""
-    collect_interval = 60*10
+    """
+    Periodically samples state of call center (TRAJECTORY) into
+    columnar recorder; long runs are downsampled to capacity.
+    Recent metrics decay (or slide) with period of recent seconds.
+    """
+    collect_interval = 10 # seconds
+    capacity = 4096
+    recent = 15 * 60 # seconds
 
     @Chain
     def initialize(self):
-        self.stat = TSeries(storing=True, time_fnc=self.sim.clock.get, time_scale=10.0*3600)
+        self.recorder = recorder.Recorder(TRAJECTORY, self.capacity)
+        sample = self.recorder.sample
+        clock = self.sim.clock.get
+        # decayed rates of answered and served calls, min of idle agents:
+        answered = statistics.DecayedStats(self.recent)
+        served = statistics.DecayedStats(self.recent)
+        idle = statistics.WindowedExtrema(self.recent)
+        counts = Call.calls_answered, Call.calls_served
         while True:
-            self.stat.collect(100.0 * (compute_abandoned()))
+            now = clock()
+            pool = CallCenterSim.pool
+            answered.append(Call.calls_answered - counts[0], now)
+            served.append(Call.calls_served - counts[1], now)
+            counts = Call.calls_answered, Call.calls_served
+            idle.append(Call.idle_agents, now)
+            # by name: order of columns always follows TRAJECTORY
+            values = {
+                'abandon_rate': compute_abandoned(),
+                'abandon_recent': max(0, 1 - served.mean / answered.mean) if answered.mean else 0,
+                'duration_recent': Call.recent_duration.mean,
+                'idle_agents': Call.idle_agents,
+                'idle_min': idle.min,
+                'predicted_calls': Call.predicted_calls,
+                'predict_adjust': Call.predict_adjust,
+                'integrator': CallCenterSim.solver.getstate().get('integrator', 0),
+                'utilization': pool.busy / pool.size if pool.size else 0,
+                'trunks_busy': Call.trunks_busy,
+                'waiting': len(CallCenterSim.waiting),
+                'leads_pending': CallCenterSim.leads.counts[leads.PENDING]
+                    if CallCenterSim.leads is not None else 0,
+            }
+            sample(CallCenterSim.clock_offset + now, [values[name] for name in TRAJECTORY])
             yield self.collect_interval
 
-def main_collection():
-    colors = ("red", "green", "blue", "yellow", "black")
-    plotter = Plotter()
-    n_agents = 23
-    for n in (n_agents,):
-        print "n =", n
-        CallCenterSim.total_agents = n
-        sim = CallCenterSim("callcenter")
-        sim.stack.trace = False
-        sim["collector"] = Collector()
-        
-        axes = plotter.add_axes()
-        for run in xrange(5):
-            sim.single_run(10*3600) # 10 hour
-            sim["collector"].stat.run_chart(axes=axes, color=colors[run])
-            pcnt_abandoned = compute_abandoned()
-            print "\trun %d, abandoned = %.2f%%, total = %i, served = %i, answered = %i, idle time rate (percent): %f" % (run, 100.0 * pcnt_abandoned, Call.calls_total, Call.calls_served, Call.calls_answered, 100-(Call.total_service_time *100) / (10 * 3600 * n))
-        axes.set_title("%d lines and staff" % (n,))
-        axes.set_xlabel("Time (days)")
-        axes.set_ylabel("Abandoned calls (%)")
-        axes.set_ylim(0, 100)
-        plotter.update()
-        
-        print '---'
-        print "\trun Summary:, abandoned = %.2f%%, total = %i, served = %i, answered = %i, idle time rate (percent): %f" % (100.0 * pcnt_abandoned, Call.calls_total, Call.calls_served, Call.calls_answered, 100-(Call.total_service_time *100 ) / (10 * 3600 * n_agents))
-        raw_input('Press "Enter" to continue')
+def replication_metrics(hours):
+    "Metrics of finished run (period after warm-start snapshot only)"
+    base = CallCenterSim.warm.state if CallCenterSim.warm is not None else {}
+    def delta(name):
+        return getattr(Call, name) - base.get(name, 0)
+    answered = delta('calls_answered')
+    agents = CallCenterSim.pool.summary(hours * 3600)
+    metrics = {
+        'abandon_rate': (answered - delta('calls_served')) / answered if answered else 0,
+        'idle_rate': 1 - delta('total_service_time') / (hours * 3600 * Call.total_agents),
+        'calls_total': delta('calls_total'),
+        'calls_served': delta('calls_served'),
+        'calls_answered': answered,
+        'calls_congested': delta('calls_congested'),
+        'occupancy_min': agents['occupancy_min'],
+        'occupancy_max': agents['occupancy_max'],
+        'fairness': agents['fairness'],
+    }
+    if CallCenterSim.leads is not None:
+        lists = CallCenterSim.leads.summary()
+        for name in ('done', 'exhausted', 'pending', 'attempts'):
+            metrics['leads_' + name] = lists[name]
+    return metrics
+
+# metrics with confidence intervals:
+ESTIMATED = ('abandon_rate', 'idle_rate')
+
+def parsecompare(text):
+    """
+    Parse "<setting>=<value>,<value>,..." (first value is baseline).
+    """
+    name, sep, values = text.partition('=')
+    if not sep or not hasattr(Call, name):
+        raise report.EReportError('Option --compare must be <setting of Call>=<value>,<value>,...')
+    try:
+        return name, [float(value) for value in values.split(',')]
+    except ValueError:
+        raise report.EReportError('Values of --compare must be numbers!')
+
+def main_collection(argv):
+    """
+    Usage: dctr-khronos-sim.py [--agents=23] [--trunks=60] [--hours=10]
+        [--runs=20] [--min_runs=3] [--precision=0.05] [--tolerance=0.001]
+        [--confidence=0.95] [--seed=0] [--antithetic]
+        [--compare=<setting>=<value>,<value>,...]
+        [--warmup=<hours>] [--snapshot=<file>]
+        [--wrapup=<seconds>] [--speed_spread=<sigma>]
+        [--patience=<mean seconds> | --patience_model=<file>]
+        [--lookahead=<horizon seconds>]
+        [--leads=<count>|<file> [--attempts=3] [--retry=<seconds>] [--window=9-21]]
+        [--sample=<seconds>] [--capacity=4096] [--trajectory=<file>]
+        [--format=json|csv|text] [--plot=<file.png>] [--show]
+    Replications are run until confidence intervals of abandon and
+    idle rates are within relative precision (or absolute tolerance),
+    at most --runs replications. With --compare every setting value
+    is run with common random numbers and differences against the
+    first value are estimated. With --warmup every replication forks
+    from snapshot of the end of single warm-up run (stored to/loaded
+    from --snapshot file); metrics cover period after warm-up only.
+    --wrapup sets after-call work of agents, --speed_spread draws
+    handling-time factors of agents (lognormal with mean 1).
+    With --patience (exponential) or --patience_model (stored by
+    statistics.Distribution.store()) answered calls wait for agent
+    until patience runs out, otherwise they are abandoned at once.
+    --lookahead dials for agents expected to finish talk (and
+    wrap-up) within horizon (e.g., mean dialing_duration reported by parse_log),
+    compare with --compare=lookahead_horizon=0,<seconds>.
+    With --leads every run dials concrete leads of calling list
+    (fresh list of count leads or list stored by leads.LeadQueue)
+    with at most --attempts attempts, retry after --retry seconds
+    within calling window (hours of day): list depletion is modeled.
+    State of center (TRAJECTORY) is sampled every --sample seconds,
+    at most --capacity samples per run (longer runs are downsampled);
+    --trajectory stores samples of all runs (JSON for .json files,
+    binary frames of recorder module otherwise). The chart of
+    abandoned calls is rendered only if --plot or --show is specified.
+    """
+    try:
+        options, args = report.parseargs(argv, {'agents': '23', 'trunks': '60', 'runs': '20',
+            'min_runs': '3', 'hours': '10', 'precision': '0.05', 'tolerance': '0.001',
+            'confidence': '0.95', 'seed': '0', 'antithetic': False, 'compare': None,
+            'warmup': '0', 'snapshot': None, 'wrapup': '0', 'speed_spread': '0',
+            'patience': None, 'patience_model': None, 'lookahead': '0',
+            'leads': None, 'attempts': '3', 'retry': '3600', 'window': '9-21',
+            'sample': '10', 'capacity': '4096', 'trajectory': None,
+            'format': 'json', 'plot': None, 'show': False})
+        compared = parsecompare(options['compare']) if options['compare'] else None
+    except report.EReportError as e:
+        print e
+        print main_collection.__doc__
+        return 2
+    n_agents = int(options['agents'])
+    CallCenterSim.trunks = int(options['trunks'])
+    Call.wrapup_time = float(options['wrapup'])
+    if options['patience_model']:
+        Call.patience = statistics.loadmodel(options['patience_model'])
+    elif options['patience']:
+        Call.patience = statistics.Exponential(1 / float(options['patience']))
+    spread = float(options['speed_spread'])
+    if spread > 0:
+        rng = simtools.Streams(int(options['seed']))['speeds']
+        CallCenterSim.agent_speeds = [rng.lognormvariate(-spread * spread / 2, spread)
+            for i in xrange(n_agents)]
+    if options['leads']:
+        try:
+            start, end = [float(hour) * 3600 for hour in options['window'].split('-')]
+            CallCenterSim.lead_attempts = int(options['attempts'])
+            CallCenterSim.lead_retry = float(options['retry'])
+            CallCenterSim.lead_list = options['leads'] if os.path.exists(options['leads']) \
+                else int(options['leads'])
+        except ValueError:
+            print 'Option --leads must be number or file, --window (<hour>-<hour>), --attempts and --retry - numbers!'
+            return 2
+        CallCenterSim.lead_window = (start, end)
+    # settings of Call for all runs (compared setting overrides them):
+    defaults = {'lookahead_horizon': float(options['lookahead'])}
+    CallCenterSim.settings = defaults
+    hours = float(options['hours'])
+    stopping = {
+        'precision': float(options['precision']),
+        'tolerance': float(options['tolerance']),
+        'confidence': float(options['confidence']),
+        'min_runs': int(options['min_runs']),
+        'max_runs': int(options['runs']),
+        'seed': int(options['seed']),
+        'antithetic': bool(options['antithetic']),
+    }
+    plotting = (options['plot'] or options['show']) and not compared
+    Collector.collect_interval = float(options['sample'])
+    Collector.capacity = int(options['capacity'])
+
+    CallCenterSim.total_agents = n_agents
+    sim = CallCenterSim("callcenter")
+    sim.stack.trace = False
+    sim["collector"] = Collector()
+    replications = [0]
+    # trajectories of replications:
+    recorders = []
+
+    warm = None
+    if options['snapshot'] and os.path.exists(options['snapshot']):
+        warm = simtools.Snapshot().load(options['snapshot'])
+    elif float(options['warmup']) > 0:
+        warm = warmup(sim, float(options['warmup']))
+        if options['snapshot']:
+            warm.store(options['snapshot'])
+    CallCenterSim.warm = warm
+
+    def run(streams, settings=None):
+        CallCenterSim.streams = streams
+        CallCenterSim.settings = dict(defaults, **(settings or {}))
+        sim.single_run(hours * 3600)
+        recorders.append(sim["collector"].recorder)
+        replications[0] += 1
+        return replication_metrics(hours)
+
+    def store_trajectory():
+        if not options['trajectory']:
+            return
+        if options['trajectory'].endswith('.json'):
+            with open(options['trajectory'], 'w') as f:
+                report.emit({'sample': Collector.collect_interval,
+                    'runs': [r.export() for r in recorders]}, 'json', f)
+        else:
+            recorder.storeall(recorders, options['trajectory'])
+
+    confidence = stopping['confidence']
+    if compared:
+        name, values = compared
+        results = simtools.compare(values, lambda value, streams: run(streams, {name: value}),
+            ESTIMATED, **stopping)
+        store_trajectory()
+        report.emit({'agents': n_agents, 'hours': hours, 'setting': name, 'values': values,
+            'replications': replications[0],
+            'baseline': dict((metric, estimate.summary(confidence))
+                for metric, estimate in results[0].iteritems()),
+            'differences': [dict((metric, estimate.summary(confidence))
+                for metric, estimate in results[k].iteritems()) for k in xrange(1, len(values))]
+        }, options['format'])
+        return 0
+
+    estimates, observations = simtools.replicate(run, ESTIMATED, **stopping)
+    store_trajectory()
+    if plotting:
+        report.plot([('run {}'.format(i), [t / 3600 for t in r.times],
+                [100.0 * rate for rate in r.column('abandon_rate')])
+                for i, r in enumerate(recorders)],
+            options['plot'], title='{} lines and staff'.format(n_agents),
+            xlabel='Time (hours)', ylabel='Abandoned calls (%)', show=options['show'])
+
+    report.emit({'agents': n_agents, 'hours': hours, 'replications': replications[0],
+        'warm_start': str(warm) if warm is not None else None,
+        'runs': [dict(observation, run=i) for i, observation in enumerate(observations)],
+        'summary': dict((metric, estimate.summary(confidence))
+            for metric, estimate in estimates.iteritems())
+    }, options['format'])
+    return 0
 
 if __name__ == "__main__":
-    main_collection()
\ No newline at end of file
+    sys.exit(main_collection(sys.argv))
@@ -1,5 +1,14 @@
 # fix division problem:
 from __future__ import division
+
+# Module is imported by per-decision entry points (dctr-cli.py,
+# dctr-decide.py): keep import surface minimal and at module level,
+# no statistics, numpy or matplotlib here.
+import sys
+import math
+import time
+import weakref
+from bisect import bisect_left
 ##############################################
 # Exceptions
 ##############################################
@@ -24,6 +33,12 @@ class ECliError(EEnvironmentError):
     """
     pass
 
+class ESolverInputError(EEnvironmentError):
+    """
+    Invalid value of input field (CLI argument, request field)
+    """
+    pass
+
 ##############################################
 # ENVIRONMENT SNAPSHOT classes
 ##############################################
@@ -37,6 +52,10 @@ TYPE_BOOL = type(False)
 TYPE_LIST = type([])
 TYPE_DICT = type({})
 TYPE_OBJ = type(object)
+# values copied between environments (numbers and strings;
+# concrete types instead of numbers.Number: import of "numbers"
+# costs more than the rest of startup of entry points):
+TYPE_VALUES = (int, long, float, complex, TYPE_STRING,)
 TYPE_FUNC = type(ftype)
 
 
@@ -69,7 +88,6 @@ class Environment(object):
             setattr(self, name, value)
 
     def _enumownprops(self):
-        import numbers
         buff = []
         attr_names = dir(self)
 
@@ -79,7 +97,7 @@ class Environment(object):
                 continue
             # Bypass complex type(s)
             value = getattr(self, name)
-            if isinstance(value, (numbers.Number, TYPE_STRING,)):
+            if isinstance(value, TYPE_VALUES):
                 buff.append(name)
         buff.sort()
         return buff
@@ -94,18 +112,29 @@ class Environment(object):
         return buff
         
     
-    def extendfrom(self, source):
+    def extendfrom(self, source, changed_only=False):
         """
         Apply all public fields and their values 
         from other "environment" (swallow copy).
         Note that "source" can be object of
         any type (e.g., named tuple).
+        With changed_only=True only attributes changed
+        in source (TrackedEnvironment) are copied
+        (changes of source are cleared).
         """
         if not isinstance(source, Environment):
             raise EEnvironmentError( \
                 '.extendfrom() argument must be an Environment instance!')
             
-        attr_names = source._enumownprops()
+        if changed_only:
+            if not isinstance(source, TrackedEnvironment):
+                raise EEnvironmentError( \
+                    '.extendfrom(changed_only=True) requires TrackedEnvironment source!')
+            attr_names = [name for name in source.changes()
+                if isinstance(getattr(source, name), TYPE_VALUES)]
+            source.clearchanges()
+        else:
+            attr_names = source._enumownprops()
 
         for name in attr_names:
             # private or protected attr:
@@ -125,6 +154,91 @@ class Environment(object):
         return self 
         # end of "extend"
 
+class TrackedEnvironment(Environment):
+    """
+    Environment which tracks changes of public attributes,
+    so only changed values can be copied (or re-validated).
+
+    >>> e1 = TrackedEnvironment(a=1, b=2).clearchanges()
+    >>> e1.a = 2
+    >>> e1.changes()
+    ['a']
+    >>> Environment().extendfrom(e1, changed_only=True).dump()
+    ['a:2']
+    >>> e1.changes()
+    []
+    """
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name[0] != '_':
+            # track changed attrs:
+            try:
+                self.__dict__['_changed'].add(name)
+            except KeyError:
+                self.__dict__['_changed'] = set((name,))
+
+    def changes(self):
+        "Return names of public attributes changed since last .clearchanges()"
+        return sorted(self.__dict__.get('_changed', ()))
+
+    def clearchanges(self):
+        self.__dict__['_changed'] = set()
+        return self # for chaining
+
+class OverlayEnvironment(TrackedEnvironment):
+    """
+    Layered view of environment: own attributes override
+    attributes of base environment, other reads fall through
+    to base (no copying of base values). Changes of own
+    attributes are tracked.
+
+    >>> base = Environment(a=1, b=2)
+    >>> e = OverlayEnvironment(base, b=20)
+    >>> e.a, e.b, base.b
+    (1, 20, 2)
+    >>> e.dump()
+    ['a:1', 'b:20']
+    >>> base.a = 10
+    >>> e.a
+    10
+    """
+
+    def __init__(self, base, **kwargs):
+        if not isinstance(base, Environment):
+            raise EEnvironmentError( \
+                'Base of overlay must be an Environment instance!')
+        self.__dict__['_base'] = base
+        TrackedEnvironment.__init__(self, **kwargs)
+
+    def __getattr__(self, name):
+        # called only for attributes missing in overlay:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.__dict__['_base'], name)
+
+    def _enumownprops(self):
+        names = set(self._base._enumownprops())
+        names.update(Environment._enumownprops(self))
+        return sorted(names)
+
+def parsenumber(name, text):
+    """
+    Convert text value of field to integer or float number.
+    >>> parsenumber('a', ' 10'), parsenumber('b', '0.05')
+    (10, 0.05)
+    """
+    text = text.strip(" ") # remove spaces
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        raise ESolverInputError(
+            'Value of "{}" must be a number!'.format(name))
+
 class CLIEnvironment(Environment):
     """
     Datamodel with CLI source.
@@ -142,12 +256,16 @@ class CLIEnvironment(Environment):
         # here is 5-minutes depth
         'calls_total', # all outbound calls
         'calls_answered', # served + abandoned
-        #~ 'calls_congested', # rejected calls due to network overload
         'calls_served', # call processed by agents
 
         'uptime', # uptime in seconds
         'interval' # interval from last call in seconds
     ]
+
+    # arguments with default values:
+    optional = {
+        'calls_congested': 0, # rejected calls due to network overload
+    }
     
     hint = {
         'idle_agents': 'Number of idle (free) agents',
@@ -157,7 +275,7 @@ class CLIEnvironment(Environment):
         # here is 5-minutes depth
         'calls_total': 'All dialed outbound calls (integer)', # all outbound calls
         'calls_answered': 'All answered calls (including voicemal, fax)  (integer)', # served + abandoned
-        #~ 'calls_congested', # rejected calls due to network overload
+        'calls_congested': 'Calls rejected due to network overload (integer, optional)',
         'calls_served': 'Calls processed by agents  (integer)',
 
         'uptime': 'Uptime of call center in seconds',
@@ -184,34 +302,27 @@ Where:
         
     def __init__(self, **kwargs):
         Environment.__init__(self, **kwargs)
-        try:
-            import sys
-        except ImportError:
-            raise ECliError(
-                'Module "sys" is not available.\nCommand-line option disabled.')
         args = sys.argv
         data = {}
         
         # parse arg text and perform type conversion:
         for pair in args[1:]: 
+            # ^ bypass the first arg, it is script name
             try:
-                # ^ bypass the first arg, it is script name
                 name, value = pair.split("=")
-                value = value.strip(" ") # remove spaces
-                data[name] = int(value)
             except ValueError:
-                # value cannot be converted to integer
-                raise ESolverInputError(
-                    "Argument value must be an integer number!")
+                raise ECliError(
+                    'Argument "{}" must be in format <name>=<value>!'.format(pair))
+            data[name] = parsenumber(name, value)
         
         # Extract values from parsed arg text:
         for name in CLIEnvironment.required:
             try:
                 setattr(self, name, data[name])
             except KeyError:
-                # Print hint and exit:
-                print self.help()
-                sys.exit()
+                raise ECliError(self.help())
+        for name, default in CLIEnvironment.optional.items():
+            setattr(self, name, data.get(name, default))
 
 class PIEnvironment(Environment):
 
@@ -219,6 +330,7 @@ class PIEnvironment(Environment):
         # Set default constants:
         self.ctr_integral_gain = 0.05
         self.ctr_proportional_gain = 2.0
+        self.ctr_congestion_gain = 1.0
         self.predict_adjust = 100.0
 
         self.uptime_threshold = 5 * 60 # 5 minutes
@@ -234,7 +346,7 @@ class PIEnvironment(Environment):
 
         self.calls_total = 0 # all outbound calls
         self.calls_answered = 0 # served + abandoned
-        #~ self.calls_congested = 0 # rejected calls due to network overload
+        self.calls_congested = 0 # rejected calls due to network overload
         self.calls_served = 0 # call processed by agents
 
         self.uptime = 0 # uptime in seconds
@@ -244,6 +356,262 @@ class PIEnvironment(Environment):
         # othwervise **kwarg values will be lost:
         Environment.__init__(self, **kwargs)
 
+##############################################
+# CACHE classes
+##############################################
+
+def quantize_rate(rate, quantum=0.001):
+    """
+    Round rate (e.g., connection rate) to the quantum
+    (0.1% by default) and return it as integer key.
+    >>> quantize_rate(0.33349)
+    333
+    >>> quantize_rate(0.3336)
+    334
+    """
+    return int(round(rate / quantum))
+
+def quantize_agents(agents):
+    """
+    Agents are counted in whole numbers only.
+    >>> quantize_agents(10.7)
+    10
+    """
+    return int(agents)
+
+class SolverCache(object):
+    """
+    Bounded LRU cache (with optional TTL) for solver sub-computations.
+    Keys must be hashable, use quantize_*() functions to build
+    keys from "almost the same" inputs.
+    Size is limited by number of entries and (optionally) by
+    estimated memory footprint in bytes.
+
+    >>> cache = SolverCache(max_entries=2)
+    >>> cache.lookup(('erlang', 10, quantize_rate(0.3334)), lambda: 42)
+    42
+    >>> cache.lookup(('erlang', 10, quantize_rate(0.3331)), lambda: 0)
+    42
+    >>> cache.put('a', 1).put('b', 2)
+    SolverCache: entries: 2, hits: 1, misses: 1, evictions: 1
+    >>> ('erlang', 10, 333) in cache
+    False
+    >>> cache.get('a')
+    1
+    >>> cache.stats()['hits']
+    2
+
+    Expired entries are dropped on access:
+
+    >>> now = [0]
+    >>> cache = SolverCache(ttl=10, clock=lambda: now[0])
+    >>> cache.put('k', 'v').get('k')
+    'v'
+    >>> now[0] = 11
+    >>> cache.get('k') is None
+    True
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None, clock=None):
+        # imported on demand (once per cache): collections is heavy
+        # for startup of entry points, which do not use cache
+        from collections import OrderedDict
+        if max_entries < 1:
+            raise ESolverError('Cache size must be positive!')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock or time.time
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(key, value):
+        "Estimated memory footprint of the entry"
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+    def _evict(self):
+        # remove least recently used items:
+        while len(self._data) > self.max_entries or \
+            (self.max_bytes is not None and self._bytes > self.max_bytes \
+                and len(self._data) > 1):
+            key, (value, expires, size) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        "Return cached value and mark it as recently used"
+        try:
+            value, expires, size = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires is not None and self._clock() >= expires:
+            self._bytes -= size
+            self.misses += 1
+            return default
+        # re-insert as the most recently used:
+        self._data[key] = (value, expires, size)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        "Store value"
+        if key in self._data:
+            self._bytes -= self._data.pop(key)[2]
+        expires = None if self.ttl is None else self._clock() + self.ttl
+        size = self._sizeof(key, value) if self.max_bytes is not None else 0
+        self._data[key] = (value, expires, size)
+        self._bytes += size
+        self._evict()
+        return self # for chaining
+
+    def lookup(self, key, compute, *args):
+        "Return cached value, call compute(*args) on miss"
+        missing = self._data # unique marker
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute(*args)
+            self.put(key, value)
+        return value
+
+    def memoize(self, keyfunc):
+        """
+        Decorator for solver functions; keyfunc(*args)
+        must return quantized key for arguments.
+        """
+        def decorator(fn):
+            def wrapper(*args):
+                return self.lookup((fn.__name__, keyfunc(*args)), fn, *args)
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            return wrapper
+        return decorator
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+        return self # for chaining
+
+    def stats(self):
+        "Return counters (e.g., for monitoring)"
+        return {
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __str__(self):
+        return 'SolverCache: entries: {}, hits: {}, misses: {}, evictions: {}' \
+            .format(len(self), self.hits, self.misses, self.evictions)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+##############################################
+# INSTRUMENTATION
+##############################################
+
+# Decision branches (fallback reasons):
+BRANCH_PREDICTIVE = 'predictive'
+REASON_INVALID_INPUT = 'Critical error: e.calls_total < e.calls_answered'
+REASON_IDLE_AGENTS = 'idle_agents below threshold'
+REASON_UPTIME = 'uptime below threshold'
+REASON_CALLS_ANSWERED = 'calls_answered below threshold'
+REASON_PREDICT_ADJUST = 'predict_adjust is 0'
+REASON_ABANDONED = 'n_abandoned_calls over threshold'
+REASON_CALLS_TOTAL = 'calls_total is zero'
+REASON_CONNECTION_RATE = 'connection_rate is zero'
+
+# same as timeit.default_timer (without import of timeit):
+_timer = time.clock if sys.platform == 'win32' else time.time
+
+def print_decision(record):
+    "Print decision record (replacement for debug output)"
+    if record['branch'] != BRANCH_PREDICTIVE:
+        print record['branch']
+    for name in ('abandon_rate', 'P_value', 'I_value', 'integrator', 'predict_adjust'):
+        if record[name] is not None:
+            print '{}={}'.format(name, record[name])
+
+class DecisionProfiler(object):
+    """
+    Sampled histogram of decision latency.
+    Every "sample_every"-th decision is timed, latency
+    is counted in buckets with upper bounds in microseconds
+    (the last bucket is open).
+
+    >>> p = DecisionProfiler(sample_every=2, bounds=(10, 100))
+    >>> [p.sample() for i in range(4)]
+    [False, True, False, True]
+    >>> p.record(0.000005).record(0.00005).record(0.5)
+    DecisionProfiler: samples: 3, mean: 166685.0us
+    >>> p.export()['counts']
+    [1, 1, 1]
+    """
+
+    default_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self, sample_every=100, bounds=None):
+        self.sample_every = max(1, int(sample_every))
+        self.bounds = tuple(bounds or self.default_bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.samples = 0
+        self.total_us = 0.0
+        self._countdown = self.sample_every
+
+    def sample(self):
+        "Return True if current decision must be timed"
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self.sample_every
+        return True
+
+    def record(self, seconds):
+        "Count latency (in seconds)"
+        us = seconds * 1000000
+        self.counts[bisect_left(self.bounds, us)] += 1
+        self.samples += 1
+        self.total_us += us
+        return self # for chaining
+
+    @property
+    def mean(self):
+        "Mean latency in microseconds"
+        try:
+            return self.total_us / self.samples
+        except ZeroDivisionError:
+            return 0
+
+    def export(self):
+        "Return histogram as dict (e.g., for JSON export)"
+        return {
+            'sample_every': self.sample_every,
+            'bounds_us': list(self.bounds),
+            'counts': list(self.counts),
+            'samples': self.samples,
+            'mean_us': self.mean
+        }
+
+    def __str__(self):
+        return 'DecisionProfiler: samples: {}, mean: {}us'.format(self.samples, self.mean)
+
+    def __repr__(self):
+        return self.__str__()
+
 
 ##############################################
 # SOLVER classes
@@ -256,8 +624,12 @@ class Solver(object):
     """
     required = []
 
-    def __init__(self, environment=None):
+    def __init__(self, environment=None, cache=None):
         self.e = None
+        # optional SolverCache for expensive sub-computations:
+        self.cache = cache
+        # callables hook(solver, record) for each decision record:
+        self.hooks = []
         if environment:
             self.observe(environment)
             
@@ -273,6 +645,32 @@ class Solver(object):
                 raise ESolverError(
                     "Environment does not correspond to solver:\n required attribute '{}' missed!".format(key))
         pass
+
+    def add_hook(self, hook):
+        "Register callable hook(solver, record) for decision records"
+        self.hooks.append(hook)
+        return self # for chaining
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+        return self # for chaining
+
+    def cached(self, key, compute, *args):
+        """
+        Return result of compute(*args) through the solver cache
+        (if cache is assigned), key must be quantized.
+        """
+        if self.cache is None:
+            return compute(*args)
+        return self.cache.lookup(key, compute, *args)
+
+    def getstate(self):
+        "Internal state of solver as dict (e.g., for warm start of simulation)"
+        return {}
+
+    def setstate(self, state):
+        "Restore state returned by .getstate()"
+        return self # for chaining
         
     def predict_outgoing_calls(self):
         """
@@ -294,7 +692,7 @@ class PIController(ProgressiveSolver):
     >>> e = PIEnvironment(idle_agents=10,calls_total=1000,calls_answered=300,calls_served=299,uptime=1000,interval=300)
     >>> c = PIController(e)
     >>> c.e.dump()
-    ['calls_answered:300', 'calls_served:299', 'calls_threshold:10', 'calls_total:1000', 'ctr_integral_gain:0.05', 'ctr_proportional_gain:2.0', 'idle_agents:10', 'interval:300', 'max_abandon_calls:0.03', 'min_idle_agents:3', 'predict_adjust:150.0', 'target_abandon_calls:0.025', 'uptime:1000', 'uptime_threshold:300']
+    ['calls_answered:300', 'calls_congested:0', 'calls_served:299', 'calls_threshold:10', 'calls_total:1000', 'ctr_congestion_gain:1.0', 'ctr_integral_gain:0.05', 'ctr_proportional_gain:2.0', 'idle_agents:10', 'interval:300', 'max_abandon_calls:0.03', 'min_idle_agents:3', 'predict_adjust:150.0', 'target_abandon_calls:0.025', 'uptime:1000', 'uptime_threshold:300']
 
     >>> c.predict_outgoing_calls()
     10
@@ -320,110 +718,528 @@ class PIController(ProgressiveSolver):
         # here is 5-minutes depth
         'calls_total', # all outbound calls
         'calls_answered', # served + abandoned
-        #~ 'calls_congested', # rejected calls due to network overload
         'calls_served', # call processed by agents
 
         'uptime', # uptime in seconds
         'interval' # interval from last call in seconds
     ]
+
+    # optional inputs (environment may omit them) with default values:
+    optional = {
+        'ctr_congestion_gain': 1.0,
+        'calls_congested': 0, # rejected calls due to network overload (same depth as calls_total)
+    }
     
-    def __init__(self, environment=None):
-        ProgressiveSolver.__init__(self, environment)
+    def __init__(self, environment=None, cache=None):
+        ProgressiveSolver.__init__(self, environment, cache)
         self.integrator = 0
         self.lasterror = ''
-    
+        # counters of decisions per fallback reason:
+        self.fallbacks = {}
+        # optional DecisionProfiler:
+        self.profiler = None
+        # optional AntiWindup (set by the stage of SolverPipeline):
+        self.windup = None
+
     def predict_outgoing_calls(self, debug=False):
-        def _trace(msg=None): 
-            if debug: 
-                print msg or self.lasterror
-        
-        import math
-        
-        e = self.e
-        
-        #~ _trace('\nActual values for environment:')
-        #~ _trace('\n'.join(e.dump()))
-        #~ _trace('\n')
-        
+        """
+        Return recommended number of outgoing calls.
+        With debug=True decision record is printed.
+        """
+        profiler = self.profiler
+        if profiler is not None and profiler.sample():
+            started = _timer()
+            calls = self._predict(debug)
+            profiler.record(_timer() - started)
+            return calls
+        return self._predict(debug)
+
+    def _predict(self, debug):
+        traced = debug or self.hooks
+        if traced:
+            e = self.e
+            inputs = dict((name, getattr(e, name)) for name in self.required)
+            for name, default in self.optional.iteritems():
+                inputs[name] = getattr(e, name, default)
+
+        calls, reason, abandon_rate, P_value, I_value = self._decide(self.e)
+
+        # back off in every branch (predictive and progressive):
+        calls = self._backoff(self.e, calls)
+
+        if reason is not None:
+            self.lasterror = reason
+            self.fallbacks[reason] = self.fallbacks.get(reason, 0) + 1
+
+        if traced:
+            record = {
+                'inputs': inputs,
+                'branch': reason or BRANCH_PREDICTIVE,
+                'abandon_rate': abandon_rate,
+                'P_value': P_value,
+                'I_value': I_value,
+                'integrator': self.integrator,
+                'predict_adjust': self.e.predict_adjust,
+                'output': calls
+            }
+            if debug:
+                print_decision(record)
+            for hook in self.hooks:
+                hook(self, record)
+        return calls
+
+    def getstate(self):
+        """
+        >>> c = PIController(PIEnvironment())
+        >>> c.integrator = 7
+        >>> PIController(PIEnvironment()).setstate(c.getstate()).integrator
+        7
+        """
+        return {'integrator': self.integrator, 'lasterror': self.lasterror,
+            'fallbacks': dict(self.fallbacks)}
+
+    def setstate(self, state):
+        self.integrator = state['integrator']
+        self.lasterror = state['lasterror']
+        self.fallbacks = dict(state['fallbacks'])
+        return self # for chaining
+
+    def _congestion(self, e):
+        """
+        Ratio of congested calls within window of counters
+        (calls_congested / calls_total): dialing recovers as
+        congested calls leave the window.
+        """
+        congested = getattr(e, 'calls_congested', 0)
+        if congested <= 0 or e.calls_total <= 0:
+            return 0.0
+        return min(1.0, float(congested) / e.calls_total)
+
+    def _backoff(self, e, calls):
+        "Scale calls down by recent congestion (rejected attempts are wasted)"
+        congestion = self._congestion(e)
+        if congestion <= 0 or calls <= 0:
+            return calls
+        backoff = 1 - getattr(e, 'ctr_congestion_gain', 1.0) * congestion
+        return math.trunc(calls * backoff) if backoff > 0 else 0
+
+    def _available(self, e):
+        "Number of agents available for dialed calls"
+        return e.idle_agents
+
+    def _decide(self, e):
+        """
+        Compute decision, return tuple:
+        (calls, fallback reason or None, abandon rate, P value, I value)
+        """
+
         # Validate dataset values
         if e.calls_total < e.calls_answered:
-            self.lasterror = 'Critical error: e.calls_total < e.calls_answered'
-            _trace()
+            self.lasterror = REASON_INVALID_INPUT
+            self.fallbacks[REASON_INVALID_INPUT] = \
+                self.fallbacks.get(REASON_INVALID_INPUT, 0) + 1
             raise ESolverError(self.lasterror)
         
         # Handle values below threshold(s):
-        
-        if e.idle_agents < e.min_idle_agents:
+
+        # idle agents (and agents expected to be released soon, see LookAheadController):
+        available = self._available(e)
+
+        if available < e.min_idle_agents:
             # return zero and wait while min_idle_agents will be available
             # otherwise we always in progressive mode!
-            self.lasterror = 'uptime below threshold'
-            _trace()
-            return 0
+            return 0, REASON_IDLE_AGENTS, None, None, None
 
         # Switch to pregressive mode in the following cases:
         if e.uptime < e.uptime_threshold:
-            self.lasterror = 'uptime below threshold'
-            _trace()
-            return ProgressiveSolver.predict_outgoing_calls(self)
+            return ProgressiveSolver.predict_outgoing_calls(self), \
+                REASON_UPTIME, None, None, None
             
         if e.calls_answered < e.calls_threshold:
-            self.lasterror = 'calls_answered below threshold'
-            _trace()
-            return ProgressiveSolver.predict_outgoing_calls(self) 
+            return ProgressiveSolver.predict_outgoing_calls(self), \
+                REASON_CALLS_ANSWERED, None, None, None
             
         if e.predict_adjust == 0:
-            self.lasterror = 'predict_adjust is 0'
-            _trace()
-            return ProgressiveSolver.predict_outgoing_calls(self) 
+            return ProgressiveSolver.predict_outgoing_calls(self), \
+                REASON_PREDICT_ADJUST, None, None, None
 
         # if current abandoned cals > 3% - switch to progressive mode
         n_abandoned_calls = float (e.calls_answered - e.calls_served) / e.calls_answered
-        _trace('abandoned rate={}'.format(n_abandoned_calls))
         
         if n_abandoned_calls > e.max_abandon_calls:
-            self.lasterror = 'n_abandoned_calls over threshold'
-            _trace()
-            return ProgressiveSolver.predict_outgoing_calls(self) 
+            return ProgressiveSolver.predict_outgoing_calls(self), \
+                REASON_ABANDONED, n_abandoned_calls, None, None
 
         connection_rate, over_dial = 0, 0
         try:
             connection_rate = float(e.calls_answered) / e.calls_total
         except ZeroDivisionError:
-            self.lasterror = 'calls_total is zero'
-            _trace()
-            return ProgressiveSolver.predict_outgoing_calls(self) 
+            return ProgressiveSolver.predict_outgoing_calls(self), \
+                REASON_CALLS_TOTAL, n_abandoned_calls, None, None
         
         try:
-            over_dial = float(e.idle_agents)/connection_rate - e.idle_agents
+            over_dial = float(available)/connection_rate - available
         except ZeroDivisionError:
-            self.lasterror = 'connection_rate is zero'
-            _trace()
-            return ProgressiveSolver.predict_outgoing_calls(self) 
+            return ProgressiveSolver.predict_outgoing_calls(self), \
+                REASON_CONNECTION_RATE, n_abandoned_calls, None, None
 
         # tune predict_adjust
         deviation = e.target_abandon_calls - n_abandoned_calls 
-        _trace('deviation={}'.format(deviation))
         
         P_value = e.ctr_proportional_gain * deviation
-        _trace('P_value={}'.format(P_value))
 
         self.integrator = self.integrator + deviation
-        _trace('self.integrator={}'.format(self.integrator))
 
-        #~ if self.integrator > 500:
-                #~ self.integrator = 500
-        #~ elif self.integrator < -500:
-                #~ self.integrator = -500
+        # clamp in the same tick (see AntiWindup stage of SolverPipeline):
+        windup = self.windup
+        if windup is not None:
+            self.integrator = windup.clamp_integrator(self.integrator)
 
         I_value = self.integrator * e.ctr_integral_gain
-        _trace('I_value={}'.format(I_value))
 
         e.predict_adjust = e.predict_adjust + (P_value + I_value) #* 100        
-        _trace('e.predict_adjust={}'.format(e.predict_adjust))
 
-        calls_to_dial = math.trunc(e.idle_agents + (over_dial * e.predict_adjust) * 0.01)
+        if windup is not None:
+            e.predict_adjust = windup.clamp_adjust(e.predict_adjust)
+
+        calls_to_dial = math.trunc(available + (over_dial * e.predict_adjust) * 0.01)
+
+        return calls_to_dial, None, n_abandoned_calls, P_value, I_value
+
+# *** Schema tables (precomputed for entry points and codecs) ***
+# all fields of PIController request, in fixed order (optional inputs at the end):
+PI_FIELDS = tuple(PIController.required) + tuple(sorted(PIController.optional))
+# fields without defaults, must be supplied by caller:
+PI_INPUTS = tuple(CLIEnvironment.required)
+# name -> True for input field, False for field with default:
+PI_SCHEMA = dict((name, name in PI_INPUTS) for name in PI_FIELDS)
+
+##############################################
+# LOOK-AHEAD (predicted release of agents)
+##############################################
+
+class HazardTable(object):
+    """
+    Survival function S(t) of call duration, tabulated with step
+    (seconds): probability that talk with elapsed time ends within
+    horizon is 1 - S(elapsed + horizon) / S(elapsed), two lookups.
+    Talks longer than all tabulated durations are expected to end.
+
+    >>> h = HazardTable.fromdurations([60, 120, 180, 240])
+    >>> h.release(0, 60), h.release(130, 60), h.release(500, 10)
+    (0.25, 0.5, 1.0)
+    >>> h.expected([0, 130, 500], 60)
+    1.75
+    """
+
+    def __init__(self, survival, step=1.0):
+        if step <= 0:
+            raise ESolverError('Step of hazard table must be positive!')
+        self.step = step
+        # S(i * step), i = 0..len - 1:
+        self.survival = list(survival)
+
+    @classmethod
+    def fromdurations(cls, durations, step=1.0):
+        "Table of empirical survival function of observed durations"
+        durations = sorted(durations)
+        n = len(durations)
+        if not n:
+            raise ESolverError('Hazard table requires observed durations!')
+        size = int(durations[-1] // step) + 1
+        # S(t) = fraction of durations over t:
+        return cls([(n - bisect_left(durations, i * step + 1e-9)) / n
+            for i in xrange(size)], step)
+
+    @classmethod
+    def fromsurvival(cls, survival, step=1.0, tail=1e-4, limit=86400):
+        """
+        Table of survival function survival(t) (e.g., of fitted model:
+        1 - cdf(t)) up to time it drops below tail (at most limit)
+        """
+        table = []
+        t = 0.0
+        while t <= limit:
+            s = survival(t)
+            table.append(s)
+            if s < tail:
+                break
+            t += step
+        return cls(table, step)
+
+    def release(self, elapsed, horizon):
+        "Probability that talk with elapsed time ends within horizon"
+        survival, step = self.survival, self.step
+        n = len(survival)
+        i = int(elapsed // step)
+        s = survival[i] if i < n else 0
+        if s <= 0:
+            return 1.0
+        j = int((elapsed + horizon) // step)
+        return 1 - (survival[j] if j < n else 0) / s
+
+    def expected(self, elapsed, horizon):
+        "Expected number of talks (elapsed times) ending within horizon"
+        # same as sum of .release(), inlined (called on every decision):
+        survival, step = self.survival, self.step
+        n = len(survival)
+        total = 0.0
+        for t in elapsed:
+            i = int(t // step)
+            s = survival[i] if i < n else 0
+            if s <= 0:
+                total += 1
+                continue
+            j = int((t + horizon) // step)
+            if j < n:
+                total += 1 - survival[j] / s
+            else:
+                total += 1
+        return total
+
+    def __str__(self):
+        return 'HazardTable: step: {}, size: {}'.format(self.step, len(self.survival))
+
+    def __repr__(self):
+        return self.__str__()
+
+class LookAheadController(PIController):
+    """
+    PI controller which counts agents expected to be released
+    within look-ahead horizon (e.g., mean dialing time, see
+    parse_log) as available: dials before agents become idle.
+    Optional attributes of environment: lookahead_horizon
+    (seconds, 0 - disabled), talk_elapsed (elapsed talk
+    times of active calls), wrapup_time (after-call work,
+    seconds) and wrapup_remaining (remaining times of agents
+    in wrap-up). Agent is released when talk ends and wrap-up
+    is finished. Cost is O(active calls).
+
+    >>> e = PIEnvironment(idle_agents=1,calls_total=1000,calls_answered=300,calls_served=299,uptime=1000,interval=300)
+    >>> h = HazardTable.fromdurations(xrange(1, 301))
+    >>> c = LookAheadController(e, hazard=h)
+    >>> c.predict_outgoing_calls(), c.lasterror
+    (0, 'idle_agents below threshold')
+    >>> e.lookahead_horizon, e.talk_elapsed = 30, [250, 280, 290, 10]
+    >>> c.predict_outgoing_calls() > 0
+    True
+    >>> e.wrapup_time, e.wrapup_remaining = 30, [5, 40]
+    >>> c._available(e)
+    2
+    """
+
+    def __init__(self, environment=None, cache=None, hazard=None):
+        PIController.__init__(self, environment, cache)
+        self.hazard = hazard
+
+    def _available(self, e):
+        horizon = getattr(e, 'lookahead_horizon', 0)
+        if self.hazard is None or horizon <= 0:
+            return e.idle_agents
+        available = e.idle_agents
+        # agents finishing wrap-up within horizon:
+        for remaining in getattr(e, 'wrapup_remaining', ()):
+            if remaining <= horizon:
+                available += 1
+        # talks followed by wrap-up must end earlier:
+        horizon -= getattr(e, 'wrapup_time', 0)
+        if horizon > 0:
+            available += self.hazard.expected(getattr(e, 'talk_elapsed', ()), horizon)
+        return available
 
-        return calls_to_dial 
+##############################################
+# PIPELINE (stability guards)
+##############################################
+
+class SolverStage(object):
+    """
+    Base class for stage of SolverPipeline.
+    .before() is called before core solver (pre-filter),
+    .after() transforms recommended number of calls (post-filter).
+    .aftermany() is batch version of .after() (for many solvers).
+    .detach() is called after core solver (also on error).
+    """
+
+    def before(self, solver):
+        pass
+
+    def detach(self, solver):
+        pass
+
+    def after(self, solver, calls):
+        return calls
+
+    def aftermany(self, solvers, calls):
+        return [self.after(solver, n) for solver, n in zip(solvers, calls)]
+
+class AntiWindup(SolverStage):
+    """
+    Clamp integrator of PI controller within [-limit, limit] and
+    predict_adjust within [min_adjust, max_adjust]: the stage is
+    attached to controller during decision, which clamps both right
+    after update (before calls of the same decision are computed);
+    restored state is clamped before decision. Solvers without
+    integrator are not affected.
+    min_adjust must be positive: predict_adjust of 0 switches
+    controller to progressive mode for good (REASON_PREDICT_ADJUST).
+    """
+
+    def __init__(self, limit=500, min_adjust=1, max_adjust=1000):
+        self.limit = limit
+        self.min_adjust = min_adjust
+        self.max_adjust = max_adjust
+
+    def clamp_integrator(self, integrator):
+        limit = self.limit
+        if integrator > limit:
+            return limit
+        if integrator < -limit:
+            return -limit
+        return integrator
+
+    def clamp_adjust(self, predict_adjust):
+        if predict_adjust > self.max_adjust:
+            return self.max_adjust
+        if predict_adjust < self.min_adjust:
+            return self.min_adjust
+        return predict_adjust
+
+    def before(self, solver):
+        if not hasattr(solver, 'integrator'):
+            return
+        solver.windup = self
+        solver.integrator = self.clamp_integrator(solver.integrator)
+        solver.e.predict_adjust = self.clamp_adjust(solver.e.predict_adjust)
+
+    def detach(self, solver):
+        if getattr(solver, 'windup', None) is self:
+            solver.windup = None
+
+class MaxCallsPerTick(SolverStage):
+    "Limit number of calls per decision"
+
+    def __init__(self, limit):
+        self.limit = limit
+
+    def after(self, solver, calls):
+        return calls if calls < self.limit else self.limit
+
+    def aftermany(self, solvers, calls):
+        limit = self.limit
+        return [n if n < limit else limit for n in calls]
+
+class TrunkCapacityCap(SolverStage):
+    """
+    Limit number of calls by free trunks: trunks - busy trunks
+    (attribute 'trunks_busy' of environment, if present).
+    """
+
+    def __init__(self, trunks, busy_attr='trunks_busy'):
+        self.trunks = trunks
+        self.busy_attr = busy_attr
+
+    def after(self, solver, calls):
+        free = self.trunks - getattr(solver.e, self.busy_attr, 0)
+        if free < 0:
+            free = 0
+        return calls if calls < free else free
+
+class SlewRateLimit(SolverStage):
+    """
+    Limit change of recommended calls between
+    consecutive decisions (per solver) by max_step.
+    Outputs of released solvers are forgotten.
+    """
+
+    def __init__(self, max_step):
+        self.max_step = max_step
+        # id(solver) -> (weak reference to solver, last output)
+        self._last = {}
+
+    def _forget(self, key):
+        "Callback of weak reference: remove entry of released solver"
+        last = self._last
+        def forget(reference):
+            entry = last.get(key)
+            if entry is not None and entry[0] is reference:
+                del last[key]
+        return forget
+
+    def after(self, solver, calls):
+        key = id(solver)
+        entry = self._last.get(key)
+        if entry is not None and entry[0]() is solver:
+            reference, last = entry
+            if calls > last + self.max_step:
+                calls = last + self.max_step
+            elif calls < last - self.max_step:
+                calls = max(0, last - self.max_step)
+        else:
+            reference = weakref.ref(solver, self._forget(key))
+        self._last[key] = (reference, calls)
+        return calls
+
+class SolverPipeline(Solver):
+    """
+    Composite solver: stages around core solver.
+
+    >>> e = PIEnvironment(idle_agents=10,calls_total=1000,calls_answered=300,calls_served=299,uptime=1000,interval=300)
+    >>> p = SolverPipeline(PIController(e), [AntiWindup(), MaxCallsPerTick(20)])
+    >>> p.predict_outgoing_calls()
+    20
+    """
+
+    def __init__(self, solver, stages=()):
+        self.solver = solver
+        self.stages = list(stages)
+        Solver.__init__(self, solver.e, solver.cache)
+        self.required = solver.required
+
+    def observe(self, environment):
+        Solver.observe(self, environment)
+        if self.solver.e is not environment:
+            self.solver.observe(environment)
+
+    def predict_outgoing_calls(self, debug=False):
+        solver = self.solver
+        for stage in self.stages:
+            stage.before(solver)
+        try:
+            calls = solver.predict_outgoing_calls(debug) if debug \
+                else solver.predict_outgoing_calls()
+        finally:
+            for stage in self.stages:
+                stage.detach(solver)
+        for stage in self.stages:
+            calls = stage.after(solver, calls)
+        return calls
+
+    def getstate(self):
+        # stages keep no state worth restoring (SlewRateLimit restarts from first decision)
+        return self.solver.getstate()
+
+    def setstate(self, state):
+        self.solver.setstate(state)
+        return self # for chaining
+
+    def predict_many(self, solvers):
+        """
+        Batch mode: decisions for many solvers (e.g., campaigns)
+        with the same stages, post-filters are applied per stage
+        to the whole batch.
+        """
+        for stage in self.stages:
+            for solver in solvers:
+                stage.before(solver)
+        try:
+            calls = [solver.predict_outgoing_calls() for solver in solvers]
+        finally:
+            for stage in self.stages:
+                for solver in solvers:
+                    stage.detach(solver)
+        for stage in self.stages:
+            calls = stage.aftermany(solvers, calls)
+        return calls
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,241 @@
+# fix division problem:
+from __future__ import division
+
+# Lead queue of dialer: turns recommended number of calls into
+# concrete leads. Pending leads are kept in heap ordered by
+# retry-after time (single integer key per lead: seconds << 32
+# | index, no tuples), leads outside of calling window (local
+# time of lead) are deferred to the window opening, failed
+# attempts are retried after delay until attempt cap is reached.
+# Per-lead data are kept in arrays and stored as compact binary.
+
+import math
+import heapq
+import struct
+from array import array
+
+class ELeadsError(Exception):
+    "Invalid operation with lead queue"
+    pass
+
+# states of lead:
+PENDING, DIALING, DONE, EXHAUSTED = 0, 1, 2, 3
+STATES = ('pending', 'dialing', 'done', 'exhausted')
+
+INDEX_BITS = 32
+INDEX_MASK = (1 << INDEX_BITS) - 1
+
+MAGIC = 'D9LQ'
+# magic, number of leads, max attempts, size of id, retry delay, window start, window end
+HEADER = struct.Struct('<4sIHHdii')
+
+class LeadQueue(object):
+    """
+    Leads with indexes 0..len-1 (in order of adding), times are
+    seconds (e.g., timestamps); tz - offset of local time of lead,
+    window - (start, end) seconds of local day for calls (None -
+    any time).
+
+    >>> q = LeadQueue(max_attempts=2, retry_delay=600, window=(9 * 3600, 21 * 3600))
+    >>> q.extend([101, 102, 103]).add(104, tz=-3 * 3600)
+    LeadQueue: leads: 4, pending: 4, dialing: 0, done: 0, exhausted: 0
+    >>> now = 10 * 3600
+    >>> [q.ids[i] for i in q.pop(3, now)] # 104 is called from 12:00 of its time
+    [101, 102, 103]
+    >>> q.result(0, True, now).result(1, False, now).result(2, False, now).pop(5, now)
+    []
+    >>> q.pop(5, now + 600), q.next_ready()
+    ([1, 2], 43200)
+    >>> q.result(1, False, now + 600).summary()['exhausted']
+    1
+    >>> r = LeadQueue().loads(q.dumps())
+    >>> r.pop(5, 12 * 3600), list(r.attempts)
+    ([2, 3], [1, 2, 2, 1])
+    """
+
+    def __init__(self, max_attempts=3, retry_delay=3600, window=None):
+        if max_attempts < 1 or max_attempts > 255:
+            raise ELeadsError('Attempt cap must be within 1..255!')
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.window = window
+        self.ids = array('l')
+        self.tz = array('l')
+        self.attempts = array('B')
+        self.states = array('B')
+        # keys: ready time (seconds) << INDEX_BITS | index
+        self._heap = []
+        # number of leads per state:
+        self.counts = [0] * len(STATES)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _key(ready, index):
+        return (int(math.ceil(ready)) << INDEX_BITS) | index if ready > 0 else index
+
+    def add(self, lead_id, ready=0, tz=0):
+        "Add lead ready to call since time ready"
+        index = len(self.ids)
+        if index > INDEX_MASK:
+            raise ELeadsError('Too many leads!')
+        self.ids.append(lead_id)
+        self.tz.append(tz)
+        self.attempts.append(0)
+        self.states.append(PENDING)
+        self.counts[PENDING] += 1
+        heapq.heappush(self._heap, self._key(ready, index))
+        return self # for chaining
+
+    def extend(self, ids, ready=0, tz=0):
+        "Add many leads at once (heap is rebuilt in linear time)"
+        start = len(self.ids)
+        self.ids.extend(ids)
+        count = len(self.ids) - start
+        if len(self.ids) - 1 > INDEX_MASK:
+            raise ELeadsError('Too many leads!')
+        self.tz.extend([tz] * count)
+        self.attempts.extend([0] * count)
+        self.states.extend([PENDING] * count)
+        self.counts[PENDING] += count
+        base = self._key(ready, 0)
+        self._heap.extend(base | index for index in xrange(start, start + count))
+        heapq.heapify(self._heap)
+        return self # for chaining
+
+    def _opening(self, index, t):
+        "Earliest time not before t within calling window of lead"
+        if self.window is None:
+            return t
+        start, end = self.window
+        local = (t + self.tz[index]) % 86400
+        if start <= local < end:
+            return t
+        if local < start:
+            return t + start - local
+        return t + 86400 - local + start
+
+    def pop(self, n, now):
+        """
+        Take up to n leads ready at time now (in order of ready time),
+        return their indexes; leads are dialing until result()
+        """
+        heap, states, attempts = self._heap, self.states, self.attempts
+        limit = (int(math.floor(now)) + 1) << INDEX_BITS
+        popped = []
+        while len(popped) < n and heap and heap[0] < limit:
+            index = heapq.heappop(heap) & INDEX_MASK
+            opening = self._opening(index, now)
+            if opening > now:
+                heapq.heappush(heap, self._key(opening, index))
+                continue
+            states[index] = DIALING
+            attempts[index] += 1
+            popped.append(index)
+        self.counts[PENDING] -= len(popped)
+        self.counts[DIALING] += len(popped)
+        return popped
+
+    def result(self, index, answered, now):
+        "Outcome of dialed lead: done if answered, else retry (until attempt cap)"
+        if self.states[index] != DIALING:
+            raise ELeadsError('Lead {} is not dialing!'.format(index))
+        self.counts[DIALING] -= 1
+        if answered:
+            state = DONE
+        elif self.attempts[index] >= self.max_attempts:
+            state = EXHAUSTED
+        else:
+            state = PENDING
+            heapq.heappush(self._heap, self._key(now + self.retry_delay, index))
+        self.states[index] = state
+        self.counts[state] += 1
+        return self # for chaining
+
+    def next_ready(self):
+        "Ready time of the first pending lead (None if no lead is pending)"
+        return self._heap[0] >> INDEX_BITS if self._heap else None
+
+    @property
+    def remaining(self):
+        "Leads which may be called yet (pending or dialing)"
+        return self.counts[PENDING] + self.counts[DIALING]
+
+    def summary(self):
+        summary = dict(zip(STATES, self.counts))
+        summary['leads'] = len(self)
+        summary['attempts'] = sum(self.attempts)
+        return summary
+
+    def dumps(self):
+        """
+        Binary: header, ids, tz offsets, attempts, states and ready
+        times (seconds) of leads; dialing leads (without result) are
+        stored as pending, unfinished attempt is not counted.
+        """
+        n = len(self)
+        ready = array('l', [0]) * n
+        for key in self._heap:
+            ready[key & INDEX_MASK] = key >> INDEX_BITS
+        states = array('B', self.states)
+        attempts = array('B', self.attempts)
+        for index, state in enumerate(states):
+            if state == DIALING:
+                states[index] = PENDING
+                attempts[index] -= 1
+        start, end = self.window if self.window is not None else (0, 0)
+        return HEADER.pack(MAGIC, n, self.max_attempts, self.ids.itemsize,
+                self.retry_delay, start, end) + \
+            ''.join(column.tostring() for column in (self.ids, self.tz, attempts, states, ready))
+
+    def loads(self, data):
+        "Load leads stored by dumps() (replaces content of queue)"
+        try:
+            magic, n, max_attempts, itemsize, retry_delay, start, end = HEADER.unpack_from(data)
+        except struct.error:
+            raise ELeadsError('Truncated lead queue!')
+        if magic != MAGIC:
+            raise ELeadsError('Bad lead queue magic: {!r}'.format(magic))
+        if itemsize != array('l').itemsize:
+            raise ELeadsError('Lead queue was stored on platform with other size of id!')
+        self.max_attempts, self.retry_delay = max_attempts, retry_delay
+        self.window = (start, end) if start != end else None
+        offset = HEADER.size
+        columns = []
+        for typecode in ('l', 'l', 'B', 'B', 'l'):
+            column = array(typecode)
+            size = column.itemsize * n
+            if len(data) < offset + size:
+                raise ELeadsError('Truncated lead queue!')
+            column.fromstring(data[offset:offset + size])
+            columns.append(column)
+            offset += size
+        self.ids, self.tz, self.attempts, self.states, ready = columns
+        self._heap = [(ready[index] << INDEX_BITS) | index
+            for index in xrange(n) if self.states[index] == PENDING]
+        heapq.heapify(self._heap)
+        self.counts = [0] * len(STATES)
+        for state in self.states:
+            self.counts[state] += 1
+        return self # for chaining
+
+    def store(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.dumps())
+        return self # for chaining
+
+    def load(self, filename):
+        with open(filename, 'rb') as f:
+            return self.loads(f.read())
+
+    def __str__(self):
+        return 'LeadQueue: leads: {}, {}'.format(len(self),
+            ', '.join('{}: {}'.format(name, count) for name, count in zip(STATES, self.counts)))
+
+    def __repr__(self):
+        return self.__str__()
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,423 @@
+# fix division problem:
+from __future__ import division
+
+# Per-agent occupancy and idle-time analytics.
+# Busy intervals of every agent are built from call start
+# plus call duration; occupancy, idle gaps and number of
+# concurrently busy (or idle) agents over time are computed
+# by sweep-line over sorted interval arrays.
+
+import sys
+import copy
+import heapq
+from array import array
+from bisect import bisect_right
+
+import calllog
+import report
+
+class StepSeries(object):
+    """
+    Piecewise-constant function of time: value[i] is
+    valid from times[i] up to times[i+1].
+    >>> s = StepSeries([10, 20, 30], [1, 3, 0])
+    >>> s(5), s(10), s(25), s(100)
+    (0, 1, 3, 0)
+    >>> s.max, s.mean
+    (3, 2.0)
+    """
+
+    def __init__(self, times, values, initial=0):
+        self.times = array('d', times)
+        self.values = array('l', values)
+        self.initial = initial
+
+    def __call__(self, t):
+        "Value at time t (lookup by bisection)"
+        i = bisect_right(self.times, t)
+        if i == 0:
+            return self.initial
+        return self.values[i - 1]
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return iter(zip(self.times, self.values))
+
+    @property
+    def max(self):
+        return max(self.values) if self.values else self.initial
+
+    @property
+    def mean(self):
+        "Time-weighted mean between first and last change"
+        times, values = self.times, self.values
+        try:
+            total = sum(values[i] * (times[i + 1] - times[i]) for i in xrange(len(times) - 1))
+            return total / (times[-1] - times[0])
+        except (ZeroDivisionError, IndexError):
+            return self.initial
+
+def sweep(increments, decrements, initial=0):
+    """
+    Count of "open" items over time; increments and decrements
+    are sorted sequences of times. Changes at the same time
+    are applied together (no transient values).
+    >>> list(sweep([0, 5, 5], [5, 10, 10]))
+    [(0.0, 1), (5.0, 2), (10.0, 0)]
+    """
+    times, values = [], []
+    count = initial
+    events = heapq.merge(((t, 1) for t in increments), ((t, -1) for t in decrements))
+    last = None
+    for t, delta in events:
+        if t != last:
+            if last is not None and (not values or values[-1] != count):
+                times.append(last)
+                values.append(count)
+            last = t
+        count += delta
+    if last is not None:
+        times.append(last)
+        values.append(count)
+    return StepSeries(times, values, initial)
+
+def merge_intervals(intervals):
+    """
+    Union of intervals, result is sorted.
+    >>> merge_intervals([(5, 8), (0, 2), (1, 4), (8, 9)])
+    [(0, 4), (5, 9)]
+    """
+    buff = []
+    for start, end in sorted(intervals):
+        if buff and start <= buff[-1][1]:
+            if end > buff[-1][1]:
+                buff[-1] = (buff[-1][0], end)
+        else:
+            buff.append((start, end))
+    return buff
+
+class Occupancy(object):
+    """
+    Interval-based occupancy engine.
+    Agent is considered logged in during "session": series of
+    busy intervals with gaps not longer than session_gap.
+
+    >>> o = Occupancy(session_gap=100)
+    >>> o.addinterval('a1', 0, 50).addinterval('a1', 60, 100).addinterval('a1', 500, 510)
+    Occupancy: agents: 1, calls: 3
+    >>> o.addinterval('a2', 40, 70)
+    Occupancy: agents: 2, calls: 4
+    >>> a1 = o.agent('a1')
+    >>> a1['busy'], a1['logged'], a1['idle_gaps'], a1['max_idle_gap']
+    (100, 110, 1, 10)
+    >>> busy = o.concurrency()
+    >>> busy(45), busy(55), busy(65), busy(505)
+    (2, 1, 2, 1)
+    >>> idle = o.idle_agents()
+    >>> idle(45), idle(55), idle(75), idle(200)
+    (0, 1, 0, 0)
+    """
+
+    def __init__(self, session_gap=30 * 60, start_field='call_timestamp'):
+        self.session_gap = session_gap
+        self.start_field = start_field
+        self.calls = 0
+        # agent -> list of (start, end)
+        self._intervals = {}
+        # agent -> merged busy intervals (computed on demand)
+        self._merged = None
+
+    def addinterval(self, agent, start, end):
+        "Add busy interval of agent"
+        try:
+            self._intervals[agent].append((start, end))
+        except KeyError:
+            self._intervals[agent] = [(start, end)]
+        self.calls += 1
+        self._merged = None
+        return self # for chaining
+
+    def add(self, row):
+        "Add decoded log row (ignored if call was not answered)"
+        start, duration = row[self.start_field], row['call_duration']
+        if start is not None and duration:
+            self.addinterval(row['agent_name'], start, start + duration)
+        return self # for chaining
+
+    def fromrows(self, rows):
+        for row in rows:
+            self.add(row)
+        return self # for chaining
+
+    def _update(self):
+        if self._merged is None:
+            self._merged = dict((agent, merge_intervals(intervals))
+                for agent, intervals in self._intervals.iteritems())
+        return self._merged
+
+    def sessions(self, agent):
+        "Login sessions of agent: list of (start, end)"
+        buff = []
+        for start, end in self._update()[agent]:
+            if buff and start - buff[-1][1] <= self.session_gap:
+                buff[-1] = (buff[-1][0], end)
+            else:
+                buff.append((start, end))
+        return buff
+
+    def agent(self, agent):
+        "Metrics of single agent"
+        busy_intervals = self._update()[agent]
+        busy = sum(end - start for start, end in busy_intervals)
+        logged = sum(end - start for start, end in self.sessions(agent))
+        gaps = [start - prev_end for (prev_start, prev_end), (start, end) in
+            zip(busy_intervals[:-1], busy_intervals[1:])
+            if start - prev_end <= self.session_gap]
+        return {
+            'calls': len(self._intervals[agent]),
+            'busy': busy,
+            'logged': logged,
+            'occupancy': busy / logged if logged else 0,
+            'idle_gaps': len(gaps),
+            'idle_time': sum(gaps),
+            'max_idle_gap': max(gaps) if gaps else 0,
+        }
+
+    def agents(self):
+        "Metrics for every agent: dict agent -> metrics"
+        return dict((agent, self.agent(agent)) for agent in self._intervals)
+
+    def _edges(self, intervals_of):
+        starts, ends = array('d'), array('d')
+        for agent in self._intervals:
+            for start, end in intervals_of(agent):
+                starts.append(start)
+                ends.append(end)
+        return sorted(starts), sorted(ends)
+
+    def concurrency(self):
+        "StepSeries of concurrently busy agents"
+        merged = self._update()
+        return sweep(*self._edges(merged.__getitem__))
+
+    def logged_in(self):
+        "StepSeries of logged in agents"
+        return sweep(*self._edges(self.sessions))
+
+    def idle_agents(self):
+        """
+        StepSeries of idle (logged in, but not busy) agents,
+        can be used as source of 'idle_agents' for replay.
+        """
+        merged = self._update()
+        busy_starts, busy_ends = self._edges(merged.__getitem__)
+        session_starts, session_ends = self._edges(self.sessions)
+        return sweep(list(heapq.merge(session_starts, busy_ends)),
+            list(heapq.merge(session_ends, busy_starts)))
+
+    def summary(self):
+        "Center-wide metrics as dict"
+        agents = self.agents()
+        busy = sum(a['busy'] for a in agents.itervalues())
+        logged = sum(a['logged'] for a in agents.itervalues())
+        concurrency = self.concurrency()
+        return {
+            'agents_total': len(agents),
+            'calls': self.calls,
+            'busy_time': busy,
+            'logged_time': logged,
+            'idle_time': logged - busy,
+            'occupancy': busy / logged if logged else 0,
+            'max_busy_agents': concurrency.max,
+            'mean_busy_agents': concurrency.mean,
+        }
+
+    def __str__(self):
+        return 'Occupancy: agents: {}, calls: {}'.format(len(self._intervals), self.calls)
+
+    def __repr__(self):
+        return self.__str__()
+
+class RunningOccupancy(object):
+    """
+    Center-wide metrics of Occupancy.summary() maintained
+    incrementally (e.g., in checkpoint of growing log): busy
+    intervals are folded into counters of agents and of
+    concurrency sweep as soon as no later row can change them,
+    so memory and cost of update do not grow with parsed rows.
+    Rows may come out of order of start by up to lateness seconds.
+
+    >>> rows = [('a1', 0, 50), ('a2', 40, 70), ('a1', 60, 100), ('a1', 500, 510)]
+    >>> o, r = Occupancy(session_gap=100), RunningOccupancy(session_gap=100, lateness=20)
+    >>> for agent, start, end in rows:
+    ...     o = o.addinterval(agent, start, end)
+    ...     r = r.addinterval(agent, start, end).fold()
+    >>> r.summary() == o.summary()
+    True
+    >>> r
+    RunningOccupancy: agents: 2, calls: 4, pending: 1
+    """
+
+    def __init__(self, session_gap=30 * 60, start_field='call_timestamp', lateness=60 * 60):
+        self.session_gap = session_gap
+        self.start_field = start_field
+        self.lateness = lateness
+        self.calls = 0
+        # latest start of busy interval:
+        self.last_start = None
+        # agent -> list of (start, end) not folded yet
+        self._pending = {}
+        # agent -> [busy, logged, session start, open start, open end, last end]
+        self._agents = {}
+        # edges of folded merged intervals not swept yet: list of (time, delta)
+        self._edges = []
+        # concurrency sweep: [count, first change, last change, integral, max]
+        self._sweep = [0, None, None, 0, 0]
+
+    def addinterval(self, agent, start, end):
+        "Add busy interval of agent"
+        try:
+            self._pending[agent].append((start, end))
+        except KeyError:
+            self._pending[agent] = [(start, end)]
+        if agent not in self._agents:
+            self._agents[agent] = [0, 0, None, None, None, None]
+        self.calls += 1
+        self.last_start = start if self.last_start is None else max(self.last_start, start)
+        return self # for chaining
+
+    def add(self, row):
+        "Add decoded log row (ignored if call was not answered)"
+        start, duration = row[self.start_field], row['call_duration']
+        if start is not None and duration:
+            self.addinterval(row['agent_name'], start, start + duration)
+        return self # for chaining
+
+    def fromrows(self, rows):
+        for row in rows:
+            self.add(row)
+        return self # for chaining
+
+    def fold(self, frontier=None):
+        """
+        Fold intervals starting before frontier (default: latest
+        start minus lateness), no later interval may start before it.
+        """
+        if frontier is None:
+            if self.last_start is None:
+                return self # for chaining
+            frontier = self.last_start - self.lateness
+        gap = self.session_gap
+        for agent, pending in self._pending.iteritems():
+            counters = self._agents[agent]
+            busy, logged, session_start, open_start, open_end, last_end = counters
+            pending.sort()
+            n = 0
+            for start, end in pending:
+                if start >= frontier:
+                    break
+                n += 1
+                if open_start is not None:
+                    if start <= open_end:
+                        open_end = max(open_end, end)
+                        continue
+                    busy += open_end - open_start
+                    self._edges.append((open_start, 1))
+                    self._edges.append((open_end, -1))
+                    last_end = open_end
+                if last_end is None or start - last_end > gap:
+                    if last_end is not None:
+                        logged += last_end - session_start
+                    session_start = start
+                open_start, open_end = start, end
+            del pending[:n]
+            # merged interval is complete if no later interval can overlap it:
+            if open_start is not None and open_end < frontier:
+                busy += open_end - open_start
+                self._edges.append((open_start, 1))
+                self._edges.append((open_end, -1))
+                last_end = open_end
+                open_start = open_end = None
+            counters[:] = busy, logged, session_start, open_start, open_end, last_end
+        # edges before start of any open or pending interval are final:
+        opened = [counters[3] for counters in self._agents.itervalues()
+            if counters[3] is not None]
+        horizon = min(opened + [frontier])
+        self._edges.sort()
+        n = 0
+        count, first, last, integral, peak = self._sweep
+        for t, delta in self._edges:
+            if t >= horizon:
+                break
+            n += 1
+            if t != last:
+                # count is value since the previous change:
+                if last is None:
+                    first = t
+                else:
+                    integral += count * (t - last)
+                last = t
+            count += delta
+            peak = max(peak, count)
+        del self._edges[:n]
+        self._sweep = [count, first, last, integral, peak]
+        return self # for chaining
+
+    def summary(self):
+        "Center-wide metrics as dict, see Occupancy.summary()"
+        final = copy.deepcopy(self).fold(float('inf'))
+        busy = logged = 0
+        for counters in final._agents.itervalues():
+            busy += counters[0]
+            logged += counters[1]
+            if counters[5] is not None:
+                logged += counters[5] - counters[2]
+        count, first, last, integral, peak = final._sweep
+        try:
+            mean = integral / (last - first)
+        except (ZeroDivisionError, TypeError):
+            mean = 0
+        return {
+            'agents_total': len(final._agents),
+            'calls': self.calls,
+            'busy_time': busy,
+            'logged_time': logged,
+            'idle_time': logged - busy,
+            'occupancy': busy / logged if logged else 0,
+            'max_busy_agents': peak,
+            'mean_busy_agents': mean,
+        }
+
+    def __str__(self):
+        return 'RunningOccupancy: agents: {}, calls: {}, pending: {}'.format(len(self._agents),
+            self.calls, sum(len(pending) for pending in self._pending.itervalues()))
+
+    def __repr__(self):
+        return self.__str__()
+
+def main(argv):
+    """
+    Usage: occupancy.py [--agents] [--session_gap=<sec>] [--format=json|csv|text] <call_log.csv> [...]
+    """
+    try:
+        options, filenames = report.parseargs(argv,
+            {'agents': False, 'session_gap': 30 * 60, 'format': 'json'})
+    except report.EReportError as e:
+        print e
+        print main.__doc__
+        return 2
+    o = Occupancy(session_gap=int(options['session_gap']))
+    o.fromrows(calllog.iterlogs(filenames))
+    summary = o.summary()
+    if options['agents']:
+        summary['agents'] = o.agents()
+    report.emit(summary, options['format'])
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv))
+    import doctest
+    doctest.testmod()
@@ -1,241 +1,386 @@
 # fix division problem:
 from __future__ import division
 
+import os
 import csv
 
 import math
 import random
 import itertools
 
-import statistics
-
 import sys
+
 try:
-    import matplotlib.pyplot as plt
-    import numpy
+    # if C version is available:
+    import cPickle as pickle
 except ImportError:
-    print "Requires matplotlib and numpy modules!"
-    sys.exit(1)
+    # Otherwise import pure-Python version:
+    import pickle
+
+import statistics
+import report
+import occupancy
+from calllog import decoderows
 
 data = []
 
-def timefromtimestr(s):
-    """ Decode from text like 00:00:00"""
-    if len(s) == 0:
-        return None
-    h, m, s = [int(v) for v in s.split(':')]
-    return 3600*h + 60 *m + s
-
-def timefromdatestr(s):
-    """ Decode from text like <date><space>00:00:00"""
-    if len(s) == 0:
-        return None
-    return timefromtimestr(s.split(' ')[1])
-
-def decode(d, name):
-    if len(d[name]) > 0:
-        return d[name]
-    else:
-        return None
+# fitted model of call duration is refitted (incremental analysis)
+# when number of durations grew by more than this fraction:
+REFIT_GROWTH = 0.1
 
+# format of partial aggregates stored in checkpoint:
+CHECKPOINT_VERSION = 2
 
-#~ class PoissonProfile(NumSequence):
-    #~ def __init__(self, xmin, xmax, step, k=1, lam=1):
-        #~ NumSequence.__init__(self)
-        #~ self.k = k
-        #~ self.lam = lam
-    
-    #~ def update(self, v=None):
-        #~ v = numpy.random.poisson(float(self.lam))
-        #~ Profile.update(self, v)
-
-#~ class ExpovarianteProfile(NumSequence):
-    #~ def __init__(self, xmin, xmax, step, k=1, lam=1):
-        #~ Profile.__init__(self, xmin, xmax, step)
-        #~ self.k = k
-        #~ self.lam = lam
-    
-    #~ def update(self, v=None):
-        #~ v = random.expovariate(float(self.lam))
-        #~ Profile.update(self, v)            
-
-#~ class LognormalProfile(Profile):
-    #~ def __init__(self, xmin, xmax, step, mean, sigma):
-        #~ Profile.__init__(self, xmin, xmax, step)
-        #~ self.logmean = mean
-        #~ self.logsigma = sigma
-        #~ s = numpy.random.lognormal(mean=self.logmean, sigma=self.logsigma, size=100000)
-        #~ for v in s:
-            #~ Profile.update(self, v)
-    
+class EParseLogError(Exception):
+    "Generic error of log analysis"
+    pass
 
+def ratio(value, total):
+    "value / total, 0 if total is 0 (e.g., log without rows yet)"
+    return float(value) / total if total else 0
 
+def aggregates():
+    """
+    Empty partial aggregates of log: all state of analysis
+    which is continued by consume() for further rows.
+    Samples are not kept: durations are counted by value
+    (statistics.CountedSet), occupancy is folded into counters
+    (occupancy.RunningOccupancy), so size of aggregates does not
+    grow with number of rows.
+    """
+    return {
+        'agents': {}, # agent -> number of calls
+        'days': {}, # day -> [first, last] call timestamp
+        'service_time': 0,
+        'calls': 0,
+        'answered_calls': 0,
+        'weighted_average_call_duration': 0,
+        'c_duration': statistics.CountedSet(label='Call duration'),
+        'c10_duration': statistics.CountedSet(label='Call duration (calls longer than 10 sec)'),
+        'c_calls_distribution': statistics.CountedSet(label='Calls distribution by day time'),
+        'c_dialing_profile': statistics.CountedSet(label='Dialing duration'),
+        'p_calls_rate': statistics.RateProfile(label='Calls rate by day time'),
+        'o_agents': occupancy.RunningOccupancy(),
+        # fitted model, its scores and number of durations it was fitted on:
+        'm_duration': None,
+        'm_duration_scores': None,
+        'm_duration_count': 0,
+    }
 
-def expovariate(k, lambd, size):
-    buff = [] 
-    count = 0
-    while count < size:
-        buff.append(k * random.expovariate(lambd))
-        count += 1
-    return buff
-
-def main():
-    d_agents = {}
-
-    t_uptime = 0
-    t_service_time = 0
-    n_calls = 0
-    n_answered_calls = 0
-    weighted_average_call_duration = 0
-
-    vmin = 0
-    vmax = 2000
-    quantum = 2
-    c_duration = statistics.NumSet(label='Call duration')
-    c10_duration = statistics.NumSet(label='Call duration (calls longer than 10 sec)')
-    c_calls_distribution = statistics.NumXY(label='Calls distribution by day time')
-    c_dialing_profile = statistics.NumSet(label='Dialing duration')
-    #~ c_dmodel_poisson = PoissonProfile(vmin, vmax, quantum, k = 0.5, lam = 1)
-    #~ c_dmodel_expovariate = ExpovarianteProfile(vmin, vmax, quantum, k = 0.5, lam = 1)
-    #~ c_dmodel_lognormal = LognormalProfile(vmin, vmax, quantum, mean=38, sigma = 3600)
-
-    with open('call_log.csv',  'r') as f:
-        reader = csv.DictReader(f, delimiter=',')
-        for line in reader:
-            agent_name = line['agent_name']
-            if agent_name in d_agents:
-                d_agents[agent_name] += 1
-            else:
-                d_agents[agent_name] = 1
-                
-            line['classification'] = decode(line, 'classification')
-            
-            call_time = line['call_time'] = timefromdatestr(line['call_time']) 
-            n_calls += 1
-            c_calls_distribution.append(call_time, 1)
-            talk_time = line['talk_time'] = timefromdatestr(line['talk_time']) 
-            
-            if talk_time is not None and  call_time is not None:
-                dialing_time = line['dialing_time'] = talk_time - call_time
-                c_dialing_profile.append(dialing_time)
+def consume(state, reader):
+    """
+    Add rows of log (dicts of csv reader) to partial aggregates (state),
+    fields are decoded by columns (see calllog.decoderows)
+    """
+    d_agents = state['agents']
+    d_days = state['days']
+    t_service_time = state['service_time']
+    n_calls = state['calls']
+    n_answered_calls = state['answered_calls']
+    weighted_average_call_duration = state['weighted_average_call_duration']
+
+    c_duration = state['c_duration']
+    c10_duration = state['c10_duration']
+    c_calls_distribution = state['c_calls_distribution']
+    c_dialing_profile = state['c_dialing_profile']
+    p_calls_rate = state['p_calls_rate']
+    o_agents = state['o_agents']
+
+    for line in decoderows(list(reader)):
+        agent_name = line['agent_name']
+        if agent_name in d_agents:
+            d_agents[agent_name] += 1
+        else:
+            d_agents[agent_name] = 1
+        
+        call_timestamp = line['call_timestamp']
+        if call_timestamp is not None:
+            day = line['day']
+            if day in d_days:
+                d_days[day][1] = max(d_days[day][1], call_timestamp)
             else:
-                dialing_time = line['dialing_time'] = None
-            
-            call_duration = line['call_duration'] = timefromtimestr(line['call_duration'])
-            #~ if call_duration and line["classification"] != 'Voicemail':
-            if call_duration:
-                c_duration.append(call_duration)
-            if call_duration and call_duration > 10:
-                n_answered_calls += 1
-                t_service_time += call_duration
-                c10_duration.append(call_duration)
-                #~ c_dmodel_poisson.update()
-                #~ c_dmodel_expovariate.update()
-                #~ c_dmodel_lognormal.update()
-                    #~ heappush(h_calls_profile, call_time)
-                weighted_average_call_duration = float(weighted_average_call_duration * \
-                    (n_answered_calls-1) + call_duration) / float(n_answered_calls)
-            
-            data.append(line)
-
-    t_uptime = data[-1]['call_time'] - data[0]['call_time']
+                d_days[day] = [call_timestamp, call_timestamp]
+        call_time = line['call_time']
+        n_calls += 1
+        if call_time is not None:
+            c_calls_distribution.append(call_time)
+            p_calls_rate.append(call_time, answered=line['talk_timestamp'] is not None)
+        
+        dialing_time = line['dialing_time']
+        if dialing_time is not None:
+            c_dialing_profile.append(dialing_time)
+        
+        call_duration = line['call_duration']
+        #~ if call_duration and line["classification"] != 'Voicemail':
+        if call_duration:
+            c_duration.append(call_duration)
+        if call_duration and call_duration > 10:
+            n_answered_calls += 1
+            t_service_time += call_duration
+            c10_duration.append(call_duration)
+            weighted_average_call_duration = float(weighted_average_call_duration * \
+                (n_answered_calls-1) + call_duration) / float(n_answered_calls)
+        
+        o_agents.add(line)
+        data.append(line)
+    o_agents.fold()
+
+    state['service_time'] = t_service_time
+    state['calls'] = n_calls
+    state['answered_calls'] = n_answered_calls
+    state['weighted_average_call_duration'] = weighted_average_call_duration
+    return state
+
+def summarize(state):
+    """
+    Return (summary, profiles) of partial aggregates:
+    summary - dict of computed statistics,
+    profiles - dict of collected NumSequence objects.
+    Cost does not depend on number of rows (except refit of model).
+    """
+    d_agents = state['agents']
+    d_days = state['days']
+    t_service_time = state['service_time']
+    n_calls = state['calls']
+    n_answered_calls = state['answered_calls']
+    c_duration = state['c_duration']
+    c10_duration = state['c10_duration']
+    c_calls_distribution = state['c_calls_distribution']
+    c_dialing_profile = state['c_dialing_profile']
+    p_calls_rate = state['p_calls_rate']
+    o_agents = state['o_agents']
+
+    # sum of daily uptimes (logs may cross midnight or span several days):
+    t_uptime = sum(last - first for first, last in d_days.itervalues())
     n_agents = len(d_agents)
+    p_calls_rate.days = len(d_days)
 
-    call_rate = float(n_calls)/float(t_uptime)
-    answered_call_rate = float(n_answered_calls)/float(t_uptime)
+    # log may have no rows yet (e.g., just rotated), rates are 0 then:
+    call_rate = ratio(n_calls, t_uptime)
+    answered_call_rate = ratio(n_answered_calls, t_uptime)
 
-    connection_rate = float(n_answered_calls)/float(n_calls)
-    average_call_duration =  float(t_service_time)/float(n_answered_calls)
+    connection_rate = ratio(n_answered_calls, n_calls)
+    average_call_duration = ratio(t_service_time, n_answered_calls)
 
-    def cuttail(data, maxval):
-        i, length = 0, len(data)
-        while i < length and data[i] < maxval:
-            i += 1
-        if i < length:
-            data = data[:i]
-        return data
-        
-    h_calls_profile = statistics.Histogram(label='Histogram: call duration', source=c_duration, bins=20)
-    h_calls10_profile = statistics.Histogram(label='Histogram: call duration (call duration > 10 sec)', source=c10_duration, bins=20)
-    h_dialing_profile = statistics.Histogram(label='Histogram: duration of dialing', source=c_dialing_profile)
-
-    print "Results are below, see also on the popup plot window"
-    print c_duration
-    print c10_duration
-    print c_calls_distribution
-    
-    print h_dialing_profile
-    print h_calls10_profile
-    print h_calls_profile
-    
-    c_duration.store('c_duration.dat')
-    c10_duration.store('c10_duration.dat')
-
-    print "Agents total: %i" % n_agents
-    print "Call-center Uptime: %i" % t_uptime
-    print "Man * time total: %i" % (t_uptime * n_agents)
-    print "Service time: %i" % t_service_time
-    print "Total idle time: %i" % (t_uptime * n_agents - t_service_time)
-
-    print "Idle time percent: %f" % (float(t_uptime * n_agents - t_service_time) *100 / float(t_uptime * n_agents))
-    print "Average idle time per agent: %f" % (float(t_uptime * n_agents - t_service_time) / float(len(d_agents)))
-    print "Calls total (w/o voicemail): %i" % n_calls
-    print "Calls answered (w/o voicemail): %i" % n_answered_calls
-    print "Call rate (1/sec): %f" % call_rate
-    print "Connection rate: %f" % connection_rate
-    print "Answered call rate (1/sec): %f" % answered_call_rate
-    print "Average call duration: %f" % average_call_duration
-    print "Weighted average call duration: %f" % weighted_average_call_duration
+    # fitted model of call duration (fitting on a sample keeps it fast for large logs),
+    # model of checkpoint is reused until enough new durations are collected;
+    # no model (None) until durations can be fitted:
+    n_durations = len(c_duration)
+    if n_durations > state['m_duration_count'] * (1 + REFIT_GROWTH) or \
+            (state['m_duration'] is None and n_durations > state['m_duration_count']):
+        fit_values = c_duration.y
+        if len(fit_values) > 20000:
+            fit_values = random.Random(0).sample(fit_values, 20000)
+        try:
+            state['m_duration'], state['m_duration_scores'] = statistics.fitbest(fit_values)
+        except statistics.EDistributionError:
+            state['m_duration'], state['m_duration_scores'] = None, None
+        state['m_duration_count'] = n_durations
+    m_duration, m_duration_scores = state['m_duration'], state['m_duration_scores']
 
-    
-    #~ print 'Poisson model: ', c_dmodel_poisson
-    #~ print 'Expovariante model: ', c_dmodel_expovariate
-    #~ print 'Lognormal model: ', c_dmodel_lognormal
-
-    #~ h_duration_profile = cuttail(h_duration_profile, 25)
-    #~ p0 = cuttail(poisson(k=25, lam=2, size=1000), 25)
-    #~ e = cuttail(expovariate(average_call_duration, answered_call_rate, 1000), 25)
-    #~ e1 = cuttail(numpy.random.exponential(scale=0.5, size=1000), 25)
-    #~ e2 = cuttail(numpy.random.exponential(scale=1, size=1000), 25)
-    #~ e3 = cuttail(numpy.random.exponential(scale=2, size=1000), 25)
-
-    #~ plt.hist(h_duration_profile, bins=1000, histtype='step', color='b', rwidth=20, label='Duration')
-    #~ plt.hist(p0, bins=100, histtype='step', color='g', normed=True, rwidth=20, label='Poisson(2)')
-
-    plt.plot(*h_calls_profile(), label = h_calls_profile.label)
-    plt.plot(*h_calls10_profile(), label = h_calls10_profile.label)
-    
-    #~ plt.plot(*c_dmodel_poisson(), label = 'c_dmodel_poisson')
-    #~ plt.plot(*c_dmodel_expovariate(), label = 'c_dmodel_expovariate')
-    #~ plt.plot(*c_dmodel_lognormal(), label = 'c_dmodel_lognormal')
-    #~ plt.fill(c_duration.x, c_dmodel_poisson.y, "g", label = 'c_dmodel_poisson')
-    #~ plt.hist(e, bins=100, histtype='bar', normed=True, label='Exp(0)')
-    #~ plt.hist(e0, bins=100, histtype='bar', normed=True, label='Exp(0)')
-    #~ plt.hist(e1, bins=1000, histtype='step', color='r', normed=True, label='Exp(1)')
-    #~ plt.hist(e2, bins=100, histtype='bar', normed=True, label='Exp(2)')
-    #~ plt.hist(e3, bins=100, histtype='bar', normed=True, label='Exp(3)')
-
-    #~ plt.hist(h_calls_profile, bins=500, histtype='stepfilled', color='r', label='Calls intensity')
-    #~ plt.hist(numpy.random.exponential(scale=5, size=100), bins=100, histtype='stepfilled', normed=True, label='Exp(5)')
-    #~ plt.hist(numpy.random.exponential(scale=10, size=100), bins=100, histtype='stepfilled', normed=True, label='Exp(10)')
-    #~ plt.hist(numpy.random.exponential(scale=50, size=100), bins=100, histtype='stepfilled', normed=True, label='Exp(50)')
-    #~ plt.hist(h_dialing_profile, bins=100, histtype='stepfilled', normed=True, color='r', alpha=0.5, label='Dialing')
-    plt.title("Distribution of Call Duration and Dialing Time")
-    plt.xlabel("Time (sec)")
-    #~ plt.ylabel("Probability")
-    plt.ylabel("Calls N")
-    plt.legend()
-    plt.show()
+    # histograms of empty sets are None:
+    h_calls_profile = statistics.Histogram(label='Histogram: call duration',
+        source=c_duration, bins=20) if len(c_duration) else None
+    h_calls10_profile = statistics.Histogram(label='Histogram: call duration (call duration > 10 sec)',
+        source=c10_duration, bins=20) if len(c10_duration) else None
+    h_dialing_profile = statistics.Histogram(label='Histogram: duration of dialing',
+        source=c_dialing_profile) if len(c_dialing_profile) else None
+
+    # man * time and idle time are computed from login sessions of agents
+    # (not assuming every agent was logged in the whole uptime):
+    occupancy_summary = o_agents.summary()
+    t_man_time = occupancy_summary['logged_time']
+    t_idle_time = occupancy_summary['idle_time']
+    summary = {
+        'agents_total': n_agents,
+        'uptime': t_uptime,
+        'man_time_total': t_man_time,
+        'service_time': t_service_time,
+        'idle_time_total': t_idle_time,
+        'idle_time_percent': ratio(t_idle_time * 100, t_man_time),
+        'average_idle_time_per_agent': ratio(t_idle_time, n_agents),
+        'occupancy': occupancy_summary,
+        'calls_total': n_calls,
+        'calls_answered': n_answered_calls,
+        'call_rate': call_rate,
+        'connection_rate': connection_rate,
+        'answered_call_rate': answered_call_rate,
+        'average_call_duration': average_call_duration,
+        'weighted_average_call_duration': state['weighted_average_call_duration'],
+        'call_duration': c_duration.summary(),
+        'call_duration_model': {
+            'model': str(m_duration) if m_duration is not None else None,
+            'scores': m_duration_scores
+        },
+        'call_duration_10': c10_duration.summary(),
+        'calls_distribution': c_calls_distribution.summary(),
+        'dialing_duration': c_dialing_profile.summary(),
+    }
+    profiles = {
+        'c_duration': c_duration,
+        'm_duration': m_duration,
+        'c10_duration': c10_duration,
+        'c_calls_distribution': c_calls_distribution,
+        'p_calls_rate': p_calls_rate,
+        'c_dialing_profile': c_dialing_profile,
+        'h_calls_profile': h_calls_profile,
+        'h_calls10_profile': h_calls10_profile,
+        'h_dialing_profile': h_dialing_profile,
+    }
+    return summary, profiles
+
+class Checkpoint(object):
+    """
+    State of incremental analysis of growing log: byte offset of
+    the first unparsed row and partial aggregates of parsed rows.
+    Only complete lines are parsed; log with other header or
+    shorter than offset (rotated) is parsed from the beginning,
+    as well as checkpoint of other version.
+    """
+
+    stored_attrs = ['version', 'filename', 'header', 'offset', 'rows', 'aggregates']
+
+    def __init__(self):
+        self.version = CHECKPOINT_VERSION
+        self.filename = None
+        self.header = None
+        self.offset = 0
+        self.rows = 0
+        self.aggregates = aggregates()
+
+    def store(self, filename):
+        data = {}
+        for name in self.stored_attrs:
+            data[name] = getattr(self, name)
+        with open(filename, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        return self # for chaining
+
+    def load(self, filename):
+        try:
+            with open(filename, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') != CHECKPOINT_VERSION:
+                self.__init__()
+                return self # for chaining
+            for name in self.stored_attrs:
+                setattr(self, name, data[name])
+        except (EnvironmentError, pickle.UnpicklingError, EOFError, KeyError, ValueError,
+                AttributeError) as e:
+            raise EParseLogError('Cannot load checkpoint "{}": {}'.format(filename, e))
+        return self # for chaining
+
+    def update(self, filename):
+        "Parse rows appended to log since the last update, return number of new rows"
+        with open(filename, 'rb') as f:
+            header = f.readline()
+            if not header.endswith('\n'):
+                # header is not written completely yet:
+                return 0
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if filename != self.filename or header != self.header or size < self.offset:
+                self.__init__()
+                self.filename, self.header, self.offset = filename, header, len(header)
+            f.seek(self.offset)
+            tail = f.read()
+        end = tail.rfind('\n') + 1
+        if not end:
+            return 0
+        del data[:]
+        fieldnames = next(csv.reader([header]))
+        consume(self.aggregates, csv.DictReader(tail[:end].splitlines(True),
+            fieldnames=fieldnames, delimiter=','))
+        self.offset += end
+        self.rows += len(data)
+        return len(data)
+
+    def __str__(self):
+        return 'Checkpoint: {}, offset: {}, rows: {}'.format(self.filename, self.offset, self.rows)
+
+    def __repr__(self):
+        return self.__str__()
+
+def analyze(filename='call_log.csv', checkpoint=None):
+    """
+    Parse log, return (summary, profiles):
+    summary - dict of computed statistics,
+    profiles - dict of collected NumSequence objects.
+    With checkpoint only rows appended since the last analysis
+    are parsed (data holds these rows only).
+    """
+    if checkpoint is not None:
+        checkpoint.update(filename)
+        return summarize(checkpoint.aggregates)
+    state = aggregates()
+    del data[:]
+    with open(filename,  'r') as f:
+        consume(state, csv.DictReader(f, delimiter=','))
+    return summarize(state)
+
+def main(argv):
+    """
+    Usage: parse_log.py [call_log.csv] [--checkpoint=<file>]
+        [--format=json|csv|text] [--plot=<file.png>] [--show]
+    Summary is written to stdout; profiles of call duration
+    are stored in c_duration.dat, c10_duration.dat, fitted model
+    of call duration - in c_duration.model, time-of-day profile
+    of call rate and answer probability - in rate.profile (for simulation).
+    With --checkpoint only rows appended to the log since the
+    previous run are parsed and merged into aggregates stored in
+    the checkpoint file (e.g., for intraday dashboards).
+    """
+    try:
+        options, args = report.parseargs(argv,
+            {'format': 'json', 'checkpoint': None, 'plot': None, 'show': False})
+    except report.EReportError as e:
+        print e
+        print main.__doc__
+        return 2
+    filename = args[0] if args else 'call_log.csv'
+    if options['checkpoint']:
+        checkpoint = Checkpoint()
+        try:
+            if os.path.exists(options['checkpoint']):
+                checkpoint.load(options['checkpoint'])
+        except EParseLogError as e:
+            sys.stderr.write('{}\n'.format(e))
+            return 2
+        summary, profiles = analyze(filename, checkpoint)
+        checkpoint.store(options['checkpoint'])
+    else:
+        summary, profiles = analyze(filename)
+
+    # samples for simulation (NumSet):
+    for name in ('c_duration', 'c10_duration'):
+        statistics.NumSet(profiles[name].label) \
+            .fromlist(profiles[name].itervalues()).store(name + '.dat')
+    if profiles['m_duration'] is not None:
+        profiles['m_duration'].store('c_duration.model')
+    profiles['p_calls_rate'].store('rate.profile')
+
+    report.emit(summary, options['format'])
+
+    if options['plot'] or options['show']:
+        h_calls_profile = profiles['h_calls_profile']
+        h_calls10_profile = profiles['h_calls10_profile']
+        if h_calls_profile is None or h_calls10_profile is None:
+            sys.stderr.write('No answered calls to plot.\n')
+            return 1
+        try:
+            report.plot([
+                    (h_calls_profile.label,) + tuple(h_calls_profile()),
+                    (h_calls10_profile.label,) + tuple(h_calls10_profile())
+                ],
+                filename=options['plot'],
+                title="Distribution of Call Duration and Dialing Time",
+                xlabel="Time (sec)",
+                ylabel="Calls N",
+                show=options['show'])
+        except report.EReportError as e:
+            sys.stderr.write('{}\n'.format(e))
+            return 1
+    return 0
     
 if __name__ == '__main__':
-    main()
-    #~ import doctest
-    #~ doctest.testmod()
-    
-    #~ p = NumSet()
-    #~ p.fromlist([0,10,10,10,10,20,20, 30, 40])
-    #~ p.y
-    
-    #~ h = Histogram(source=p, bins=3)
-    #~ print h
-    
\ No newline at end of file
+    sys.exit(main(sys.argv))
@@ -0,0 +1,209 @@
+# fix division problem:
+from __future__ import division
+
+# Low-overhead recorder of many metrics over time: samples are
+# written into preallocated columnar arrays (one per metric).
+# When capacity is reached, the recorder either downsamples
+# (pairs of samples are merged and every next stored sample is
+# the mean of twice as many samples) or, in ring mode, overwrites
+# the oldest samples. Recorded trajectories are exported as dict
+# (for JSON reports) or compact binary frames.
+
+import struct
+from array import array
+
+class ERecorderError(Exception):
+    "Generic error of recorder"
+    pass
+
+MODES = ('downsample', 'ring')
+
+MAGIC = 'D9TS'
+# magic, number of metrics, number of samples, stride, length of names
+HEADER = struct.Struct('<4sHIIH')
+
+class Recorder(object):
+    """
+    >>> r = Recorder(['a', 'b'], capacity=4)
+    >>> for t in xrange(10): r.sample(t, (t, 10 * t))
+    >>> r.stride, list(r.times), list(r.column('a'))
+    (4, [0.0, 4.0], [1.5, 5.5])
+    >>> r = Recorder(['a'], capacity=3)
+    >>> for t in xrange(12): r.sample(t, (t,))
+    >>> r.stride, list(r.times), list(r.column('a'))
+    (8, [0.0], [3.5])
+    >>> r = Recorder(['a'], capacity=3, mode='ring')
+    >>> for t in xrange(5): r.sample(t, (t,))
+    >>> list(r.times), list(r.column('a'))
+    ([2.0, 3.0, 4.0], [2.0, 3.0, 4.0])
+    >>> Recorder.loads(r.dumps()).export()['a']
+    [2.0, 3.0, 4.0]
+    """
+
+    def __init__(self, metrics, capacity=4096, mode='downsample'):
+        if mode not in MODES:
+            raise ERecorderError('Unknown mode "{}", use one of: {}'.format(mode, ', '.join(MODES)))
+        if capacity < 2:
+            raise ERecorderError('Capacity of recorder must be at least 2!')
+        self.metrics = list(metrics)
+        self.capacity = capacity
+        self.mode = mode
+        self._times = array('d', [0.0]) * capacity
+        self._columns = [array('d', [0.0]) * capacity for name in self.metrics]
+        self._index = dict((name, i) for i, name in enumerate(self.metrics))
+        # number of stored samples, position of the next one (ring):
+        self.length = 0
+        self._head = 0
+        # number of samples merged into every stored sample:
+        self.stride = 1
+        # accumulated samples of the current stride:
+        self._pending = 0
+        self._time = 0.0
+        self._sums = [0.0] * len(self.metrics)
+
+    def sample(self, t, values):
+        "Record values of all metrics (in order of metrics) at time t"
+        if len(values) != len(self._columns):
+            raise ERecorderError('Expected {} values, got {}!'.format(len(self._columns), len(values)))
+        if self.stride == 1:
+            self._store(t, values)
+            return
+        if self._pending == 0:
+            self._time = t
+            self._sums = list(values)
+        else:
+            sums = self._sums
+            for i, value in enumerate(values):
+                sums[i] += value
+        self._pending += 1
+        if self._pending == self.stride:
+            stride = self.stride
+            self._pending = 0
+            self._store(self._time, [value / stride for value in self._sums])
+
+    def _store(self, t, values):
+        if self.length == self.capacity:
+            # ring mode: overwrite the oldest sample
+            self._head %= self.capacity
+            self.length -= 1
+        i = self._head
+        self._times[i] = t
+        for column, value in zip(self._columns, values):
+            column[i] = value
+        self._head += 1
+        self.length += 1
+        if self.length == self.capacity and self.mode == 'downsample':
+            self._downsample()
+
+    def _downsample(self):
+        """
+        Merge pairs of stored samples, double the stride; unpaired
+        sample (odd capacity) starts accumulation of the next one
+        """
+        half = self.length // 2
+        times = self._times
+        if self.length % 2:
+            last = self.length - 1
+            self._time = times[last]
+            self._sums = [column[last] * self.stride for column in self._columns]
+            self._pending = self.stride
+        for i in xrange(half):
+            times[i] = times[2 * i]
+        for column in self._columns:
+            for i in xrange(half):
+                column[i] = (column[2 * i] + column[2 * i + 1]) / 2
+        self.length = self._head = half
+        self.stride *= 2
+
+    def _order(self, data):
+        "Stored samples of array in order of time"
+        if self.mode == 'ring' and self.length == self.capacity:
+            head = self._head % self.capacity
+            return data[head:] + data[:head]
+        return data[:self.length]
+
+    @property
+    def times(self):
+        return self._order(self._times)
+
+    def column(self, name):
+        try:
+            return self._order(self._columns[self._index[name]])
+        except KeyError:
+            raise ERecorderError('Unknown metric "{}"!'.format(name))
+
+    def export(self):
+        "Trajectory as dict of lists (e.g., for report.emit())"
+        data = {'time': self.times.tolist(), 'stride': self.stride}
+        for name in self.metrics:
+            data[name] = self.column(name).tolist()
+        return data
+
+    def dumps(self):
+        "Binary frame: header, names, time column and metric columns (little-endian doubles)"
+        names = '\n'.join(self.metrics)
+        columns = [self.times] + [self.column(name) for name in self.metrics]
+        if struct.pack('=H', 1) != struct.pack('<H', 1):
+            for column in columns:
+                column.byteswap()
+        return HEADER.pack(MAGIC, len(self.metrics), self.length, self.stride, len(names)) + \
+            names + ''.join(column.tostring() for column in columns)
+
+    @classmethod
+    def loads(cls, data, offset=0):
+        "Load recorder from binary frame (capacity = number of samples)"
+        recorder, size = cls._loads(data, offset)
+        return recorder
+
+    @classmethod
+    def _loads(cls, data, offset):
+        try:
+            magic, n_metrics, length, stride, names_size = HEADER.unpack_from(data, offset)
+        except struct.error:
+            raise ERecorderError('Truncated recorder frame!')
+        if magic != MAGIC:
+            raise ERecorderError('Bad recorder frame magic: {!r}'.format(magic))
+        offset += HEADER.size
+        names = data[offset:offset + names_size]
+        offset += names_size
+        recorder = cls(names.split('\n') if n_metrics else [], capacity=max(length, 2))
+        columns = []
+        for i in xrange(n_metrics + 1):
+            column = array('d')
+            column.fromstring(data[offset:offset + 8 * length])
+            if struct.pack('=H', 1) != struct.pack('<H', 1):
+                column.byteswap()
+            columns.append(column)
+            offset += 8 * length
+        recorder._times[:length] = columns[0]
+        for target, column in zip(recorder._columns, columns[1:]):
+            target[:length] = column
+        recorder.length = recorder._head = length
+        recorder.stride = stride
+        return recorder, offset
+
+    def store(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.dumps())
+        return self # for chaining
+
+def storeall(recorders, filename):
+    "Store sequence of recorders (e.g., runs) into single file"
+    with open(filename, 'wb') as f:
+        for recorder in recorders:
+            f.write(recorder.dumps())
+
+def loadall(filename):
+    "Load list of recorders stored by storeall() or Recorder.store()"
+    with open(filename, 'rb') as f:
+        data = f.read()
+    recorders = []
+    offset = 0
+    while offset < len(data):
+        recorder, offset = Recorder._loads(data, offset)
+        recorders.append(recorder)
+    return recorders
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
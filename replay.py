@@ -0,0 +1,197 @@
+# fix division problem:
+from __future__ import division
+
+# Replay of historical call log through a solver:
+# for every tick the windowed solver inputs (calls_total,
+# calls_answered, calls_served, idle_agents) are reconstructed
+# from the log and the prediction is compared with
+# the number of calls actually dialed.
+
+import sys
+import heapq
+from collections import deque, namedtuple
+
+import dctr
+import calllog
+
+Tick = namedtuple('Tick', ['time', 'idle_agents', 'calls_total', 'calls_answered',
+    'calls_served', 'predicted', 'actual'])
+
+# kinds of window events:
+DIALED, ANSWERED, SERVED = 0, 1, 2
+
+class Replay(object):
+    """
+    Streaming replay for single day of log.
+    Window counters and busy agents are updated incrementally,
+    so cost is proportional to number of rows and ticks.
+    Times are full timestamps (calls across midnight are
+    ordered correctly), ticks are reported in the same units.
+
+    >>> rows = [
+    ...     {'agent_name': 'a1', 'call_timestamp': 86390, 'talk_timestamp': 86395, 'call_duration': 60},
+    ...     {'agent_name': 'a2', 'call_timestamp': 86392, 'talk_timestamp': None, 'call_duration': None},
+    ...     {'agent_name': 'a2', 'call_timestamp': 86400, 'talk_timestamp': 86410, 'call_duration': 5},
+    ... ]
+    >>> r = Replay(tick=10, window=300, settings={'uptime_threshold': 0})
+    >>> for t in r.run(rows): print t.time, t.idle_agents, t.calls_total, t.calls_answered, t.calls_served, t.actual
+    86400 1 3 1 1 3
+    86410 0 3 2 1 0
+    """
+
+    def __init__(self, solver_factory=dctr.PIController, settings=None,
+            tick=5, window=300, served_threshold=10, n_agents=None, idle_agents=None):
+        self.solver_factory = solver_factory
+        self.settings = settings or {}
+        self.tick = tick
+        self.window = window
+        # calls longer than threshold are counted as "served" (see parse_log)
+        self.served_threshold = served_threshold
+        # if None - number of agents seen in log so far
+        self.n_agents = n_agents
+        # optional function of timestamp (e.g., occupancy.Occupancy()
+        # .fromrows(rows).idle_agents()), used instead of
+        # estimation from n_agents and busy agents:
+        self.idle_agents = idle_agents
+
+    def run(self, rows):
+        "Generate Tick for every tick of rows (ordered by call timestamp)"
+        env = dctr.PIEnvironment(**self.settings)
+        solver = self.solver_factory(env)
+        tick, window = self.tick, self.window
+
+        pending = [] # heap of (time, kind, duration)
+        events = deque() # window events (time, kind)
+        counters = [0, 0, 0] # DIALED, ANSWERED, SERVED in window
+        busy = [] # heap of busy-until times
+        agents = set()
+
+        started = None
+        now = None
+        actual = 0
+
+        def advance(now):
+            # move pending events into window:
+            while pending and pending[0][0] <= now:
+                t, kind, duration = heapq.heappop(pending)
+                events.append((t, kind))
+                counters[kind] += 1
+                if kind == ANSWERED and duration:
+                    heapq.heappush(busy, t + duration)
+            # expire old events:
+            edge = now - window
+            while events and events[0][0] <= edge:
+                counters[events.popleft()[1]] -= 1
+            while busy and busy[0] <= now:
+                heapq.heappop(busy)
+
+        def decide(now, actual):
+            if self.idle_agents is not None:
+                env.idle_agents = self.idle_agents(now)
+            else:
+                n_agents = self.n_agents or len(agents)
+                env.idle_agents = max(0, n_agents - len(busy))
+            env.calls_total, env.calls_answered, env.calls_served = counters
+            env.uptime = now - started
+            env.interval = tick
+            try:
+                predicted = solver.predict_outgoing_calls()
+            except dctr.ESolverError:
+                predicted = None
+            return Tick(now, env.idle_agents, counters[DIALED], counters[ANSWERED],
+                counters[SERVED], predicted, actual)
+
+        for row in rows:
+            call_time = row['call_timestamp']
+            if call_time is None:
+                continue
+            if started is None:
+                started = call_time
+                now = call_time + tick
+            while call_time > now:
+                advance(now)
+                yield decide(now, actual)
+                actual = 0
+                now += tick
+            actual += 1
+            agents.add(row['agent_name'])
+            heapq.heappush(pending, (call_time, DIALED, None))
+            talk_time = row['talk_timestamp']
+            if talk_time is not None:
+                duration = row['call_duration']
+                heapq.heappush(pending, (talk_time, ANSWERED, duration))
+                if duration and duration > self.served_threshold:
+                    heapq.heappush(pending, (talk_time, SERVED, None))
+
+        # flush the rest of events:
+        while pending:
+            advance(now)
+            yield decide(now, actual)
+            actual = 0
+            now += tick
+
+def summarize(ticks):
+    """
+    Aggregate ticks of replay: total predicted and
+    actually dialed calls, mean absolute difference per tick.
+    >>> sorted(summarize([Tick(5, 1, 1, 1, 1, 3, 1), Tick(10, 1, 1, 1, 1, None, 2)]).items())
+    [('actual', 3), ('errors', 1), ('mean_abs_diff', 2.0), ('predicted', 3), ('ticks', 2)]
+    """
+    n, errors, predicted, actual, diff = 0, 0, 0, 0, 0
+    for t in ticks:
+        n += 1
+        actual += t.actual
+        if t.predicted is None:
+            errors += 1
+            continue
+        predicted += t.predicted
+        diff += abs(t.predicted - t.actual)
+    try:
+        mean_abs_diff = diff / (n - errors)
+    except ZeroDivisionError:
+        mean_abs_diff = 0
+    return {'ticks': n, 'errors': errors, 'predicted': predicted,
+        'actual': actual, 'mean_abs_diff': mean_abs_diff}
+
+def replay_day(args):
+    "Replay rows of single day, return (day, summary); used by worker processes"
+    day, rows, options = args
+    return day, summarize(Replay(**options).run(rows))
+
+def backtest(filename, processes=None, **options):
+    """
+    Replay every day of log file in parallel,
+    return list of (day, summary), ordered by day.
+    Options are passed to Replay().
+    """
+    tasks = ((day, rows, options) for day, rows in
+        calllog.iterdays(calllog.iterlog(filename)))
+    if processes == 1:
+        return sorted(map(replay_day, tasks))
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        return sorted(pool.imap_unordered(replay_day, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+def main(argv):
+    """
+    Usage: replay.py <call_log.csv> [solver class name from dctr] [tick]
+    """
+    if len(argv) < 2:
+        print main.__doc__
+        return 1
+    solver_factory = getattr(dctr, argv[2]) if len(argv) > 2 else dctr.PIController
+    tick = int(argv[3]) if len(argv) > 3 else 5
+    for day, summary in backtest(argv[1], solver_factory=solver_factory, tick=tick):
+        print '{}: ticks: {ticks}, predicted: {predicted}, actual: {actual}, mean abs diff: {mean_abs_diff:.2f}, errors: {errors}' \
+            .format(day, **summary)
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv))
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,122 @@
+# fix division problem:
+from __future__ import division
+
+# Headless reporting: machine-readable summaries (JSON, CSV)
+# and plots rendered to files. Matplotlib is imported
+# only when plot is requested.
+
+import sys
+import csv
+import json
+
+class EReportError(Exception):
+    "Generic error in reporting"
+    pass
+
+FORMATS = ('json', 'csv', 'text')
+
+def flatten(summary, prefix=''):
+    """
+    Flatten nested dicts (and lists) into list of (dotted name, value).
+    >>> flatten({'a': 1, 'b': {'c': 2, 'd': {'e': 3}}, 'f': [{'g': 4}]})
+    [('a', 1), ('b.c', 2), ('b.d.e', 3), ('f.0.g', 4)]
+    """
+    if isinstance(summary, (list, tuple)):
+        items = [(str(i), value) for i, value in enumerate(summary)]
+    else:
+        items = sorted(summary.items())
+    buff = []
+    for name, value in items:
+        if isinstance(value, (dict, list, tuple)):
+            buff.extend(flatten(value, prefix + name + '.'))
+        else:
+            buff.append((prefix + name, value))
+    return buff
+
+def emit(summary, format='json', stream=None):
+    """
+    Write summary (dict) to stream (stdout by default).
+    json - single JSON object; csv - rows "name,value";
+    text - lines "name: value".
+    >>> emit({'n_calls': 10, 'duration': {'mean': 2.5}}, 'csv')
+    name,value
+    duration.mean,2.5
+    n_calls,10
+    >>> emit({'n_calls': 10}, 'text')
+    n_calls: 10
+    """
+    stream = stream or sys.stdout
+    if format == 'json':
+        json.dump(summary, stream, indent=2, sort_keys=True)
+        stream.write('\n')
+    elif format == 'csv':
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(('name', 'value'))
+        writer.writerows(flatten(summary))
+    elif format == 'text':
+        for name, value in flatten(summary):
+            stream.write('{}: {}\n'.format(name, value))
+    else:
+        raise EReportError('Unknown report format "{}", use one of: {}' \
+            .format(format, ', '.join(FORMATS)))
+
+def pyplot(show=False):
+    """
+    Import matplotlib.pyplot on demand; non-interactive
+    backend is selected unless plot must be shown.
+    """
+    try:
+        import matplotlib
+        if not show:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise EReportError('Requires matplotlib module for plotting!')
+    return plt
+
+def plot(series, filename=None, title='', xlabel='', ylabel='', show=False):
+    """
+    Render series (list of (label, x values, y values))
+    into file (format from extension) and/or show it.
+    """
+    plt = pyplot(show)
+    figure = plt.figure()
+    for label, x, y in series:
+        plt.plot(x, y, label=label)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.legend()
+    if filename:
+        figure.savefig(filename)
+    if show:
+        plt.show()
+    plt.close(figure)
+
+def parseargs(argv, options):
+    """
+    Parse arguments like --name=value (or --flag) into copy of
+    options (dict with default values); return (options, positional args).
+    >>> options, args = parseargs(['x.py', 'log.csv', '--format=csv', '--show'],
+    ...     {'format': 'json', 'show': False})
+    >>> sorted(options.items()), args
+    ([('format', 'csv'), ('show', True)], ['log.csv'])
+    """
+    options = dict(options)
+    args = []
+    for arg in argv[1:]:
+        if not arg.startswith('--'):
+            args.append(arg)
+            continue
+        if '=' in arg:
+            name, value = arg[2:].split('=', 1)
+        else:
+            name, value = arg[2:], True
+        if name not in options:
+            raise EReportError('Unknown option: {}'.format(arg))
+        options[name] = value
+    return options, args
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
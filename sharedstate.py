@@ -0,0 +1,215 @@
+# fix division problem:
+from __future__ import division
+
+# Controller state of campaigns in shared memory: fixed-layout
+# records (integrator and predict_adjust per campaign) in a file
+# mapped by every worker process (e.g., in /dev/shm), so any
+# worker can serve any campaign without sticky routing: the rest
+# of decision comes from request (PIController keeps no other
+# state between decisions).
+# Readers use seqlock (no locks, retry if record was changed
+# while read); read-modify-write of record (decision) holds
+# POSIX record lock of that record only. Records are never
+# freed: campaign keeps its slot (open addressing by key).
+# Locks are per process: use single SharedState per process.
+
+import os
+import mmap
+import time
+import zlib
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    # no record locks (e.g., Windows): single writer process only
+    fcntl = None
+
+class ESharedStateError(Exception):
+    "Generic error of shared state table"
+    pass
+
+MAGIC = 'D9SS'
+VERSION = 1
+# magic, version, capacity, size of record
+HEADER = struct.Struct('<4sHIH')
+# records start at aligned offset:
+RECORDS_OFFSET = 64
+# sequence (odd while record is written)
+SEQ = struct.Struct('<I')
+# used flag, campaign key, integrator, predict_adjust, decisions, time of update
+BODY = struct.Struct('<I32sddQd')
+RECORD_SIZE = SEQ.size + BODY.size
+KEY_SIZE = 32
+
+class SharedState(object):
+    """
+    Table of controller states shared by processes.
+
+    >>> import tempfile
+    >>> filename = tempfile.mktemp()
+    >>> a, b = SharedState(filename, capacity=8), SharedState(filename)
+    >>> a.read('c1') is None
+    True
+    >>> slot = a.acquire('c1')
+    >>> a.store(slot, 3.5, 120.0).release(slot).read('c1')[:3]
+    (3.5, 120.0, 1)
+    >>> b.read('c1')[:3], b.capacity
+    ((3.5, 120.0, 1), 8)
+    >>> a.close(); b.close(); os.remove(filename)
+    """
+
+    def __init__(self, filename, capacity=1024):
+        if capacity < 1:
+            raise ESharedStateError('Capacity of shared state must be positive!')
+        self.filename = filename
+        self._fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._lock(0, RECORDS_OFFSET)
+            try:
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, RECORDS_OFFSET + capacity * RECORD_SIZE)
+                    os.write(self._fd, HEADER.pack(MAGIC, VERSION, capacity, RECORD_SIZE))
+                size = os.fstat(self._fd).st_size
+                self._map = mmap.mmap(self._fd, size)
+            finally:
+                self._unlock(0, RECORDS_OFFSET)
+            magic, version, capacity, record_size = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+                raise ESharedStateError('File "{}" is not shared state table (version {})!'
+                    .format(filename, VERSION))
+            if size < RECORDS_OFFSET + capacity * RECORD_SIZE:
+                raise ESharedStateError('Shared state table "{}" is truncated!'.format(filename))
+        except (EnvironmentError, struct.error):
+            os.close(self._fd)
+            raise ESharedStateError('Cannot map shared state table "{}"!'.format(filename))
+        except ESharedStateError:
+            os.close(self._fd)
+            raise
+        self.capacity = capacity
+        # campaign -> slot (slots never move):
+        self._slots = {}
+
+    def _lock(self, offset, size):
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, size, offset, os.SEEK_SET)
+
+    def _unlock(self, offset, size):
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, size, offset, os.SEEK_SET)
+
+    @staticmethod
+    def _key(campaign):
+        key = campaign.encode('utf-8') if isinstance(campaign, unicode) else str(campaign)
+        if len(key) > KEY_SIZE:
+            raise ESharedStateError('Campaign key "{}" is longer than {} bytes!'.format(key, KEY_SIZE))
+        return key
+
+    def _offset(self, slot):
+        return RECORDS_OFFSET + slot * RECORD_SIZE
+
+    def _read(self, slot):
+        "Consistent body of record (seqlock read)"
+        m, offset = self._map, self._offset(slot)
+        while True:
+            seq = SEQ.unpack_from(m, offset)[0]
+            if seq & 1:
+                # writer in progress:
+                time.sleep(0)
+                continue
+            body = BODY.unpack_from(m, offset + SEQ.size)
+            if SEQ.unpack_from(m, offset)[0] == seq:
+                return body
+
+    def _write(self, slot, *body):
+        "Write body of locked record"
+        m, offset = self._map, self._offset(slot)
+        seq = SEQ.unpack_from(m, offset)[0]
+        SEQ.pack_into(m, offset, (seq + 1) & 0xffffffff)
+        BODY.pack_into(m, offset + SEQ.size, *body)
+        SEQ.pack_into(m, offset, (seq + 2) & 0xffffffff)
+
+    def find(self, campaign, create=False):
+        "Slot of campaign (None if campaign has no record and create is False)"
+        try:
+            return self._slots[campaign]
+        except KeyError:
+            pass
+        key = self._key(campaign)
+        start = zlib.crc32(key) & 0xffffffff
+        for i in xrange(self.capacity):
+            slot = (start + i) % self.capacity
+            used, stored = self._read(slot)[:2]
+            if not used:
+                if not create:
+                    return None
+                # claim empty slot (other worker may claim it first):
+                offset = self._offset(slot)
+                self._lock(offset, RECORD_SIZE)
+                try:
+                    used, stored = self._read(slot)[:2]
+                    if not used:
+                        self._write(slot, 1, key, 0.0, 0.0, 0, 0.0)
+                        used, stored = 1, key
+                finally:
+                    self._unlock(offset, RECORD_SIZE)
+            if stored.rstrip('\0') == key:
+                self._slots[campaign] = slot
+                return slot
+        if create:
+            raise ESharedStateError('Shared state table is full ({} campaigns)!'.format(self.capacity))
+        return None
+
+    def read(self, campaign):
+        """
+        State of campaign without locks: (integrator, predict_adjust,
+        decisions, time of update); None for unknown campaign
+        """
+        slot = self.find(campaign)
+        if slot is None:
+            return None
+        return self._read(slot)[2:]
+
+    def acquire(self, campaign):
+        "Lock record of campaign (created if necessary) for decision, return slot"
+        slot = self.find(campaign, create=True)
+        self._lock(self._offset(slot), RECORD_SIZE)
+        return slot
+
+    def load(self, slot):
+        "(integrator, predict_adjust) of acquired record, None if nothing stored yet"
+        integrator, predict_adjust, decisions = self._read(slot)[2:5]
+        return (integrator, predict_adjust) if decisions else None
+
+    def store(self, slot, integrator, predict_adjust):
+        "Update acquired record"
+        used, key, old_integrator, old_adjust, decisions, updated = self._read(slot)
+        self._write(slot, used, key, integrator, predict_adjust, decisions + 1, time.time())
+        return self # for chaining
+
+    def release(self, slot):
+        self._unlock(self._offset(slot), RECORD_SIZE)
+        return self # for chaining
+
+    def campaigns(self):
+        "Dict campaign key -> state of all records (without locks)"
+        states = {}
+        for slot in xrange(self.capacity):
+            body = self._read(slot)
+            if body[0]:
+                states[body[1].rstrip('\0')] = body[2:]
+        return states
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def __str__(self):
+        return 'SharedState: {}, capacity: {}'.format(self.filename, self.capacity)
+
+    def __repr__(self):
+        return self.__str__()
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,331 @@
+# fix division problem:
+from __future__ import division
+
+# Replication statistics for simulation experiments:
+# confidence intervals of replicated metrics, named random
+# streams (common random numbers across compared configurations,
+# antithetic streams) and sequential stopping of replications
+# once the target precision is reached; warm-start snapshots.
+# Module does not depend on simulation suite: replication is any
+# function run(streams) which returns dict of metrics.
+
+import copy
+import math
+import pickle
+import random
+import hashlib
+
+class ESimulationError(Exception):
+    "Generic error in simulation tools"
+    pass
+
+##############################################
+# Confidence intervals
+##############################################
+
+def normal_quantile(p):
+    """
+    Inverse of standard normal CDF (P. J. Acklam's rational
+    approximation, relative error below 1.2e-9).
+    >>> round(normal_quantile(0.975), 6), normal_quantile(0.5)
+    (1.959964, 0.0)
+    """
+    if not 0 < p < 1:
+        raise ESimulationError('Probability must be in (0, 1)!')
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+        1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+        6.680131188771972e+01, -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+        -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+        3.754408661907416e+00)
+    if p == 0.5:
+        return 0.0
+    if p < 0.02425:
+        q = math.sqrt(-2 * math.log(p))
+        return (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    if p > 1 - 0.02425:
+        return -normal_quantile(1 - p)
+    q = p - 0.5
+    r = q * q
+    return (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+        (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+
+def t_quantile(p, df):
+    """
+    Quantile of Student t distribution: exact for 1 and 2 degrees
+    of freedom, Cornish-Fisher expansion otherwise.
+    >>> round(t_quantile(0.975, 1), 3), round(t_quantile(0.975, 4), 3), round(t_quantile(0.975, 30), 3)
+    (12.706, 2.776, 2.042)
+    """
+    if df < 1:
+        raise ESimulationError('Degrees of freedom must be positive!')
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = normal_quantile(p)
+    z2 = z * z
+    return z + (z2 + 1) * z / (4 * df) + \
+        ((5 * z2 + 16) * z2 + 3) * z / (96 * df ** 2) + \
+        (((3 * z2 + 19) * z2 + 17) * z2 - 15) * z / (384 * df ** 3) + \
+        ((((79 * z2 + 776) * z2 + 1482) * z2 - 1920) * z2 - 945) * z / (92160 * df ** 4)
+
+class Estimate(object):
+    """
+    Mean of independent observations with confidence interval
+    (running mean and variance, Welford's method).
+    >>> e = Estimate().fromlist([0.02, 0.03, 0.025, 0.027])
+    >>> e
+    Estimate: n: 4, mean: 0.0255
+    >>> round(e.halfwidth(0.95), 4)
+    0.0067
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+        return self # for chaining
+
+    def fromlist(self, values):
+        for value in values:
+            self.add(value)
+        return self # for chaining
+
+    @property
+    def variance(self):
+        "Sample variance"
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+    def halfwidth(self, confidence=0.95):
+        "Half-width of confidence interval of mean (inf for less than 2 observations)"
+        if self.n < 2:
+            return float('inf')
+        return t_quantile((1 + confidence) / 2, self.n - 1) * self.stdev / math.sqrt(self.n)
+
+    def interval(self, confidence=0.95):
+        h = self.halfwidth(confidence)
+        return self.mean - h, self.mean + h
+
+    def precise(self, precision, confidence=0.95, tolerance=0.0):
+        """
+        True if half-width of interval is within relative precision
+        of mean (or below absolute tolerance, for means close to zero)
+        """
+        return self.halfwidth(confidence) <= max(precision * abs(self.mean), tolerance)
+
+    def summary(self, confidence=0.95):
+        low, high = self.interval(confidence)
+        return {'n': self.n, 'mean': self.mean, 'stdev': self.stdev,
+            'halfwidth': self.halfwidth(confidence), 'low': low, 'high': high,
+            'confidence': confidence}
+
+    def __str__(self):
+        return 'Estimate: n: {}, mean: {:.6g}'.format(self.n, self.mean)
+
+    def __repr__(self):
+        return self.__str__()
+
+##############################################
+# Random streams
+##############################################
+
+class AntitheticRandom(random.Random):
+    """
+    Random generator which returns 1 - u for every uniform u
+    of the base sequence; all derived variates (uniform,
+    expovariate, randrange etc.) become antithetic.
+    >>> a, b = random.Random(5), AntitheticRandom(5)
+    >>> [round(a.random() + b.random(), 12) for i in xrange(3)]
+    [1.0, 1.0, 1.0]
+    """
+
+    def random(self):
+        u = 1.0 - random.Random.random(self)
+        # 1 - u is in (0, 1], keep result in [0, 1):
+        return u if u < 1.0 else 0.0
+
+class Streams(object):
+    """
+    Named independent random streams of single replication:
+    every purpose (answer, duration etc.) has own generator, so
+    configurations compared with the same seed consume the same
+    random numbers (common random numbers), even if they
+    draw different number of variates for other purposes.
+    >>> s, t = Streams(1), Streams(1)
+    >>> s['answer'].random() == t['answer'].random()
+    True
+    >>> Streams(1)['answer'].random() == Streams(1)['duration'].random()
+    False
+    """
+
+    def __init__(self, seed=0, antithetic=False):
+        self.seed = seed
+        self.antithetic = antithetic
+        self._streams = {}
+
+    def __getitem__(self, name):
+        try:
+            return self._streams[name]
+        except KeyError:
+            # seed of stream is independent of hash randomization:
+            key = int(hashlib.md5('{}:{}'.format(self.seed, name)).hexdigest()[:16], 16)
+            factory = AntitheticRandom if self.antithetic else random.Random
+            stream = self._streams[name] = factory(key)
+            return stream
+
+    def __str__(self):
+        return 'Streams: seed: {}{}'.format(self.seed, ', antithetic' if self.antithetic else '')
+
+    def __repr__(self):
+        return self.__str__()
+
+##############################################
+# Replications
+##############################################
+
+def _observe(run, seed, antithetic):
+    "Single observation: metrics of replication (mean of antithetic pair)"
+    metrics = run(Streams(seed))
+    if not antithetic:
+        return metrics
+    mirrored = run(Streams(seed, antithetic=True))
+    return dict((name, (value + mirrored[name]) / 2) for name, value in metrics.iteritems())
+
+def replicate(run, metrics, precision=0.05, confidence=0.95, tolerance=0.0,
+        min_runs=3, max_runs=100, seed=0, antithetic=False):
+    """
+    Run replications run(streams) until confidence intervals of all
+    metrics are within relative precision (or max_runs is reached);
+    return (dict metric -> Estimate, list of observations).
+    With antithetic=True every observation is mean of pair of
+    replications (plain and antithetic streams of the same seed).
+
+    >>> def run(streams):
+    ...     return {'x': streams['x'].uniform(0, 1)}
+    >>> estimates, observations = replicate(run, ['x'], precision=0.1, max_runs=1000)
+    >>> estimates['x'].precise(0.1), len(observations) < 1000
+    (True, True)
+    >>> pairs, observations = replicate(run, ['x'], precision=0.1, antithetic=True)
+    >>> round(pairs['x'].mean, 12), len(observations)
+    (0.5, 3)
+    """
+    if min_runs < 2:
+        raise ESimulationError('At least 2 replications are required for confidence interval!')
+    estimates = dict((name, Estimate()) for name in metrics)
+    observations = []
+    for i in xrange(max_runs):
+        observation = _observe(run, seed + i, antithetic)
+        observations.append(observation)
+        for name, estimate in estimates.iteritems():
+            estimate.add(observation[name])
+        if i + 1 >= min_runs and all(estimate.precise(precision, confidence, tolerance)
+                for estimate in estimates.itervalues()):
+            break
+    return estimates, observations
+
+def compare(configs, run, metrics, precision=0.05, confidence=0.95, tolerance=0.0,
+        min_runs=3, max_runs=100, seed=0, antithetic=False):
+    """
+    Compare configurations with common random numbers: replication i
+    of every configuration uses the same streams, differences of
+    metrics against the first (baseline) configuration are estimated.
+    run(config, streams) returns dict of metrics; replications stop
+    when intervals of all differences are within precision (relative
+    to the baseline mean) or below tolerance.
+    Return dict: config index -> {metric -> Estimate}, where
+    index 0 holds estimates of baseline and the rest - differences.
+
+    >>> def run(config, streams):
+    ...     return {'x': streams['x'].uniform(0, 1) + config}
+    >>> results = compare([0.0, 0.1], run, ['x'], precision=0.01, tolerance=1e-9)
+    >>> results[1]['x'].n, round(results[1]['x'].mean, 12), round(results[1]['x'].halfwidth(), 12)
+    (3, 0.1, 0.0)
+    """
+    if len(configs) < 2:
+        raise ESimulationError('At least 2 configurations are required for comparison!')
+    if min_runs < 2:
+        raise ESimulationError('At least 2 replications are required for confidence interval!')
+    results = dict((k, dict((name, Estimate()) for name in metrics)) for k in xrange(len(configs)))
+    for i in xrange(max_runs):
+        observations = [_observe(lambda streams: run(config, streams), seed + i, antithetic)
+            for config in configs]
+        base = observations[0]
+        for name in metrics:
+            results[0][name].add(base[name])
+            for k in xrange(1, len(configs)):
+                results[k][name].add(observations[k][name] - base[name])
+        if i + 1 >= min_runs and all(
+                results[k][name].halfwidth(confidence) <=
+                    max(precision * abs(results[0][name].mean), tolerance)
+                for k in xrange(1, len(configs)) for name in metrics):
+            break
+    return results
+
+##############################################
+# Warm start
+##############################################
+
+class Snapshot(object):
+    """
+    Steady-state snapshot of simulation: model time, state variables,
+    controller state and in-flight activities (each is a tuple, e.g.
+    (kind, remaining time, ...)). What-if branches fork from the
+    snapshot instead of re-simulating warm-up period.
+
+    >>> s = Snapshot(3600, {'idle_agents': 2}, {'integrator': 5}, [('talk', 30.0, 90.0)])
+    >>> b = s.fork()
+    >>> b.state['idle_agents'] = 0
+    >>> s.state['idle_agents'], b.inflight
+    (2, [('talk', 30.0, 90.0)])
+    """
+
+    stored_attrs = ['clock', 'state', 'controller', 'inflight']
+
+    def __init__(self, clock=0, state=None, controller=None, inflight=()):
+        self.clock = clock
+        self.state = state or {}
+        self.controller = controller or {}
+        self.inflight = list(inflight)
+
+    def fork(self):
+        "Independent copy for single branch"
+        return copy.deepcopy(self)
+
+    def store(self, filename):
+        data = {}
+        for name in self.stored_attrs:
+            data[name] = getattr(self, name)
+        with open(filename, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        return self # for chaining
+
+    def load(self, filename):
+        with open(filename, 'rb') as f:
+            data = pickle.load(f)
+        for name in self.stored_attrs:
+            setattr(self, name, data[name])
+        return self # for chaining
+
+    def __str__(self):
+        return 'Snapshot: clock: {}, in-flight: {}'.format(self.clock, len(self.inflight))
+
+    def __repr__(self):
+        return self.__str__()
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -7,14 +7,6 @@ import math
 import random
 import itertools
 
-import sys
-try:
-    import matplotlib.pyplot as plt
-    import numpy
-except ImportError:
-    print "Requires matplotlib and numpy modules!"
-    sys.exit(1)
-
 try:
     # if C version is available:
     import cPickle as pickle
@@ -96,10 +88,11 @@ class NumSequence(object):
         self._values.append(value)
         return self # for chaining
     
-    def selectrandom(self):
+    def selectrandom(self, rng=random):
+        "Random element; rng - random generator (e.g., stream of replication)"
         if self.len == 0:
             raise ENumSequenceError('Cannot select random element from empty set.')
-        index = random.randrange(0, self.len)
+        index = rng.randrange(0, self.len)
         return self.y[index]
     
     def _update(self):
@@ -211,6 +204,13 @@ class NumSequence(object):
         self._update()
         return iter(self._values)
     
+    def summary(self):
+        "Return aggregates as dict (e.g., for reports)"
+        return {
+            'label': self.label, 'min': self.min, 'mean': self.mean,
+            'max': self.max, 'sum': self.sum, 'count': len(self)
+        }
+
     def __str__(self):
         "Return string representation of object"
         return '{}: min: {}, mean: {}, max:{}, sum: {}, count: {}' \
@@ -358,6 +358,106 @@ class NumXY(NumSet):
             # if X range is near zero - return first Y value
             return self._values[-1][1]
 
+class CountedSet(NumSequence):
+    """
+    Sorted multiset stored as value -> count (histogram with
+    bin per distinct value): memory grows with number of distinct
+    values, aggregates are computed from counts and sets can be
+    merged (e.g., partial aggregates of growing log).
+    Independent variable - zero-based index, like in NumSet.
+    >>> p = CountedSet()
+    >>> p.append(10).append(5).append(20).append(10, count=2)
+    Data set: min: 5, mean: 11.0, max:20, sum: 55, count: 5
+    >>> p.y
+    (5, 10, 10, 10, 20)
+    >>> p.counts()
+    [(5, 1), (10, 3), (20, 1)]
+    >>> p.merge(CountedSet().fromlist([40, 5])).counts()
+    [(5, 2), (10, 3), (20, 1), (40, 1)]
+    >>> len(p)
+    7
+    >>> p.selectrandom() in p.y
+    True
+    """
+
+    stored_attrs = ['_label', '_counts', '_len']
+
+    def __init__(self, label='Data set'):
+        NumSequence.__init__(self, label=label)
+        self._counts = {}
+        self._len = 0
+
+    def append(self, value, count=1):
+        self._counts[value] = self._counts.get(value, 0) + count
+        self._len += count
+        return self # for chaining
+
+    def merge(self, source):
+        "Add counts of other CountedSet"
+        for value, count in source._counts.iteritems():
+            self.append(value, count)
+        return self # for chaining
+
+    def fromlist(self, data):
+        self._counts = {}
+        self._len = 0
+        for value in data:
+            self.append(value)
+        return self # for chaining
+
+    def counts(self):
+        "Sorted list of (value, count)"
+        return sorted(self._counts.iteritems())
+
+    def selectrandom(self, rng=random):
+        "Random element (weighted by counts); rng - random generator"
+        if self._len == 0:
+            raise ENumSequenceError('Cannot select random element from empty set.')
+        index = rng.randrange(0, self._len)
+        for value, count in self.counts():
+            index -= count
+            if index < 0:
+                return value
+
+    def x_slice(self, min=None, max=None, label=None):
+        "Return sliced NumSet where min<X<max"
+        return NumSet(self.label).fromlist(self.itervalues()).x_slice(min, max, label)
+
+    def y_slice(self, min=None, max=None, label=None):
+        "Return sliced NumSet where min<Y<max"
+        return NumSet(self.label).fromlist(self.itervalues()).y_slice(min, max, label)
+
+    @property
+    def len(self):
+        return self._len
+
+    @property
+    def min(self):
+        "Min value, None for empty set"
+        return min(self._counts) if self._counts else None
+
+    @property
+    def max(self):
+        "Max value, None for empty set"
+        return max(self._counts) if self._counts else None
+
+    @property
+    def sum(self):
+        return sum(value * count for value, count in self._counts.iteritems())
+
+    def iteritems(self):
+        return self.itervalues()
+
+    def iterkeys(self):
+        return xrange(0, self._len)
+
+    def itervalues(self):
+        return itertools.chain.from_iterable(
+            itertools.repeat(value, count) for value, count in self.counts())
+
+    def __len__(self):
+        return self._len
+
 class Histogram(NumXY):
     """
     Frequency distribution foe numeric sequence.
@@ -376,14 +476,17 @@ class Histogram(NumXY):
         NumXY.__init__(self, label=label)
         #~ print 'label:', label
         #~ print 'source', source
-        if isinstance(source, NumSequence) and source.len > 0: 
-            self._build(source.y, bins)
+        if isinstance(source, CountedSet) and source.len > 0:
+            self._build(source.counts(), bins)
+        elif isinstance(source, NumSequence) and source.len > 0:
+            self._build(CountedSet().fromlist(source.itervalues()).counts(), bins)
         else:
             raise ENumSequenceError('Cannot create histogram from empty object')
 
 
-    def _build(self, values, bins):
-        yrange = (max(values)-min(values))
+    def _build(self, counts, bins):
+        "Build from sorted list of (value, count)"
+        yrange = counts[-1][0] - counts[0][0]
         delta = math.ceil(yrange/bins)
         yremainder = yrange - delta * bins
         while yremainder != 0:
@@ -393,17 +496,15 @@ class Histogram(NumXY):
             yremainder = yrange - delta * bins
             
         vertices = {}
-        values = list(values)[:]
-        values.sort()
-        
-        v0 = values[0] + delta
-        for v in values:
-            if v > v0:
+        v0 = counts[0][0] + delta
+        for v, count in counts:
+            # every value advances bin by single step at most:
+            while count and v > v0:
                 v0 += delta
-            if v0 not in vertices:
-                vertices[v0] = 1
-            else:
-                vertices[v0] += 1
+                vertices[v0] = vertices.get(v0, 0) + 1
+                count -= 1
+            if count:
+                vertices[v0] = vertices.get(v0, 0) + count
         
         self._values = list(vertices.iteritems())
         self._values.sort()
@@ -420,7 +521,6 @@ class Histogram(NumXY):
     @property
     def sum(self):
         "Sum value of dependent variable (like sum(Y))"
-        print type(self)
         return sum(map(lambda x, y: x * y, self.iterkeys(), self.itervalues()))
     
     @property
@@ -444,6 +544,746 @@ class Histogram(NumXY):
         """
         return zip(*self._values)
 
+##############################################
+# Decayed and windowed statistics
+##############################################
+
+from collections import deque
+
+class DecayedStats(object):
+    """
+    Exponentially weighted mean and variance of drifting data:
+    weight of value halves every halflife (in units of time t,
+    or of appended values if t is not given). O(1) update,
+    fixed memory, samples are not kept. Weights are normalized,
+    so early values are not biased towards zero.
+    >>> d = DecayedStats(halflife=1)
+    >>> d.append(10).append(20)
+    Decayed stats: mean: 16.6666666667, stdev: 4.71404520791, weight: 1.5
+    >>> d = DecayedStats(halflife=60)
+    >>> for t in xrange(0, 600, 10): d = d.append(100 if t < 300 else 200, t)
+    >>> round(d.mean, 1), round(d.at(1190).weight, 3)
+    (197.0, 0.009)
+    """
+
+    stored_attrs = ['_label', 'halflife', 'count', 'weight', 'mean', 'variance', '_time']
+
+    def __init__(self, halflife, label='Decayed stats'):
+        if halflife <= 0:
+            raise ENumSequenceError('Half-life must be positive!')
+        self._label = label
+        self.halflife = halflife
+        self.count = 0
+        # sum of decayed weights (effective number of values):
+        self.weight = 0.0
+        self.mean = 0.0
+        self.variance = 0.0
+        self._time = None
+
+    def store(self, filename):
+        "Store state (e.g., between runs of controller)"
+        data = {}
+        for name in self.stored_attrs:
+            data[name] = getattr(self, name)
+        with open(filename, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, filename):
+        "Load stored state"
+        with open(filename, "rb") as f:
+            data = pickle.load(f)
+        for name, value in data.iteritems():
+            setattr(self, name, value)
+        return self # for chaining
+
+    def at(self, t):
+        "Decay weight of history up to time t (no new value)"
+        if self._time is not None and t > self._time:
+            self.weight *= 0.5 ** ((t - self._time) / self.halflife)
+        self._time = t if self._time is None else max(self._time, t)
+        return self # for chaining
+
+    def append(self, value, t=None):
+        "Add value observed at time t (default: number of appended values)"
+        self.at(self.count if t is None else t)
+        self.count += 1
+        self.weight += 1
+        alpha = 1 / self.weight
+        diff = value - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.variance = (1 - alpha) * (self.variance + diff * increment)
+        return self # for chaining
+
+    @property
+    def label(self):
+        return self._label
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+    def summary(self):
+        "Return aggregates as dict (e.g., for reports)"
+        return {
+            'label': self.label, 'mean': self.mean, 'stdev': self.stdev,
+            'weight': self.weight, 'count': self.count
+        }
+
+    def __str__(self):
+        return '{}: mean: {}, stdev: {}, weight: {}' \
+            .format(self.label, self.mean, self.stdev, self.weight)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return self.count
+
+class WindowedExtrema(object):
+    """
+    Min and max of values within sliding window (in units of
+    time t, or of appended values if t is not given): monotonic
+    deques, amortized O(1) update; only values which may become
+    min or max are kept. Min and max of empty window are None,
+    count (len) is number of all appended values.
+    >>> w = WindowedExtrema(window=3)
+    >>> for value in (5, 1, 4, 3, 2): w = w.append(value)
+    >>> w.min, w.max, len(w)
+    (2, 4, 5)
+    >>> w = WindowedExtrema(window=60).append(10, t=0).append(7, t=30)
+    >>> w.expire(70)
+    Windowed extrema: min: 7, max: 7, count: 2
+    >>> w.expire(100).min is None
+    True
+    """
+
+    stored_attrs = ['_label', 'window', 'count', '_time', '_mins', '_maxs']
+
+    def __init__(self, window, label='Windowed extrema'):
+        if window <= 0:
+            raise ENumSequenceError('Window must be positive!')
+        self._label = label
+        self.window = window
+        self.count = 0
+        self._time = None
+        # (time, value): increasing values (mins), decreasing values (maxs):
+        self._mins = deque()
+        self._maxs = deque()
+
+    def store(self, filename):
+        "Store state (e.g., between runs of controller)"
+        data = {}
+        for name in self.stored_attrs:
+            data[name] = getattr(self, name)
+        with open(filename, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, filename):
+        "Load stored state"
+        with open(filename, "rb") as f:
+            data = pickle.load(f)
+        for name, value in data.iteritems():
+            setattr(self, name, value)
+        return self # for chaining
+
+    def expire(self, t):
+        "Drop values out of window ending at time t"
+        self._time = t if self._time is None else max(self._time, t)
+        start = self._time - self.window
+        for queue in (self._mins, self._maxs):
+            while queue and queue[0][0] <= start:
+                queue.popleft()
+        return self # for chaining
+
+    def append(self, value, t=None):
+        "Add value observed at time t (default: number of appended values)"
+        if t is None:
+            t = self.count
+        self.count += 1
+        mins, maxs = self._mins, self._maxs
+        while mins and mins[-1][1] >= value:
+            mins.pop()
+        mins.append((t, value))
+        while maxs and maxs[-1][1] <= value:
+            maxs.pop()
+        maxs.append((t, value))
+        return self.expire(t)
+
+    @property
+    def label(self):
+        return self._label
+
+    @property
+    def min(self):
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def max(self):
+        return self._maxs[0][1] if self._maxs else None
+
+    def summary(self):
+        "Return aggregates as dict (e.g., for reports)"
+        return {'label': self.label, 'min': self.min, 'max': self.max, 'count': self.count}
+
+    def __str__(self):
+        return '{}: min: {}, max: {}, count: {}'.format(self.label, self.min, self.max, self.count)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return self.count
+
+##############################################
+# Fitted distribution models
+##############################################
+
+import struct
+
+class EDistributionError(Exception):
+    "Generic error in distribution model"
+    pass
+
+def _values(source):
+    "Values of NumSequence or any iterable"
+    if isinstance(source, NumSequence):
+        return source.y
+    return tuple(source)
+
+def _positive(values):
+    buff = [v for v in values if v > 0]
+    if not buff:
+        raise EDistributionError('Cannot fit model: no positive values.')
+    return buff
+
+def digamma(x):
+    "Digamma function (recurrence + asymptotic series)"
+    result = 0.0
+    while x < 6:
+        result -= 1 / x
+        x += 1
+    x2 = 1 / (x * x)
+    return result + math.log(x) - 0.5 / x \
+        - x2 * (1 / 12 - x2 * (1 / 120 - x2 / 252))
+
+def trigamma(x):
+    "Trigamma function (recurrence + asymptotic series)"
+    result = 0.0
+    while x < 6:
+        result += 1 / (x * x)
+        x += 1
+    x2 = 1 / (x * x)
+    return result + 1 / x + x2 / 2 \
+        + x2 / x * (1 / 6 - x2 * (1 / 30 - x2 / 42))
+
+def gammainc(a, x):
+    "Regularized lower incomplete gamma function P(a, x)"
+    if x <= 0:
+        return 0.0
+    lnorm = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # series:
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-12:
+            n += 1
+            term *= x / n
+            total += term
+        return total * math.exp(lnorm)
+    # continued fraction (modified Lentz):
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in xrange(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-12:
+            break
+    return 1 - math.exp(lnorm) * h
+
+class Distribution(object):
+    """
+    Base class for fitted parametric models.
+    Model is fitted by maximum likelihood from sufficient
+    statistics (single pass over values), can be scored
+    (log-likelihood, AIC, Kolmogorov-Smirnov statistic),
+    sampled and serialized into a few bytes.
+    """
+    code = None # type code for serialization
+    names = () # names of parameters
+
+    def __init__(self, *params):
+        if len(params) != len(self.names):
+            raise EDistributionError('{} requires parameters: {}' \
+                .format(self.__class__.__name__, ', '.join(self.names)))
+        self.params = tuple(float(p) for p in params)
+
+    @classmethod
+    def fit(cls, source):
+        raise NotImplementedError()
+
+    def logpdf(self, x):
+        raise NotImplementedError()
+
+    def cdf(self, x):
+        raise NotImplementedError()
+
+    def sample(self, rng=random):
+        raise NotImplementedError()
+
+    def selectrandom(self, rng=random):
+        "Same protocol as NumSequence.selectrandom() (for simulation)"
+        return self.sample(rng)
+
+    @property
+    def mean(self):
+        raise NotImplementedError()
+
+    def loglikelihood(self, source):
+        return sum(map(self.logpdf, _positive(_values(source))))
+
+    def aic(self, source):
+        "Akaike information criterion (lower is better)"
+        return 2 * len(self.params) - 2 * self.loglikelihood(source)
+
+    def ks(self, source):
+        "Kolmogorov-Smirnov statistic (lower is better)"
+        values = sorted(_positive(_values(source)))
+        n = len(values)
+        cdf = self.cdf
+        return max(max(F - i / n, (i + 1) / n - F)
+            for i, F in enumerate(map(cdf, values)))
+
+    def goodness(self, source):
+        "Goodness-of-fit scores as dict"
+        loglikelihood = self.loglikelihood(source)
+        return {
+            'loglikelihood': loglikelihood,
+            'aic': 2 * len(self.params) - 2 * loglikelihood,
+            'ks': self.ks(source)
+        }
+
+    def dumps(self):
+        "Serialize model: type code, number of parameters, parameters"
+        return struct.pack('<BB{}d'.format(len(self.params)),
+            self.code, len(self.params), *self.params)
+
+    def store(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.dumps())
+
+    def __str__(self):
+        return '{}({})'.format(self.__class__.__name__,
+            ', '.join('{}={:.6g}'.format(name, value)
+                for name, value in zip(self.names, self.params)))
+
+    def __repr__(self):
+        return self.__str__()
+
+class Exponential(Distribution):
+    """
+    >>> m = Exponential.fit([1, 2, 3])
+    >>> m
+    Exponential(rate=0.5)
+    >>> len(m.dumps())
+    10
+    >>> round(m.cdf(2), 6)
+    0.632121
+    """
+    code = 1
+    names = ('rate',)
+
+    @classmethod
+    def fit(cls, source):
+        values = _positive(_values(source))
+        return cls(len(values) / sum(values))
+
+    def logpdf(self, x):
+        rate = self.params[0]
+        return math.log(rate) - rate * x
+
+    def cdf(self, x):
+        return 1 - math.exp(-self.params[0] * x) if x > 0 else 0.0
+
+    def sample(self, rng=random):
+        return rng.expovariate(self.params[0])
+
+    @property
+    def mean(self):
+        return 1 / self.params[0]
+
+class Lognormal(Distribution):
+    """
+    >>> m = Lognormal.fit([math.exp(1), math.exp(3)])
+    >>> m
+    Lognormal(mu=2, sigma=1)
+    >>> round(m.cdf(math.exp(2)), 6)
+    0.5
+    """
+    code = 2
+    names = ('mu', 'sigma')
+
+    @classmethod
+    def fit(cls, source):
+        logs = map(math.log, _positive(_values(source)))
+        n = len(logs)
+        mu = sum(logs) / n
+        sigma = math.sqrt(sum((v - mu) ** 2 for v in logs) / n)
+        if sigma == 0:
+            raise EDistributionError('Cannot fit lognormal model: all values are equal.')
+        return cls(mu, sigma)
+
+    def logpdf(self, x):
+        mu, sigma = self.params
+        lx = math.log(x)
+        return -lx - math.log(sigma) - 0.5 * math.log(2 * math.pi) \
+            - (lx - mu) ** 2 / (2 * sigma * sigma)
+
+    def cdf(self, x):
+        if x <= 0:
+            return 0.0
+        mu, sigma = self.params
+        return 0.5 * (1 + math.erf((math.log(x) - mu) / (sigma * math.sqrt(2))))
+
+    def sample(self, rng=random):
+        return rng.lognormvariate(*self.params)
+
+    @property
+    def mean(self):
+        mu, sigma = self.params
+        return math.exp(mu + sigma * sigma / 2)
+
+class Gamma(Distribution):
+    """
+    Shape is estimated by Newton iterations of MLE equation.
+    >>> m = Gamma.fit([2, 4, 6, 8, 10])
+    >>> m
+    Gamma(shape=3.70164, scale=1.6209)
+    >>> round(m.mean, 6)
+    6.0
+    >>> round(m.cdf(1000), 6)
+    1.0
+    """
+    code = 3
+    names = ('shape', 'scale')
+
+    @staticmethod
+    def _shape(values):
+        n = len(values)
+        mean = sum(values) / n
+        s = math.log(mean) - sum(map(math.log, values)) / n
+        if s <= 1e-12:
+            raise EDistributionError('Cannot fit gamma model: all values are equal.')
+        k = (3 - s + math.sqrt((s - 3) ** 2 + 24 * s)) / (12 * s)
+        for i in xrange(50):
+            step = (math.log(k) - digamma(k) - s) / (1 / k - trigamma(k))
+            k -= step
+            if abs(step) < 1e-10 * k:
+                break
+        return k, mean
+
+    @classmethod
+    def fit(cls, source):
+        k, mean = cls._shape(_positive(_values(source)))
+        return cls(k, mean / k)
+
+    def logpdf(self, x):
+        k, theta = self.params
+        return (k - 1) * math.log(x) - x / theta - k * math.log(theta) - math.lgamma(k)
+
+    def cdf(self, x):
+        k, theta = self.params
+        return gammainc(k, x / theta)
+
+    def sample(self, rng=random):
+        return rng.gammavariate(*self.params)
+
+    @property
+    def mean(self):
+        return self.params[0] * self.params[1]
+
+class Erlang(Gamma):
+    """
+    Gamma model with integer shape.
+    >>> Erlang.fit([2, 4, 6, 8, 10])
+    Erlang(shape=4, scale=1.5)
+    """
+    code = 4
+
+    @classmethod
+    def fit(cls, source):
+        k, mean = cls._shape(_positive(_values(source)))
+        k = max(1, int(round(k)))
+        return cls(k, mean / k)
+
+class ExponentialMixture(Distribution):
+    """
+    Mixture of exponential components fitted by EM;
+    parameters: weight and rate for every component.
+    >>> rng = random.Random(1)
+    >>> values = [rng.expovariate(1.0) for i in xrange(3000)] + \\
+    ...     [rng.expovariate(0.01) for i in xrange(1000)]
+    >>> m = ExponentialMixture.fit(values, components=2)
+    >>> [round(w, 1) for w in m.weights], [round(1 / r, -1) for r in m.rates]
+    ([0.8, 0.2], [0.0, 100.0])
+    >>> len(m.dumps())
+    34
+    """
+    code = 5
+
+    def __init__(self, *params):
+        if not params or len(params) % 2:
+            raise EDistributionError('ExponentialMixture requires pairs of (weight, rate).')
+        self.names = tuple('{}{}'.format(name, i)
+            for i in xrange(len(params) // 2) for name in ('weight', 'rate'))
+        Distribution.__init__(self, *params)
+
+    @property
+    def weights(self):
+        return self.params[0::2]
+
+    @property
+    def rates(self):
+        return self.params[1::2]
+
+    @classmethod
+    def fit(cls, source, components=2, maxiter=100, tolerance=1e-8, maxvalues=5000):
+        """
+        EM iterations run over distinct values with their counts
+        (durations in seconds repeat heavily); more than maxvalues
+        values are sampled (deterministic sample).
+        """
+        values = _positive(_values(source))
+        if len(values) > maxvalues:
+            values = random.Random(0).sample(values, maxvalues)
+        values.sort()
+        n = len(values)
+        if n < components:
+            raise EDistributionError('Cannot fit mixture: not enough values.')
+        # initial guess: means of equal-size chunks of sorted values
+        weights = [1 / components] * components
+        rates = []
+        for i in xrange(components):
+            chunk = values[i * n // components:(i + 1) * n // components]
+            rates.append(len(chunk) / sum(chunk))
+        counts = [(x, len(list(group))) for x, group in itertools.groupby(values)]
+        last = None
+        for iteration in xrange(maxiter):
+            sums_r = [0.0] * components
+            sums_rx = [0.0] * components
+            loglikelihood = 0.0
+            for x, count in counts:
+                densities = [w * r * math.exp(-r * x) for w, r in zip(weights, rates)]
+                total = sum(densities) or 1e-300
+                loglikelihood += count * math.log(total)
+                for j in xrange(components):
+                    responsibility = count * densities[j] / total
+                    sums_r[j] += responsibility
+                    sums_rx[j] += responsibility * x
+            weights = [s / n for s in sums_r]
+            rates = [(s / sx) if sx > 0 else r for s, sx, r in zip(sums_r, sums_rx, rates)]
+            if last is not None and abs(loglikelihood - last) < tolerance * abs(last):
+                break
+            last = loglikelihood
+        params = []
+        for w, r in sorted(zip(weights, rates), reverse=True):
+            params.extend((w, r))
+        return cls(*params)
+
+    def logpdf(self, x):
+        return math.log(sum(w * r * math.exp(-r * x)
+            for w, r in zip(self.weights, self.rates)) or 1e-300)
+
+    def cdf(self, x):
+        if x <= 0:
+            return 0.0
+        return sum(w * (1 - math.exp(-r * x)) for w, r in zip(self.weights, self.rates))
+
+    def sample(self, rng=random):
+        u = rng.random()
+        for w, r in zip(self.weights, self.rates):
+            u -= w
+            if u < 0:
+                break
+        return rng.expovariate(r)
+
+    @property
+    def mean(self):
+        return sum(w / r for w, r in zip(self.weights, self.rates))
+
+    def __str__(self):
+        return 'ExponentialMixture({})'.format(', '.join(
+            '{:.6g}*Exp(rate={:.6g})'.format(w, r) for w, r in zip(self.weights, self.rates)))
+
+models = {}
+for _model in (Exponential, Lognormal, Gamma, Erlang, ExponentialMixture):
+    models[_model.code] = _model
+
+def loadsmodel(data):
+    """
+    Restore model serialized by .dumps().
+    >>> loadsmodel(Lognormal(2, 0.5).dumps())
+    Lognormal(mu=2, sigma=0.5)
+    """
+    code, count = struct.unpack_from('<BB', data)
+    if code not in models:
+        raise EDistributionError('Unknown model type: {}'.format(code))
+    return models[code](*struct.unpack_from('<{}d'.format(count), data, 2))
+
+def loadmodel(filename):
+    "Load model stored by .store()"
+    with open(filename, 'rb') as f:
+        return loadsmodel(f.read())
+
+def fitbest(source, candidates=(Exponential, Lognormal, Gamma, Erlang, ExponentialMixture)):
+    """
+    Fit candidate models, return (best model by AIC, scores)
+    where scores is dict: model name -> goodness-of-fit.
+    >>> rng = random.Random(1)
+    >>> best, scores = fitbest([rng.lognormvariate(3, 0.8) for i in xrange(2000)])
+    >>> best.__class__.__name__, sorted(scores)
+    ('Lognormal', ['Erlang', 'Exponential', 'ExponentialMixture', 'Gamma', 'Lognormal'])
+    """
+    values = _values(source)
+    best, best_aic, scores = None, None, {}
+    for candidate in candidates:
+        try:
+            model = candidate.fit(values)
+        except EDistributionError:
+            continue
+        scores[candidate.__name__] = score = model.goodness(values)
+        if best is None or score['aic'] < best_aic:
+            best, best_aic = model, score['aic']
+    if best is None:
+        raise EDistributionError('Cannot fit any model.')
+    return best, scores
+
+##############################################
+# Time-of-day rate profile
+##############################################
+
+from array import array
+
+class RateProfile(object):
+    """
+    Binned rate of calls (dialed calls observed in log) and answer
+    probability by time of day. Simulation plays back answer
+    probability (dialing itself is driven by controller), rate is
+    reported and plotted; lookup is single array index.
+    >>> p = RateProfile(bin_seconds=3600)
+    >>> for t in (9*3600, 9*3600+10, 9*3600+20, 10*3600): p = p.append(t, answered=(t % 20 == 0))
+    >>> p.days = 1
+    >>> round(p.rate(9*3600 + 1800) * 3600, 6)
+    3.0
+    >>> p.p_answer(9*3600 + 1800)
+    0.6666666666666666
+    >>> p.p_answer(3*3600, default=0.2)
+    0.2
+    >>> import os, tempfile
+    >>> filename = tempfile.mktemp()
+    >>> p.store(filename)
+    >>> RateProfile().load(filename).p_answer(10*3600)
+    1.0
+    >>> os.remove(filename)
+    """
+
+    stored_attrs = ['_label', 'bin_seconds', 'days', '_arrivals', '_answered']
+
+    def __init__(self, label='Rate profile', bin_seconds=15 * 60):
+        if 86400 % bin_seconds:
+            raise ENumSequenceError('Day must consist of whole number of bins!')
+        self._label = label
+        self.bin_seconds = bin_seconds
+        # number of observed days (rate is averaged by days):
+        self.days = 1
+        bins = 86400 // bin_seconds
+        self._arrivals = array('d', [0]) * bins
+        self._answered = array('d', [0]) * bins
+        self._needsupdate = True
+
+    def store(self, filename):
+        "Store profile for further playback"
+        data = {}
+        for name in self.stored_attrs:
+            data[name] = getattr(self, name)
+        with open(filename, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, filename):
+        "Load profile for further playback"
+        with open(filename, "rb") as f:
+            data = pickle.load(f)
+        for name, value in data.iteritems():
+            setattr(self, name, value)
+        self._needsupdate = True
+        return self # for chaining
+
+    def append(self, t, answered=False):
+        "Count call at time t (seconds since midnight or timestamp)"
+        i = int(t) % 86400 // self.bin_seconds
+        self._arrivals[i] += 1
+        if answered:
+            self._answered[i] += 1
+        self._needsupdate = True
+        return self # for chaining
+
+    def _update(self):
+        "Precompute lookup tables"
+        scale = 1 / (self.bin_seconds * max(1, self.days))
+        self._rates = array('d', [n * scale for n in self._arrivals])
+        self._p = array('d', [(a / n) if n else -1
+            for n, a in zip(self._arrivals, self._answered)])
+        self._needsupdate = False
+
+    def rate(self, t):
+        "Calls per second at time of day t (averaged by days)"
+        if self._needsupdate:
+            self._update()
+        return self._rates[int(t) % 86400 // self.bin_seconds]
+
+    def p_answer(self, t, default=0):
+        "Probability of answer at time of day t (default if no calls observed)"
+        if self._needsupdate:
+            self._update()
+        p = self._p[int(t) % 86400 // self.bin_seconds]
+        return default if p < 0 else p
+
+    @property
+    def label(self):
+        return self._label
+
+    @property
+    def bins(self):
+        return len(self._arrivals)
+
+    def __call__(self):
+        """
+        Rate profile for direct output
+        into pyplot charts: (times of bins, rates)
+        """
+        if self._needsupdate:
+            self._update()
+        return (tuple(i * self.bin_seconds for i in xrange(self.bins)), tuple(self._rates))
+
+    def __str__(self):
+        if self._needsupdate:
+            self._update()
+        return '{}: bins: {}, days: {}, peak rate: {}'.format(
+            self.label, self.bins, self.days, max(self._rates))
+
+    def __repr__(self):
+        return self.__str__()
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import unittest
 import dctr as dc
+import codec
 
 
 class TestSolver(unittest.TestCase):
@@ -88,6 +89,562 @@ class TestSolver(unittest.TestCase):
         self.assertEqual(prediction, e.idle_agents)
 
 
+class TestSolverCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = dc.SolverCache(max_entries=3, ttl=60, clock=lambda: self.now)
+
+    def test_quantized_keys_hit(self):
+        calls = []
+        def compute(agents, rate):
+            calls.append((agents, rate))
+            return agents * rate
+        key = lambda agents, rate: (dc.quantize_agents(agents), dc.quantize_rate(rate))
+        self.cache.lookup(key(10, 0.33341), compute, 10, 0.33341)
+        self.cache.lookup(key(10, 0.33338), compute, 10, 0.33338)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = self.cache
+        cache.put('a', 1).put('b', 2).put('c', 3)
+        cache.get('a')
+        cache.put('d', 4)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl(self):
+        self.cache.put('a', 1)
+        self.now = 59
+        self.assertEqual(self.cache.get('a'), 1)
+        self.now = 120
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_memory_cap(self):
+        cache = dc.SolverCache(max_entries=1000, max_bytes=2000)
+        for i in xrange(100):
+            cache.put(i, 'x' * 100)
+        self.assertTrue(cache.stats()['bytes'] <= 2000)
+        self.assertTrue(len(cache) < 100)
+
+    def test_solver_cached(self):
+        solver = dc.PIController(cache=self.cache)
+        self.assertEqual(solver.cached('k', lambda x: x + 1, 1), 2)
+        self.assertEqual(solver.cached('k', lambda x: x + 2, 1), 2)
+        self.assertEqual(dc.PIController().cached('k', lambda x: x + 2, 1), 3)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.e = dc.PIEnvironment(
+            idle_agents = 10,
+            calls_total = 1000,
+            calls_answered = 300,
+            calls_served = 295,
+            uptime = 1000,
+            interval = 300
+        )
+        self.solver = dc.PIController(self.e)
+
+    def test_hook_receives_record(self):
+        records = []
+        self.solver.add_hook(lambda solver, record: records.append(record))
+        prediction = self.solver.predict_outgoing_calls()
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record['branch'], dc.BRANCH_PREDICTIVE)
+        self.assertEqual(record['output'], prediction)
+        self.assertEqual(record['inputs']['idle_agents'], 10)
+        self.assertEqual(record['integrator'], self.solver.integrator)
+        self.assertTrue(record['P_value'] is not None)
+
+    def test_fallback_counters(self):
+        self.e.idle_agents = 1
+        self.solver.predict_outgoing_calls()
+        self.solver.predict_outgoing_calls()
+        self.e.idle_agents = 10
+        self.e.uptime = 0
+        self.solver.predict_outgoing_calls()
+        self.assertEqual(self.solver.fallbacks, {
+            dc.REASON_IDLE_AGENTS: 2,
+            dc.REASON_UPTIME: 1
+        })
+        self.assertEqual(self.solver.lasterror, dc.REASON_UPTIME)
+
+    def test_invalid_input_counted(self):
+        self.e.calls_answered = 2000
+        self.assertRaises(dc.ESolverError, self.solver.predict_outgoing_calls)
+        self.assertEqual(self.solver.fallbacks[dc.REASON_INVALID_INPUT], 1)
+
+    def test_profiler_sampling(self):
+        self.solver.profiler = dc.DecisionProfiler(sample_every=3)
+        for i in xrange(10):
+            self.solver.predict_outgoing_calls()
+        exported = self.solver.profiler.export()
+        self.assertEqual(exported['samples'], 3)
+        self.assertEqual(sum(exported['counts']), 3)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.e = dc.PIEnvironment(
+            idle_agents = 10,
+            calls_total = 1000,
+            calls_answered = 300,
+            calls_served = 300,
+            uptime = 1000,
+            interval = 300
+        )
+        self.solver = dc.PIController(self.e)
+
+    def test_anti_windup(self):
+        pipeline = dc.SolverPipeline(self.solver, [dc.AntiWindup(limit=0.05, max_adjust=120)])
+        for i in xrange(100):
+            pipeline.predict_outgoing_calls()
+        self.assertTrue(abs(self.solver.integrator) <= 0.05)
+        self.assertTrue(self.e.predict_adjust <= 120)
+
+    def test_anti_windup_same_tick(self):
+        # update of this decision overshoots limits (45 -> ~99):
+        self.e.predict_adjust, self.e.ctr_proportional_gain = 45, 2000
+        pipeline = dc.SolverPipeline(self.solver, [dc.AntiWindup(limit=0.01, max_adjust=50)])
+        self.assertEqual(pipeline.predict_outgoing_calls(), 21)
+        self.assertEqual(self.solver.integrator, 0.01)
+        self.assertEqual(self.e.predict_adjust, 50)
+        progressive = dc.SolverPipeline(dc.ProgressiveSolver(self.e), [dc.AntiWindup()])
+        self.assertEqual(progressive.predict_many([progressive.solver]), [10])
+
+    def test_anti_windup_recovers(self):
+        # long stretch over target abandon rate drives adjust down to the clamp:
+        pipeline = dc.SolverPipeline(self.solver, [dc.AntiWindup()])
+        self.e.ctr_integral_gain = 50
+        self.e.calls_total, self.e.calls_answered, self.e.calls_served = 3000, 1000, 972
+        for i in xrange(100):
+            pipeline.predict_outgoing_calls()
+        self.assertEqual(self.e.predict_adjust, 1)
+        # abandon rate recovered: controller stays predictive, adjust grows
+        self.e.calls_served = 1000
+        calls = [pipeline.predict_outgoing_calls() for i in xrange(20)]
+        self.assertEqual(self.solver.fallbacks, {})
+        self.assertTrue(self.e.predict_adjust > 1)
+        self.assertTrue(calls[-1] > calls[0])
+        # stage is detached after decision:
+        self.assertTrue(self.solver.windup is None)
+
+    def test_max_calls_per_tick(self):
+        pipeline = dc.SolverPipeline(self.solver, [dc.MaxCallsPerTick(15)])
+        self.assertEqual(pipeline.predict_outgoing_calls(), 15)
+
+    def test_trunk_capacity(self):
+        self.e.trunks_busy = 28
+        pipeline = dc.SolverPipeline(self.solver, [dc.TrunkCapacityCap(30)])
+        self.assertEqual(pipeline.predict_outgoing_calls(), 2)
+        self.e.trunks_busy = 40
+        self.assertEqual(pipeline.predict_outgoing_calls(), 0)
+
+    def test_slew_rate(self):
+        pipeline = dc.SolverPipeline(dc.ProgressiveSolver(self.e), [dc.SlewRateLimit(3)])
+        self.assertEqual(pipeline.predict_outgoing_calls(), 10)
+        self.e.idle_agents = 30
+        self.assertEqual(pipeline.predict_outgoing_calls(), 13)
+        self.e.idle_agents = 0
+        self.assertEqual(pipeline.predict_outgoing_calls(), 10)
+        stage = pipeline.stages[0]
+        del pipeline
+        self.assertEqual(stage._last, {})
+
+    def test_predict_many(self):
+        solvers = [dc.ProgressiveSolver(dc.PIEnvironment(idle_agents=n)) for n in (5, 50)]
+        pipeline = dc.SolverPipeline(solvers[0], [dc.MaxCallsPerTick(20)])
+        self.assertEqual(pipeline.predict_many(solvers), [5, 20])
+
+    def test_warm_state(self):
+        pipeline = dc.SolverPipeline(self.solver, [dc.AntiWindup()])
+        for i in xrange(10):
+            pipeline.predict_outgoing_calls()
+        state = pipeline.getstate()
+        e = dc.PIEnvironment(**dict((name, getattr(self.e, name)) for name in dc.PI_FIELDS))
+        forked = dc.SolverPipeline(dc.PIController(e), [dc.AntiWindup()]).setstate(state)
+        self.assertEqual(forked.predict_outgoing_calls(), pipeline.predict_outgoing_calls())
+        self.assertEqual(forked.solver.integrator, self.solver.integrator)
+
+
+class TestCongestion(unittest.TestCase):
+    def setUp(self):
+        self.e = dc.PIEnvironment(
+            idle_agents = 10,
+            calls_total = 1000,
+            calls_answered = 300,
+            calls_served = 295,
+            uptime = 1000,
+            interval = 300
+        )
+
+    def predict(self, calls_congested):
+        self.e.calls_congested = calls_congested
+        self.e.predict_adjust = 100.0
+        return dc.PIController(self.e).predict_outgoing_calls()
+
+    def test_backoff(self):
+        free = self.predict(0)
+        congested = self.predict(200)
+        self.assertTrue(congested < free)
+        self.assertEqual(congested, int(free * 0.8))
+
+    def test_full_congestion(self):
+        self.assertEqual(self.predict(1000), 0)
+
+    def test_progressive_backoff(self):
+        self.e.uptime = 10 # progressive (uptime below threshold)
+        self.assertEqual(self.predict(500), 5)
+
+    def test_windowed_congestion(self):
+        # counters are windowed: ratio of the window, no state between decisions
+        e = self.e
+        e.calls_congested = 500
+        solver = dc.PIController(e)
+        solver.predict_outgoing_calls()
+        e.calls_congested = 5
+        e.predict_adjust = 100.0
+        self.assertEqual(solver.predict_outgoing_calls(), self.predict(5))
+        self.assertEqual(self.predict(5), int(self.predict(0) * 0.995))
+
+    def test_optional_inputs(self):
+        e = dc.Environment(**dict((name, getattr(self.e, name))
+            for name in dc.PIController.required))
+        self.assertEqual(dc.PIController(e).predict_outgoing_calls(), self.predict(0))
+
+    def test_cli_optional(self):
+        import sys
+        argv = sys.argv
+        try:
+            sys.argv = ['dctr-cli.py', 'idle_agents=5', 'calls_total=10',
+                'calls_answered=5', 'calls_served=5', 'uptime=10', 'interval=1']
+            self.assertEqual(dc.CLIEnvironment().calls_congested, 0)
+            sys.argv.append('calls_congested=3')
+            self.assertEqual(dc.CLIEnvironment().calls_congested, 3)
+        finally:
+            sys.argv = argv
+
+
+class TestEnvironmentChanges(unittest.TestCase):
+    def test_changes_tracked(self):
+        e = dc.TrackedEnvironment(idle_agents=5)
+        self.assertTrue('idle_agents' in e.changes())
+        e.clearchanges()
+        e.idle_agents = 6
+        e.calls_total = 100
+        self.assertEqual(e.changes(), ['calls_total', 'idle_agents'])
+
+    def test_differential_extend(self):
+        source = dc.TrackedEnvironment(a=1, b=2).clearchanges()
+        target = dc.PIEnvironment()
+        source.b = 3
+        source.c = [1, 2] # not copied: complex type
+        target.extendfrom(source, changed_only=True)
+        self.assertEqual(target.b, 3)
+        self.assertFalse(hasattr(target, 'a'))
+        self.assertFalse(hasattr(target, 'c'))
+        self.assertEqual(source.changes(), [])
+
+    def test_overlay_solver(self):
+        base = dc.PIEnvironment(calls_total=1000, calls_answered=300,
+            calls_served=295, uptime=1000, interval=300)
+        tick = dc.OverlayEnvironment(base, idle_agents=10)
+        solver = dc.PIController(tick)
+        solver.predict_outgoing_calls()
+        # writes of solver go to overlay:
+        self.assertNotEqual(tick.predict_adjust, base.predict_adjust)
+        self.assertEqual(tick.changes(), ['idle_agents', 'predict_adjust'])
+        self.assertTrue('calls_total:1000' in tick.dump())
+
+    def test_overlay_requires_environment(self):
+        self.assertRaises(dc.EEnvironmentError, dc.OverlayEnvironment, object())
+
+    def test_differential_requires_tracking(self):
+        self.assertRaises(dc.EEnvironmentError,
+            dc.PIEnvironment().extendfrom, dc.Environment(), True)
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.request = {'idle_agents': 5, 'calls_total': 3000, 'calls_answered': 1000,
+            'calls_served': 990, 'uptime': 600, 'interval': 5}
+
+    def test_json_batch(self):
+        line = codec.encodejson([dict(self.request, campaign='c1'),
+            dict(self.request, campaign='c2', ctr_integral_gain=0.1)])
+        d = codec.Dispatcher()
+        replies = d.solve(codec.decodejson(line))
+        self.assertEqual([r[0] for r in replies], [u'c1', u'c2'])
+        self.assertTrue(all(r[2] is None for r in replies))
+        self.assertEqual(d.solvers['c1'].e.ctr_integral_gain, 0.05)
+        self.assertEqual(d.solvers['c2'].e.ctr_integral_gain, 0.1)
+
+    def test_binary_roundtrip(self):
+        requests = [dict(self.request, campaign=1), dict(self.request, campaign=2, idle_agents=0)]
+        decoded = codec.decodebinary(codec.encodebinary(requests))
+        self.assertEqual(decoded, [dict((k, float(v)) if k != 'campaign' else (k, v)
+            for k, v in r.items()) for r in requests])
+        replies = codec.Dispatcher().solve(decoded)
+        self.assertEqual(codec.decodebinaryreply(codec.encodebinaryreply(replies)), replies)
+
+    def test_validation(self):
+        self.assertRaises(dc.ESolverInputError, codec.validate, dict(self.request))
+        self.assertRaises(dc.ESolverInputError, codec.validate,
+            dict(self.request, campaign=1, unknown=1))
+        self.assertRaises(dc.ESolverInputError, codec.validate,
+            dict(self.request, campaign=1, idle_agents='5'))
+        self.assertRaises(dc.ESolverInputError, codec.decodebinary, codec.REQUEST_MAGIC)
+        self.assertRaises(dc.ESolverInputError, codec.decodejson, '{')
+
+    def test_serve_malformed(self):
+        import StringIO
+        good = codec.encodejson([dict(self.request, campaign='c1')])
+        out = StringIO.StringIO()
+        frames = codec.serve(StringIO.StringIO('{\n' + '[{"campaign": [1]}]\n' + good), out)
+        replies = [codec.decodejsonreply(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(frames, 3)
+        self.assertEqual([r[0][2] is None for r in replies], [False, False, True])
+        frame = codec.encodebinary([dict(self.request, campaign=1)])
+        out = StringIO.StringIO()
+        codec.serve(StringIO.StringIO('XXXXXX' + frame + frame[:-3]), out, 'binary')
+        data, replies = out.getvalue(), []
+        while data:
+            size = codec.HEADER.size + codec.HEADER.unpack_from(data)[1] * codec.REPLY_RECORD.size
+            replies.append(codec.decodebinaryreply(data[:size]))
+            data = data[size:]
+        self.assertEqual([r[0][2] for r in replies], ['error', None, 'error'])
+
+    def test_state_kept_per_campaign(self):
+        d = codec.Dispatcher()
+        d.solve([dict(self.request, campaign='c1')])
+        integrator = d.solvers['c1'].integrator
+        d.solve([dict(self.request, campaign='c1'), dict(self.request, campaign='c2')])
+        self.assertNotEqual(d.solvers['c1'].integrator, integrator)
+        self.assertEqual(d.solvers['c2'].integrator, integrator)
+
+    def test_cli_float(self):
+        import sys
+        argv = sys.argv
+        try:
+            sys.argv = ['dctr-cli.py', 'idle_agents=5', 'calls_total=10',
+                'calls_answered=3', 'calls_served=3', 'uptime=600', 'interval=0.5']
+            self.assertEqual(dc.CLIEnvironment().interval, 0.5)
+            sys.argv = sys.argv[:2]
+            self.assertRaises(dc.ECliError, dc.CLIEnvironment)
+            sys.argv = ['dctr-cli.py', 'idle_agents=x']
+            self.assertRaises(dc.ESolverInputError, dc.CLIEnvironment)
+        finally:
+            sys.argv = argv
+
+
+class TestStartup(unittest.TestCase):
+    def run_decide(self, *args):
+        import os, sys, subprocess
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dctr-decide.py')
+        process = subprocess.Popen([sys.executable, '-S', path] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        return process.returncode, out, err
+
+    def test_decision(self):
+        code, out, err = self.run_decide('idle_agents=5', 'calls_total=3000',
+            'calls_answered=1000', 'calls_served=990', 'uptime=600', 'interval=5')
+        self.assertEqual((code, out), (0, '15\n'))
+
+    def test_invalid_arguments(self):
+        self.assertEqual(self.run_decide('idle_agents=5')[0], 2)
+        self.assertEqual(self.run_decide('unknown=5')[0], 2)
+
+    def test_import_surface(self):
+        import sys, subprocess
+        out = subprocess.check_output([sys.executable, '-S', '-c',
+            'import sys, dctr; print sorted(set(["statistics", "numpy", "matplotlib", "numbers", "collections"]) & set(sys.modules))'])
+        self.assertEqual(out, '[]\n')
+
+    def test_schema(self):
+        self.assertEqual(dc.PI_FIELDS[:len(dc.PIController.required)], tuple(dc.PIController.required))
+        self.assertFalse(dc.PI_SCHEMA['calls_congested'])
+        self.assertTrue(dc.PI_SCHEMA['idle_agents'])
+        self.assertFalse(dc.PI_SCHEMA['ctr_integral_gain'])
+
+
+def _increment_shared(filename, n):
+    import sharedstate
+    state = sharedstate.SharedState(filename)
+    for i in xrange(n):
+        slot = state.acquire('c1')
+        integrator, adjust = state.load(slot) or (0.0, 0.0)
+        state.store(slot, integrator + 1, adjust).release(slot)
+    state.close()
+
+class TestSharedState(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.request = {'idle_agents': 5, 'calls_total': 3000, 'calls_answered': 1000,
+            'calls_served': 990, 'uptime': 600, 'interval': 5}
+        self.filename = tempfile.mktemp()
+
+    def tearDown(self):
+        import os
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def test_any_worker_serves_campaign(self):
+        import sharedstate
+        state = sharedstate.SharedState(self.filename, capacity=16)
+        workers = [codec.Dispatcher(state=state), codec.Dispatcher(state=state)]
+        sticky = codec.Dispatcher()
+        for i in xrange(6):
+            request = dict(self.request, campaign='c1', calls_served=990 - i)
+            if i % 3 == 0:
+                request['calls_congested'] = 300
+            self.assertEqual(workers[i % 2].solve([request]), sticky.solve([request]))
+        integrator, adjust, decisions = state.read('c1')[:3]
+        self.assertEqual(decisions, 6)
+        self.assertEqual(integrator, sticky.solvers['c1'].integrator)
+        self.assertEqual(adjust, sticky.solvers['c1'].e.predict_adjust)
+        state.close()
+
+    def test_concurrent_updates(self):
+        import multiprocessing, sharedstate
+        sharedstate.SharedState(self.filename, capacity=4).close()
+        processes = [multiprocessing.Process(target=_increment_shared, args=(self.filename, 200))
+            for i in xrange(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        state = sharedstate.SharedState(self.filename)
+        self.assertEqual(state.read('c1')[:3], (800.0, 0.0, 800))
+        state.close()
+
+    def test_bad_campaign_served(self):
+        import sharedstate, StringIO
+        state = sharedstate.SharedState(self.filename, capacity=4)
+        requests = [dict(self.request, campaign=campaign) for campaign in ('c1', 'c' * 40, 'c2')]
+        out = StringIO.StringIO()
+        codec.serve(StringIO.StringIO(''.join(codec.encodejson([r]) for r in requests)),
+            out, dispatcher=codec.Dispatcher(state=state))
+        replies = [codec.decodejsonreply(line)[0] for line in out.getvalue().splitlines()]
+        self.assertEqual([r[0] for r in replies], ['c1', 'c' * 40, 'c2'])
+        self.assertEqual([r[1] is None for r in replies], [False, True, False])
+        self.assertTrue('longer than' in replies[1][2])
+        self.assertEqual(sorted(state.campaigns()), ['c1', 'c2'])
+        state.close()
+
+    def test_limits(self):
+        import sharedstate
+        state = sharedstate.SharedState(self.filename, capacity=2)
+        state.release(state.acquire('c1')).release(state.acquire('c2'))
+        self.assertRaises(sharedstate.ESharedStateError, state.acquire, 'c3')
+        self.assertRaises(sharedstate.ESharedStateError, state.find, 'c' * 40)
+        self.assertEqual(sorted(state.campaigns()), ['c1', 'c2'])
+        state.close()
+        with open(self.filename, 'r+b') as f:
+            f.write('XXXX')
+        self.assertRaises(sharedstate.ESharedStateError, sharedstate.SharedState, self.filename)
+
+
+class TestLookAhead(unittest.TestCase):
+    def setUp(self):
+        self.e = dc.PIEnvironment(
+            idle_agents = 2,
+            calls_total = 1000,
+            calls_answered = 300,
+            calls_served = 295,
+            uptime = 1000,
+            interval = 300
+        )
+        self.hazard = dc.HazardTable.fromdurations(range(60, 181))
+
+    def predict(self, horizon, elapsed):
+        self.e.predict_adjust = 100.0
+        self.e.lookahead_horizon = horizon
+        self.e.talk_elapsed = elapsed
+        return dc.LookAheadController(self.e, hazard=self.hazard).predict_outgoing_calls()
+
+    def test_disabled(self):
+        self.e.predict_adjust = 100.0
+        self.assertEqual(self.predict(0, [170, 175, 178]),
+            dc.PIController(self.e).predict_outgoing_calls())
+
+    def test_dial_early(self):
+        # talks close to the longest duration end within horizon:
+        self.assertEqual(self.predict(30, [10, 20]), 0)
+        self.assertTrue(self.predict(30, [170, 175, 178]) > 0)
+
+    def test_wrapup(self):
+        # talks end within horizon, but wrap-up follows:
+        self.e.wrapup_time = 30
+        self.assertEqual(self.predict(30, [170, 175, 178]), 0)
+        self.e.wrapup_remaining = [10, 20, 25]
+        self.assertEqual(self.predict(30, []), self.predict(30, [170, 175, 178]))
+        self.assertTrue(self.predict(30, []) > 0)
+
+    def test_release(self):
+        h = self.hazard
+        self.assertEqual(h.release(0, 30), 0)
+        self.assertAlmostEqual(h.release(150, 10), 10 / 30.0)
+        self.assertEqual(h.release(1000, 1), 1.0)
+        model = dc.HazardTable.fromsurvival(lambda t: 2.0 ** (-t / 60.0))
+        self.assertAlmostEqual(model.release(600, 60), 0.5)
+
+
+class TestParseLog(unittest.TestCase):
+    def setUp(self):
+        import os, tempfile, bench
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'call_log.csv')
+        self.checkpoint = os.path.join(self.tmpdir, 'call_log.checkpoint')
+        bench.synthetic_log(self.filename, 3000)
+        with open(self.filename, 'rb') as f:
+            self.lines = f.readlines()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_incremental_equals_full(self):
+        import parse_log
+        checkpoint = parse_log.Checkpoint()
+        # log is growing, the last line is written partially:
+        for end in (200, 1201, 2500):
+            with open(self.filename, 'wb') as f:
+                f.writelines(self.lines[:end])
+                f.write(self.lines[end][:10])
+            parse_log.analyze(self.filename, checkpoint)
+            checkpoint.store(self.checkpoint)
+            checkpoint = parse_log.Checkpoint().load(self.checkpoint)
+        with open(self.filename, 'wb') as f:
+            f.writelines(self.lines)
+        summary, profiles = parse_log.analyze(self.filename, checkpoint)
+        full, full_profiles = parse_log.analyze(self.filename)
+        # model is refitted only when enough new durations are collected:
+        del summary['call_duration_model'], full['call_duration_model']
+        self.assertEqual(summary, full)
+        self.assertEqual(profiles['h_calls_profile']._values, full_profiles['h_calls_profile']._values)
+
+    def test_empty_log(self):
+        import parse_log
+        checkpoint = parse_log.Checkpoint()
+        # header only (e.g., just rotated), then single row:
+        for end in (1, 2):
+            with open(self.filename, 'wb') as f:
+                f.writelines(self.lines[:end])
+            summary, profiles = parse_log.analyze(self.filename, checkpoint)
+            self.assertEqual((summary['calls_total'], summary['call_rate']), (end - 1, 0))
+        self.assertEqual(summary['call_duration_model']['model'], None)
+        self.assertTrue(profiles['h_calls_profile'] is None)
+
+
 if __name__ == '__main__':
-    suite = unittest.TestLoader().loadTestsFromTestCase(TestSolver)
+    suite = unittest.TestSuite()
+    for case in (TestSolver, TestSolverCache, TestInstrumentation, TestPipeline,
+            TestCongestion, TestEnvironmentChanges, TestCodec, TestStartup, TestLookAhead,
+            TestSharedState, TestParseLog):
+        suite.addTest(unittest.TestLoader().loadTestsFromTestCase(case))
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,120 @@
+# fix division problem:
+from __future__ import division
+
+# Hierarchical timer wheel (Varghese & Lauck): timers are kept in
+# buckets of wheels with growing granularity, so scheduling and
+# cancellation cost O(1) regardless of number of pending timers;
+# timers of coarse wheels are cascaded into finer wheels when
+# their turn comes. Used for customer patience timeouts in
+# simulation (millions of pending abandonment timers).
+
+import math
+
+class ETimerWheelError(Exception):
+    "Invalid operation with timer wheel"
+    pass
+
+class TimerWheel(object):
+    """
+    Timers fire at the first .advance(now) with now not earlier
+    than their time rounded up to the tick.
+
+    >>> w = TimerWheel(tick=1.0, slots=4, levels=2)
+    >>> a = w.schedule(2.5, 'a')
+    >>> b = w.schedule(30, 'b') # beyond range of wheels
+    >>> c = w.schedule(7, 'c')
+    >>> w.cancel(c)
+    'c'
+    >>> w.advance(2), w.advance(3), len(w)
+    ([], ['a'], 1)
+    >>> w.advance(29), w.advance(30)
+    ([], ['b'])
+    """
+
+    def __init__(self, tick=1.0, slots=256, levels=4, now=0):
+        if slots < 2 or levels < 1:
+            raise ETimerWheelError('Timer wheel requires at least 2 slots and 1 level!')
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        # ticks covered by single slot of every level:
+        self._spans = [slots ** level for level in xrange(levels + 1)]
+        self._wheels = [[{} for i in xrange(slots)] for level in xrange(levels)]
+        # timers beyond range of the top wheel:
+        self._overflow = {}
+        self._current = int(math.floor(now / tick))
+        # handle -> bucket (dict handle -> (tick, payload)):
+        self._timers = {}
+        self._handles = 0
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _insert(self, handle, ticks, payload):
+        delta = ticks - self._current
+        spans = self._spans
+        for level in xrange(self.levels):
+            if delta < spans[level + 1]:
+                bucket = self._wheels[level][(ticks // spans[level]) % self.slots]
+                break
+        else:
+            bucket = self._overflow
+        bucket[handle] = (ticks, payload)
+        self._timers[handle] = bucket
+
+    def schedule(self, time, payload):
+        "Schedule timer, return handle for cancellation"
+        ticks = max(int(math.ceil(time / self.tick)), self._current + 1)
+        self._handles += 1
+        self._insert(self._handles, ticks, payload)
+        return self._handles
+
+    def cancel(self, handle):
+        "Cancel pending timer, return its payload"
+        try:
+            bucket = self._timers.pop(handle)
+        except KeyError:
+            raise ETimerWheelError('Timer {} is not pending!'.format(handle))
+        return bucket.pop(handle)[1]
+
+    def _cascade(self, bucket):
+        timers = bucket.items()
+        bucket.clear()
+        for handle, (ticks, payload) in timers:
+            self._insert(handle, ticks, payload)
+
+    def advance(self, now):
+        "Move time to now, return payloads of expired timers (in order of time and scheduling)"
+        target = int(math.floor(now / self.tick))
+        expired = []
+        if not self._timers:
+            self._current = max(self._current, target)
+            return expired
+        spans, slots, wheels = self._spans, self.slots, self._wheels
+        while self._current < target and self._timers:
+            self._current += 1
+            current = self._current
+            # cascade coarse wheels (top-down) at the start of their slots:
+            if current % spans[self.levels] == 0 and self._overflow:
+                self._cascade(self._overflow)
+            for level in xrange(self.levels - 1, 0, -1):
+                if current % spans[level] == 0:
+                    self._cascade(wheels[level][(current // spans[level]) % slots])
+            bucket = wheels[0][current % slots]
+            if bucket:
+                for handle, (ticks, payload) in sorted(bucket.items()):
+                    del self._timers[handle]
+                    expired.append(payload)
+                bucket.clear()
+        self._current = max(self._current, target)
+        return expired
+
+    def __str__(self):
+        return 'TimerWheel: pending: {}'.format(len(self._timers))
+
+    def __repr__(self):
+        return self.__str__()
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()